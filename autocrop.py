@@ -0,0 +1,126 @@
+"""Recorte automático según el contenido.
+
+Para una proporción dada se busca la ventana con más "energía" de bordes, que
+suele corresponder al sujeto: las zonas lisas (cielo, fondos, paredes) tienen poca.
+El cálculo se hace sobre una versión reducida de la imagen (unos cientos de
+píxeles de lado) y el resultado se lleva a la resolución completa.
+
+La suma de la energía en cada ventana se obtiene de una imagen integral (tabla de
+sumas acumuladas): cualquier rectángulo sale de cuatro lecturas, así que evaluar
+todas las posiciones posibles cuesta lo mismo que recorrer la imagen una vez.
+"""
+import numpy as np
+from PIL import Image, ImageFilter
+
+from image_processor import ImageProcessor
+from orientation import get_orientation, oriented_size
+from tracing import span
+
+# Lado mayor de la versión reducida sobre la que se busca
+PROXY_SIDE = 384
+# Tamaño de la ventana, respecto a la mayor que cabe, cuando la proporción es libre
+FREE_RATIO_SCALE = 0.8
+# Penalización por alejarse del centro, como fracción de la mejor puntuación:
+# desempata entre ventanas casi iguales (o en imágenes lisas) a favor del centro
+CENTER_WEIGHT = 0.05
+
+def make_proxy(image, side=PROXY_SIDE):
+    """Versión reducida de una imagen ya decodificada, con el lado mayor como mucho `side`."""
+    width, height = image.size
+    factor = max(width, height) // (side * 2)
+    proxy = image.reduce(factor) if factor > 1 else image
+    if max(proxy.size) > side:
+        proxy = proxy.resize(ImageProcessor.fit_size(proxy.size, side, side), Image.Resampling.BILINEAR)
+    return proxy
+
+def saliency_map(proxy):
+    """Energía de bordes (|dx| + |dy| del brillo, tras un ligero desenfoque) como array float32."""
+    gray = proxy.convert('L').filter(ImageFilter.BoxBlur(1))
+    values = np.asarray(gray, dtype=np.float32)
+    energy = np.zeros_like(values)
+    energy[:, 1:] += np.abs(np.diff(values, axis=1))
+    energy[1:, :] += np.abs(np.diff(values, axis=0))
+    return energy
+
+def integral_image(values):
+    """Tabla de sumas acumuladas con una fila y una columna de ceros delante."""
+    height, width = values.shape
+    table = np.zeros((height + 1, width + 1), dtype=np.float64)
+    table[1:, 1:] = values.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    return table
+
+def window_sums(table, window_width, window_height):
+    """Suma de cada ventana de ese tamaño, indexada por su esquina superior izquierda (fila, columna)."""
+    return (table[window_height:, window_width:] - table[:-window_height, window_width:]
+            - table[window_height:, :-window_width] + table[:-window_height, :-window_width])
+
+def window_size(size, ratio=None, scale=1.0):
+    """Mayor ventana con esa proporción que cabe en `size`, multiplicada por `scale`."""
+    width, height = size
+    ratio = ratio or width / height
+    if width / height > ratio:
+        window_width, window_height = height * ratio, height
+    else:
+        window_width, window_height = width, width / ratio
+    return (max(1, min(width, int(round(window_width * scale)))),
+            max(1, min(height, int(round(window_height * scale)))))
+
+def best_window(saliency, window_width, window_height):
+    """Esquina (x, y) de la ventana con más saliencia; entre casi empates, la más centrada."""
+    sums = window_sums(integral_image(saliency), window_width, window_height)
+    rows, cols = sums.shape
+    best = sums.max()
+    if best > 0 and (rows > 1 or cols > 1):
+        ys = (np.arange(rows) - (rows - 1) / 2) / max(rows - 1, 1)
+        xs = (np.arange(cols) - (cols - 1) / 2) / max(cols - 1, 1)
+        distance = np.sqrt(ys[:, None] ** 2 + xs[None, :] ** 2)
+        sums = sums - CENTER_WEIGHT * best * distance
+    elif best <= 0:
+        # Nothing stands out: centre the window
+        return (cols - 1) // 2, (rows - 1) // 2
+    y, x = np.unravel_index(np.argmax(sums), sums.shape)
+    return int(x), int(y)
+
+def suggest_box(image, ratio=None, full_size=None, scale=None):
+    """Propone una caja de recorte con la proporción `ratio` (None: la de la imagen).
+
+    `image` puede ser ya una versión reducida de la imagen (la vista previa, por
+    ejemplo); full_size es entonces el tamaño real, en cuyos píxeles se devuelve
+    la caja. `scale` es el tamaño de la ventana respecto a la mayor que cabe (por
+    defecto, entera con proporción fija y FREE_RATIO_SCALE con proporción libre).
+    """
+    full_size = full_size or image.size
+    if scale is None:
+        scale = 1.0 if ratio else FREE_RATIO_SCALE
+    full_width, full_height = full_size
+    window_width, window_height = window_size(full_size, ratio, scale)
+
+    with span("auto_crop", size=f"{full_width}x{full_height}", ratio=ratio) as s:
+        proxy = make_proxy(image)
+        saliency = saliency_map(proxy)
+        # The window in proxy pixels: same fraction of the image as at full size
+        factor_x, factor_y = proxy.size[0] / full_width, proxy.size[1] / full_height
+        proxy_width = max(1, min(proxy.size[0], int(round(window_width * factor_x))))
+        proxy_height = max(1, min(proxy.size[1], int(round(window_height * factor_y))))
+        x, y = best_window(saliency, proxy_width, proxy_height)
+
+        # Map the window centre back and place the exact full-size window around it
+        center_x = (x + proxy_width / 2) / factor_x
+        center_y = (y + proxy_height / 2) / factor_y
+        left = max(0, min(full_width - window_width, int(round(center_x - window_width / 2))))
+        top = max(0, min(full_height - window_height, int(round(center_y - window_height / 2))))
+        box = (left, top, left + window_width, top + window_height)
+        s.set(box=list(box), proxy=f"{proxy.size[0]}x{proxy.size[1]}")
+    return box
+
+def suggest_box_for_file(file_path, ratio=None, full_size=None, scale=None):
+    """Como suggest_box, pero decodificando el archivo directamente a tamaño reducido.
+
+    La caja es de la imagen orientada según EXIF, como la vista previa; full_size
+    debe ser también el tamaño orientado.
+    """
+    proxy, _ = ImageProcessor.open_preview(file_path, PROXY_SIDE, PROXY_SIDE)
+    if full_size is None:
+        with Image.open(file_path) as image:
+            full_size = oriented_size(image.size, get_orientation(image))
+    return suggest_box(proxy, ratio, full_size, scale)
@@ -0,0 +1,478 @@
+"""Recorte por lotes sin interfaz gráfica.
+
+Ejemplo:
+    python batch.py fotos/ -o recortes/ --box 100,100,900,700 --shape circular --workers 8
+
+Con --rendition se guardan varias versiones de cada recorte (ver export.py)
+decodificando y recortando cada original una sola vez:
+    python batch.py fotos/ -o web/ --rendition 2048:jpeg --rendition 256:png --rendition avatar=512:png:circular
+
+Con --memory-budget el lote se ajusta a un límite de memoria total: cada imagen
+se recorta con la estrategia más barata que cabe (ver memory.py) y solo se
+envían a los procesos los bloques cuya memoria estimada cabe junto a los que ya
+están en marcha.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import autocrop
+import export
+import memory
+import tracing
+from image_processor import ImageProcessor
+from masks import DEFAULT_SUPERSAMPLE, needs_mask
+from orientation import get_orientation, oriented_size
+from trim import TRIM_TOLERANCE
+from utils import extension_for, get_file_format, is_image_file, list_image_files, parse_ratio
+
+SHAPES = ["rectangular", "cuadrado", "circular", "elipse", "redondeado", "poligono"]
+
+def make_spec(box=None, shape="rectangular", ratio=None, file_format=None, quality=95,
+              lossless=False, snap_to_mcu=True, antialias=True, radius=0, points=None, memory_budget=None,
+              renditions=None, auto_crop=False, trim=None):
+    """Construye la especificación de recorte que se envía a cada proceso."""
+    return {
+        'box': tuple(box) if box else None,
+        'shape': shape,
+        'ratio': ratio,
+        'format': file_format,
+        'quality': quality,
+        'lossless': lossless,
+        'snap_to_mcu': snap_to_mcu,
+        'supersample': DEFAULT_SUPERSAMPLE if antialias else 1,
+        'radius': radius,
+        'points': tuple(tuple(p) for p in points) if points else None,
+        'memory_budget': memory_budget,
+        'renditions': tuple(renditions) if renditions else None,
+        'auto_crop': auto_crop,
+        'trim': trim,
+    }
+
+def iter_input_files(inputs, recursive=False):
+    """Recorre archivos y directorios de entrada devolviendo pares (ruta, nombre de salida) de forma perezosa.
+
+    El nombre de salida es la ruta relativa al directorio de entrada, de modo que
+    con `recursive` cada subcarpeta se recrea bajo el directorio de salida.
+    """
+    for path in inputs:
+        if os.path.isdir(path):
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    for name in sorted(filenames):
+                        if is_image_file(name):
+                            file_path = os.path.join(dirpath, name)
+                            yield file_path, os.path.relpath(file_path, path)
+            else:
+                for file_path in list_image_files(path):
+                    yield file_path, os.path.basename(file_path)
+        else:
+            yield path, os.path.basename(path)
+
+def resolve_box(spec, image_size, bounds=None):
+    """Calcula la caja de recorte final para una imagen según la especificación.
+
+    `bounds` sustituye a la imagen completa como caja por defecto (p. ej. el
+    contenido sin márgenes con spec['trim']).
+    """
+    width, height = image_size
+    box = spec['box'] or bounds or (0, 0, width, height)
+    if spec['shape'] == "poligono" and spec.get('points') and not spec['box']:
+        # Without an explicit box, a polygon is cropped to its own bounds
+        xs = [x for x, _ in spec['points']]
+        ys = [y for _, y in spec['points']]
+        box = (min(xs), min(ys), max(xs), max(ys))
+
+    # Clamp to the image bounds
+    x1, y1, x2, y2 = box
+    x1, x2 = sorted((max(0, min(x1, width)), max(0, min(x2, width))))
+    y1, y2 = sorted((max(0, min(y1, height)), max(0, min(y2, height))))
+    if x2 - x1 < 1 or y2 - y1 < 1:
+        raise ValueError(f"La caja de recorte {box} queda fuera de la imagen ({width}x{height})")
+
+    return ImageProcessor.fit_ratio((x1, y1, x2, y2), resolve_ratio(spec))
+
+def resolve_ratio(spec):
+    """Proporción del recorte (None: libre). Las formas cuadrada y circular fuerzan 1:1, como en la interfaz."""
+    return 1.0 if spec['shape'] in ["cuadrado", "circular"] else parse_ratio(spec['ratio'])
+
+def resolve_shape(spec, box):
+    """Devuelve la forma que se pasa a crop_image para una caja ya resuelta."""
+    if spec['shape'] == "redondeado":
+        return ("redondeado", spec.get('radius', 0))
+    if spec['shape'] == "poligono" and spec.get('points'):
+        # Polygon points are given in image pixels; masks want them relative to the box
+        return ("poligono", tuple((x - box[0], y - box[1]) for x, y in spec['points']))
+    return spec['shape']
+
+def normalize_format(file_format):
+    """Normaliza un formato de salida ("jpg" -> "JPEG"); None si no se fuerza ninguno."""
+    file_format = file_format.upper() if file_format else None
+    return 'JPEG' if file_format == 'JPG' else file_format
+
+def output_path_for(file_path, output_dir, file_format=None, name=None):
+    """Devuelve la ruta de salida para un archivo, cambiando la extensión si se fuerza un formato.
+
+    `name` (por defecto, el nombre del archivo) puede incluir subcarpetas.
+    """
+    name = name or os.path.basename(file_path)
+    if file_format:
+        name = os.path.splitext(name)[0] + extension_for(file_format)
+    return os.path.join(output_dir, name)
+
+def output_paths_for(file_path, output_dir, spec, name=None):
+    """Rutas que escribe process_file para un archivo: la del recorte o, con versiones, una por versión."""
+    name = name or os.path.basename(file_path)
+    renditions = spec.get('renditions')
+    if not renditions:
+        return [output_path_for(file_path, output_dir, spec['format'], name)]
+    file_format = spec['format'] or get_file_format(file_path)[0]
+    base_path = os.path.join(output_dir, name)
+    return [export.rendition_path(base_path, r, r.file_format or file_format) for r in renditions]
+
+def numbered_name(name, counter):
+    """El nombre con -1, -2... antes de la extensión."""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}-{counter}{ext}"
+
+def output_key(name, spec):
+    """Clave con la que dos nombres de salida chocan: sin extensión si esta no la da el nombre."""
+    if spec['format'] or spec.get('renditions'):
+        # a.jpg and a.png both become a.png (or a-256.png, ...)
+        name = os.path.splitext(name)[0]
+    return os.path.normcase(name)
+
+def file_budget(spec):
+    """Memoria disponible para una sola imagen dentro del presupuesto del lote (None: sin límite)."""
+    budget = spec.get('memory_budget')
+    return max(0, budget - memory.WORKER_OVERHEAD) if budget else None
+
+def estimate_file_memory(file_path, spec):
+    """Memoria estimada para recortar un archivo con la estrategia normal (0 si no se puede abrir)."""
+    try:
+        file_format = spec['format'] or get_file_format(file_path)[0]
+        with ImageProcessor.open_image(file_path) as image:
+            exif_orientation = get_orientation(image)
+            box = resolve_box(spec, oriented_size(image.size, exif_orientation))
+            return memory.plan_crop(image, box, resolve_shape(spec, box), save_format=file_format,
+                                    exif_orientation=exif_orientation).peak
+    except Exception:
+        # The worker reports the error; it needs no memory worth reserving
+        return 0
+
+def process_file(file_path, spec, output_dir, name=None):
+    """Abre, recorta y guarda un archivo como `name` (por defecto, su nombre) en output_dir.
+
+    Devuelve (ruta, error, megapíxeles procesados, memoria estimada en bytes).
+    """
+    with tracing.span("process_file", path=os.path.basename(file_path)) as s:
+        result = _process_file(file_path, spec, output_dir, name or os.path.basename(file_path))
+        if result[1]:
+            s.set(error=result[1])
+    return result
+
+def _process_file(file_path, spec, output_dir, name):
+    try:
+        file_format = spec['format'] or get_file_format(file_path)[0]
+        save_path = output_path_for(file_path, output_dir, spec['format'], name)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        with ImageProcessor.open_image(file_path) as image:
+            # Boxes are given in the upright image, as any viewer shows it
+            metadata = ImageProcessor.read_metadata(image)
+            exif_orientation = metadata.orientation
+            size = oriented_size(image.size, exif_orientation)
+            if spec.get('auto_crop'):
+                box = autocrop.suggest_box_for_file(file_path, resolve_ratio(spec), size)
+            elif spec.get('trim') is not None:
+                box = resolve_box(spec, size, ImageProcessor.find_trim_box(image, spec['trim'], exif_orientation))
+            else:
+                box = resolve_box(spec, size)
+            
+            # Rectangular JPEG crops can skip the decode/encode round trip
+            crop_shape = resolve_shape(spec, box)
+            renditions = spec.get('renditions')
+            if spec.get('lossless') and not renditions and not needs_mask(crop_shape) \
+                    and file_format == 'JPEG' and image.format == 'JPEG':
+                lossless_box = ImageProcessor.save_crop_lossless(
+                    file_path, box, save_path, spec.get('snap_to_mcu', True), exif_orientation, image.size
+                )
+                if lossless_box:
+                    x1, y1, x2, y2 = lossless_box
+                    return file_path, None, (x2 - x1) * (y2 - y1) / 1e6, 0
+            
+            # Renditions apply the shape at each output size, after resizing
+            full_shape = "rectangular" if renditions else crop_shape
+            with tracing.span("plan_memory") as s:
+                plan = memory.plan_crop(image, box, full_shape, file_budget(spec), file_format,
+                                        exif_orientation)
+                s.set(**memory.stage_args(plan), band_rows=plan.band_rows, cache_mask=plan.cache_mask,
+                      region_only=plan.region_only)
+            cropped = ImageProcessor.crop_image(image, box, full_shape, spec.get('supersample', 1),
+                                                plan.band_rows, plan.cache_mask, exif_orientation,
+                                                plan.region_only)
+        if renditions:
+            export.save_renditions(cropped, renditions, os.path.join(output_dir, name),
+                                   crop_shape, file_format, spec['quality'], spec.get('supersample', 1),
+                                   metadata=metadata)
+        else:
+            ImageProcessor.save_image(cropped, save_path, file_format, spec['quality'], metadata)
+        width, height = cropped.size
+        return file_path, None, width * height / 1e6, plan.peak
+    except Exception as e:
+        # A broken file must never take the rest of the chunk down with it
+        return file_path, f"{type(e).__name__}: {e}", 0.0, 0
+
+def process_chunk(files, spec, output_dir):
+    """Procesa un bloque de pares (ruta, nombre de salida) dentro de un proceso trabajador.
+
+    Devuelve los resultados y los eventos de traza del bloque (vacíos si no se traza).
+    """
+    if spec.get('trace'):
+        tracing.enable()
+    results = [process_file(path, spec, output_dir, name) for path, name in files]
+    return results, tracing.drain()
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _unique_names(files, spec, renamed):
+    """Da a cada archivo un nombre de salida que no choque con el de otro del lote.
+
+    Acepta rutas o pares (ruta, nombre de salida); los que chocan reciben -1, -2...
+    y se anotan en `renamed` como (ruta, nombres que se escriben), con un nombre
+    por versión si el lote tiene versiones.
+    """
+    taken = set()
+    for item in files:
+        path, name = (item, os.path.basename(item)) if isinstance(item, str) else item
+        unique = name
+        counter = 1
+        while output_key(unique, spec) in taken:
+            unique = numbered_name(name, counter)
+            counter += 1
+        taken.add(output_key(unique, spec))
+        if unique != name:
+            renamed.append((path, ", ".join(output_paths_for(path, "", spec, unique))))
+        yield path, unique
+
+def run_batch(files, spec, output_dir, workers=None, chunk_size=16, on_result=None):
+    """Recorta todos los archivos en paralelo y devuelve un resumen del lote.
+
+    `files` son rutas o pares (ruta, nombre de salida) como los de iter_input_files.
+    Si dos archivos irían a la misma salida, el segundo recibe un sufijo -1, -2...
+    y queda anotado en summary['renamed'].
+
+    Los archivos se envían en bloques de `chunk_size` y nunca hay más de dos
+    bloques por proceso en vuelo, de modo que la memoria del proceso principal
+    no crece con el número de archivos. Con spec['memory_budget'] cada bloque
+    reserva la memoria de su imagen más cara más la de un proceso, y solo se
+    envía cuando cabe junto a los que están en marcha (uno solo se envía siempre).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    budget = spec.get('memory_budget')
+    if budget:
+        workers = max(1, min(workers, budget // memory.WORKER_OVERHEAD))
+    max_in_flight = workers * 2
+    if tracing.is_enabled():
+        spec = dict(spec, trace=True)
+
+    summary = {'processed': 0, 'failed': 0, 'megapixels': 0.0, 'errors': [], 'renamed': [],
+               'peak_bytes': 0, 'peak_file': None}
+    start = time.perf_counter()
+
+    def collect(future):
+        results, events = future.result()
+        tracing.add_events(events)
+        for path, error, megapixels, peak_bytes in results:
+            if error:
+                summary['failed'] += 1
+                summary['errors'].append((path, error))
+            else:
+                summary['processed'] += 1
+                summary['megapixels'] += megapixels
+                if peak_bytes > summary['peak_bytes']:
+                    summary['peak_bytes'], summary['peak_file'] = peak_bytes, path
+            if on_result:
+                on_result(path, error)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        reserved = {}
+        for chunk in _chunks(_unique_names(files, spec, summary['renamed']), chunk_size):
+            reserve = 0
+            if budget:
+                # Formats without region reads reserve their whole decoded image, so fewer of
+                # them run at once; one that only fits alone reserves the whole budget
+                estimate = max(estimate_file_memory(path, spec) for path, _ in chunk)
+                reserve = min(budget, memory.WORKER_OVERHEAD + estimate)
+            while pending and (len(pending) >= max_in_flight
+                               or budget and sum(reserved.values()) + reserve > budget):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    reserved.pop(future, None)
+                    collect(future)
+            future = executor.submit(process_chunk, chunk, spec, output_dir)
+            reserved[future] = reserve
+            pending.add(future)
+
+        for future in pending:
+            future.result()
+            collect(future)
+
+    elapsed = time.perf_counter() - start
+    total = summary['processed'] + summary['failed']
+    summary['elapsed'] = elapsed
+    summary['files_per_second'] = total / elapsed if elapsed > 0 else 0.0
+    summary['megapixels_per_second'] = summary['megapixels'] / elapsed if elapsed > 0 else 0.0
+    return summary
+
+def format_summary(summary):
+    """Formatea el resumen de rendimiento de un lote."""
+    text = (
+        f"Procesadas: {summary['processed']}  Fallidas: {summary['failed']}  "
+        f"Tiempo: {summary['elapsed']:.2f} s  "
+        f"({summary['files_per_second']:.1f} imágenes/s, {summary['megapixels_per_second']:.1f} MP/s)"
+    )
+    if summary.get('peak_bytes'):
+        text += (f"\nMemoria estimada máxima por imagen: {memory.format_bytes(summary['peak_bytes'])} "
+                 f"({os.path.basename(summary['peak_file'])})")
+    return text
+
+def parse_box(value):
+    """Convierte "x1,y1,x2,y2" en una tupla de enteros."""
+    try:
+        box = tuple(int(v) for v in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Caja no válida: {value}")
+    if len(box) != 4:
+        raise argparse.ArgumentTypeError("La caja debe tener el formato x1,y1,x2,y2")
+    return box
+
+def parse_points(value):
+    """Convierte "x1,y1 x2,y2 x3,y3 ..." en una tupla de puntos."""
+    try:
+        points = tuple(tuple(float(v) for v in pair.split(',')) for pair in value.split())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Puntos no válidos: {value}")
+    if len(points) < 3 or any(len(p) != 2 for p in points):
+        raise argparse.ArgumentTypeError('Los puntos deben tener el formato "x1,y1 x2,y2 x3,y3 ..." (al menos tres)')
+    return points
+
+def parse_memory_budget(value):
+    """Convierte un tamaño como "2G" o "512M" en bytes para --memory-budget."""
+    try:
+        budget = memory.parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    if budget < memory.WORKER_OVERHEAD:
+        raise argparse.ArgumentTypeError(
+            f"El presupuesto debe ser de al menos {memory.format_bytes(memory.WORKER_OVERHEAD)}"
+        )
+    return budget
+
+def parse_rendition(value):
+    """Convierte una versión como "2048:jpeg" o "avatar=512:png:circular" para --rendition."""
+    try:
+        return export.parse_rendition(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Recorta imágenes por lotes usando todos los núcleos.")
+    parser.add_argument("inputs", nargs="+", help="Archivos o directorios de entrada")
+    parser.add_argument("-o", "--output", required=True, help="Directorio de salida")
+    parser.add_argument("--box", type=parse_box, help="Caja de recorte x1,y1,x2,y2 (por defecto, la imagen completa)")
+    parser.add_argument("--shape", choices=SHAPES, default="rectangular", help="Forma de recorte")
+    parser.add_argument("--radius", type=float, default=0,
+                        help="Radio de las esquinas en píxeles, con --shape redondeado")
+    parser.add_argument("--points", type=parse_points,
+                        help='Vértices en píxeles de la imagen, con --shape poligono: "x1,y1 x2,y2 x3,y3 ..."')
+    parser.add_argument("--ratio", default="libre", help="Proporción, p. ej. 1:1, 4:3, 16:9 (por defecto, libre)")
+    parser.add_argument("--auto-crop", action="store_true",
+                        help="Elige en cada imagen la zona con más detalle, con la proporción de --ratio o --shape")
+    parser.add_argument("--trim", action="store_true", help="Quita los márgenes uniformes (del color de las esquinas)")
+    parser.add_argument("--trim-tolerance", type=int, default=TRIM_TOLERANCE, metavar="N",
+                        help=f"Con --trim, diferencia por canal (0-255) que aún cuenta como margen (por defecto {TRIM_TOLERANCE})")
+    parser.add_argument("--format", dest="file_format", help="Formato de salida (por defecto, el original)")
+    parser.add_argument("--quality", type=int, default=95, help="Calidad JPEG/WebP")
+    parser.add_argument("--lossless", action="store_true",
+                        help="Recorta los JPEG rectangulares sin recodificar (requiere jpegtran)")
+    parser.add_argument("--no-snap", dest="snap_to_mcu", action="store_false",
+                        help="Con --lossless, no desplaza la caja a la rejilla de 8/16 px; recodifica si no está alineada")
+    parser.add_argument("--no-antialias", dest="antialias", action="store_false",
+                        help="No suaviza el borde de las formas")
+    parser.add_argument("--rendition", dest="renditions", action="append", type=parse_rendition,
+                        metavar="[NOMBRE=]TAMAÑO[:FORMATO][:FORMA][:qCALIDAD]",
+                        help="Guarda el recorte en varias versiones en lugar de una; se repite por versión "
+                             "(p. ej. 2048:jpeg, 256:png, avatar=512:png:circular; orig conserva el tamaño)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Recorre los subdirectorios")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Archivos por tarea enviada a cada proceso")
+    parser.add_argument("--memory-budget", type=parse_memory_budget, metavar="TAMAÑO",
+                        help="Memoria máxima del lote, p. ej. 2G o 512M: reduce el paralelismo y "
+                             "usa estrategias más baratas en lugar de quedarse sin memoria")
+    parser.add_argument("--trace", metavar="ARCHIVO",
+                        help="Guarda una traza de tiempos para chrome://tracing o Perfetto "
+                             f"(también con la variable {tracing.TRACE_ENV})")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.ratio != "libre" and parse_ratio(args.ratio) is None:
+        print(f"Proporción no válida: {args.ratio}", file=sys.stderr)
+        return 2
+
+    if args.shape == "poligono" and not args.points:
+        print("--shape poligono necesita --points", file=sys.stderr)
+        return 2
+
+    if args.auto_crop and (args.box or args.shape == "poligono"):
+        print("--auto-crop no se puede combinar con --box ni con --shape poligono", file=sys.stderr)
+        return 2
+
+    if args.trim and (args.box or args.auto_crop or args.shape == "poligono"):
+        print("--trim no se puede combinar con --box, --auto-crop ni --shape poligono", file=sys.stderr)
+        return 2
+
+    file_format = normalize_format(args.file_format)
+    trace_path = args.trace or os.environ.get(tracing.TRACE_ENV)
+    if trace_path:
+        # No path for tracing itself: the trace is saved once, below, even if the batch fails
+        tracing.enable()
+
+    spec = make_spec(args.box, args.shape, args.ratio, file_format, args.quality,
+                     args.lossless, args.snap_to_mcu, args.antialias, args.radius, args.points,
+                     args.memory_budget, args.renditions, args.auto_crop,
+                     args.trim_tolerance if args.trim else None)
+
+    try:
+        summary = run_batch(
+            iter_input_files(args.inputs, args.recursive), spec, args.output,
+            workers=args.workers, chunk_size=args.chunk_size
+        )
+    finally:
+        if trace_path:
+            tracing.save(trace_path)
+
+    for path, name in summary['renamed']:
+        print(f"{path} se guarda como {name}: otro archivo del lote ya usa su nombre de salida", file=sys.stderr)
+    for path, error in summary['errors']:
+        print(f"Error en {path}: {error}", file=sys.stderr)
+    print(format_summary(summary))
+    if trace_path:
+        print(f"Traza guardada en {trace_path}")
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Banco de pruebas de rendimiento de ImageProcessor.
+
+Genera imágenes sintéticas (tamaños de 1 a 200 MP, modos RGB, RGBA, L y P, formatos
+JPEG, PNG, WebP, TIFF y BMP), mide el tiempo y el pico de memoria de open_image,
+resize_to_fit, crop_image y save_image, y guarda los resultados en un JSON que
+sirve de referencia para comparar después.
+
+Ejemplo:
+    python benchmark.py run -o base.json --sizes 1,12
+    (actualizar Pillow)
+    python benchmark.py run -o nuevo.json --sizes 1,12
+    python benchmark.py compare base.json nuevo.json --threshold 0.10
+
+Cada medición se hace en un proceso nuevo, así que el pico de memoria
+(VmHWM en Linux, ru_maxrss en otros sistemas) corresponde solo a esa operación.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import PIL
+from PIL import Image
+
+from image_processor import ImageProcessor
+
+SIZES = [1, 12, 50, 200]
+MODES = ["RGB", "RGBA", "L", "P"]
+FORMATS = ["JPEG", "PNG", "WEBP", "TIFF", "BMP"]
+OPERATIONS = ["open_image", "resize_to_fit", "crop_image", "crop_image_circular", "save_image"]
+
+# Modes each format can store without converting
+FORMAT_MODES = {
+    "JPEG": {"RGB", "L"},
+    "PNG": {"RGB", "RGBA", "L", "P"},
+    "WEBP": {"RGB", "RGBA"},
+    "TIFF": {"RGB", "RGBA", "L", "P"},
+    "BMP": {"RGB", "RGBA", "L", "P"},
+}
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "TIFF": ".tif", "BMP": ".bmp"}
+# WebP cannot store images with a side longer than this
+WEBP_MAX_SIDE = 16383
+
+PREVIEW_SIZE = (1920, 1080)
+
+def synthetic_size(megapixels):
+    """Tamaño 3:2 con aproximadamente los megapíxeles pedidos."""
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    return int(height * 1.5), height
+
+def make_synthetic(megapixels, mode):
+    """Crea una imagen con degradados y ruido, que se comprime como una foto y no como un color plano."""
+    width, height = synthetic_size(megapixels)
+
+    # Smooth texture: small noise upscaled, plus gradients in each channel
+    texture = Image.effect_noise((max(1, width // 16), max(1, height // 16)), 64)
+    texture = texture.resize((width, height), Image.Resampling.BILINEAR)
+    horizontal = Image.linear_gradient("L").rotate(90).resize((width, height))
+    vertical = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (texture, horizontal, vertical))
+
+    if mode == "RGBA":
+        image.putalpha(vertical)
+    elif mode == "L":
+        image = texture
+    elif mode == "P":
+        image = image.convert("P", palette=Image.Palette.WEB, dither=Image.Dither.NONE)
+    return image
+
+def input_path(workdir, megapixels, mode, file_format):
+    return os.path.join(workdir, f"sintetica_{megapixels}mp_{mode}{EXTENSIONS[file_format]}")
+
+def prepare_inputs(workdir, sizes, modes, formats):
+    """Genera (o reutiliza) los archivos de entrada y devuelve los casos que se pueden medir."""
+    os.makedirs(workdir, exist_ok=True)
+    cases = []
+    for megapixels in sizes:
+        for mode in modes:
+            image = None
+            for file_format in formats:
+                if mode not in FORMAT_MODES[file_format]:
+                    continue
+                if file_format == "WEBP" and max(synthetic_size(megapixels)) > WEBP_MAX_SIDE:
+                    continue
+                path = input_path(workdir, megapixels, mode, file_format)
+                if not os.path.exists(path):
+                    if image is None:
+                        image = make_synthetic(megapixels, mode)
+                    ImageProcessor.save_image(image, path, file_format)
+                cases.append({"megapixels": megapixels, "mode": mode, "format": file_format, "path": path})
+    return cases
+
+def _rss_mb():
+    """Memoria residente actual del proceso en MB (None si no se puede leer)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _reset_peak():
+    """Reinicia el pico de memoria del proceso donde se puede (Linux), que si no hereda el del padre."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_mb():
+    """Pico de memoria residente del proceso en MB (None si no se puede leer)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def measure(task):
+    """Mide una operación sobre un caso. Se ejecuta en un proceso propio."""
+    operation = task["operation"]
+    path = task["path"]
+    repeat = task["repeat"]
+    output = os.path.join(task["workdir"], "salida" + EXTENSIONS[task["format"]])
+
+    # Everything except open_image works on an already decoded image
+    image = None
+    if operation != "open_image":
+        image = ImageProcessor.open_image(path)
+        image.load()
+    width, height = synthetic_size(task["megapixels"])
+    box = (width // 4, height // 4, width * 3 // 4, height * 3 // 4)
+
+    def run():
+        if operation == "open_image":
+            with ImageProcessor.open_image(path) as opened:
+                opened.load()
+        elif operation == "resize_to_fit":
+            ImageProcessor.resize_to_fit(image, *PREVIEW_SIZE)
+        elif operation == "crop_image":
+            ImageProcessor.crop_image(image, box)
+        elif operation == "crop_image_circular":
+            ImageProcessor.crop_image(image, box, "circular")
+        elif operation == "save_image":
+            ImageProcessor.save_image(image, output, task["format"])
+
+    _reset_peak()
+    rss_before = _rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    peak = _peak_mb()
+
+    if os.path.exists(output):
+        os.remove(output)
+    return {
+        "seconds": min(times),
+        "median": statistics.median(times),
+        "peak_mb": peak,
+        "delta_mb": peak - rss_before if peak is not None and rss_before is not None else None,
+    }
+
+def case_id(operation, case):
+    return f"{operation}/{case['format']}/{case['mode']}/{case['megapixels']}MP"
+
+def run_benchmark(sizes, modes, formats, operations, repeat=3, workdir=None, on_result=None):
+    """Ejecuta el banco de pruebas y devuelve el documento JSON con los resultados."""
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "recorta-benchmark")
+    cases = prepare_inputs(workdir, sizes, modes, formats)
+
+    results = []
+    for case in cases:
+        for operation in operations:
+            task = dict(case, operation=operation, repeat=repeat, workdir=workdir)
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_measure", json.dumps(task)],
+                capture_output=True, text=True
+            )
+            result = {
+                "id": case_id(operation, case),
+                "operation": operation,
+                "format": case["format"],
+                "mode": case["mode"],
+                "megapixels": case["megapixels"],
+            }
+            if completed.returncode == 0:
+                result.update(json.loads(completed.stdout))
+            else:
+                result["error"] = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "error"
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare(baseline, current, threshold=0.10, memory_threshold=None, min_delta=0.005):
+    """Compara dos resultados y devuelve (filas, regresiones).
+
+    Una operación empeora si tarda más de (1 + threshold) veces lo que tardaba y
+    al menos min_delta segundos más, o si su pico de memoria crece más de
+    memory_threshold (por defecto, el mismo umbral).
+    """
+    if memory_threshold is None:
+        memory_threshold = threshold
+    previous = {r["id"]: r for r in baseline["results"]}
+
+    rows = []
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(result["id"])
+        if old is None or "seconds" not in old or "seconds" not in result:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] > 0 else 1.0
+        slower = ratio > 1 + threshold and result["seconds"] - old["seconds"] >= min_delta
+
+        memory_ratio = None
+        # Deltas of a few MB are allocator noise, not a trend
+        if old.get("delta_mb") and result.get("delta_mb") is not None and old["delta_mb"] >= 8:
+            memory_ratio = result["delta_mb"] / old["delta_mb"]
+        heavier = memory_ratio is not None and memory_ratio > 1 + memory_threshold
+
+        row = (result["id"], old["seconds"], result["seconds"], ratio, memory_ratio, slower or heavier)
+        rows.append(row)
+        if slower or heavier:
+            regressions.append(row)
+    return rows, regressions
+
+def format_row(row):
+    case, old_seconds, new_seconds, ratio, memory_ratio, regressed = row
+    memory = f"  memoria x{memory_ratio:.2f}" if memory_ratio is not None else ""
+    mark = "  <-- REGRESIÓN" if regressed else ""
+    return f"{case:45s} {old_seconds * 1000:9.1f} ms -> {new_seconds * 1000:9.1f} ms  x{ratio:.2f}{memory}{mark}"
+
+def _parse_list(value, cast=str):
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Mide el rendimiento de ImageProcessor.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Ejecuta el banco de pruebas y guarda los resultados")
+    run_parser.add_argument("-o", "--output", required=True, help="Archivo JSON de resultados")
+    run_parser.add_argument("--sizes", type=lambda v: _parse_list(v, int), default=SIZES,
+                            help="Megapíxeles separados por comas (por defecto, 1,12,50,200)")
+    run_parser.add_argument("--modes", type=_parse_list, default=MODES, help="Modos, p. ej. RGB,RGBA,L,P")
+    run_parser.add_argument("--formats", type=lambda v: _parse_list(v.upper()), default=FORMATS,
+                            help="Formatos, p. ej. JPEG,PNG,WEBP,TIFF,BMP")
+    run_parser.add_argument("--operations", type=_parse_list, default=OPERATIONS,
+                            help="Operaciones: " + ",".join(OPERATIONS))
+    run_parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por medición (se toma la mejor)")
+    run_parser.add_argument("--workdir", help="Directorio para las imágenes sintéticas (se reutilizan)")
+
+    compare_parser = commands.add_parser("compare", help="Compara unos resultados con otros de referencia")
+    compare_parser.add_argument("baseline", help="JSON de referencia")
+    compare_parser.add_argument("current", help="JSON nuevo")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="Empeoramiento de tiempo tolerado (0.10 = 10 %%)")
+    compare_parser.add_argument("--memory-threshold", type=float, default=None,
+                                help="Aumento de memoria tolerado (por defecto, el mismo que --threshold)")
+    compare_parser.add_argument("--min-delta", type=float, default=0.005,
+                                help="Diferencia mínima en segundos para considerar una regresión")
+
+    measure_parser = commands.add_parser("_measure")
+    measure_parser.add_argument("task")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "_measure":
+        print(json.dumps(measure(json.loads(args.task))))
+        return 0
+
+    if args.command == "run":
+        unknown = [op for op in args.operations if op not in OPERATIONS]
+        if unknown:
+            print(f"Operaciones desconocidas: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+
+        def report(result):
+            if "error" in result:
+                print(f"{result['id']:45s} error: {result['error']}", file=sys.stderr)
+            else:
+                peak = f"  pico {result['peak_mb']:.0f} MB" if result.get("peak_mb") is not None else ""
+                print(f"{result['id']:45s} {result['seconds'] * 1000:9.1f} ms{peak}")
+
+        document = run_benchmark(args.sizes, args.modes, args.formats, args.operations,
+                                 args.repeat, args.workdir, on_result=report)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows, regressions = compare(baseline, current, args.threshold, args.memory_threshold, args.min_delta)
+    for row in rows:
+        print(format_row(row))
+    print(f"{len(regressions)} regresiones de {len(rows)} mediciones")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+from image_processor import ImageProcessor
+from masks import needs_mask
+from orientation import orient, oriented_size
+
+# Un recorte con su caja en coordenadas de la imagen original
+CropOperation = namedtuple("CropOperation", ["box", "shape"])
+
+class CropChain:
+    """Edición no destructiva: una secuencia de recortes sobre la imagen original.
+
+    Cada recorte se guarda en coordenadas de la imagen original, así que la cadena
+    se resuelve siempre en un único recorte de la original (más las máscaras de las
+    formas) en lugar de encadenar copias de imágenes intermedias.
+
+    Con exif_orientation las cajas son de la imagen orientada, tal como se ve; al
+    materializar la cadena solo se gira el recorte (ver ImageProcessor.crop_region).
+    """
+
+    def __init__(self, source, operations=(), supersample=1, exif_orientation=1):
+        self.source = source
+        self.operations = list(operations)
+        self.supersample = supersample  # Suavizado del borde de las máscaras
+        self.exif_orientation = exif_orientation
+
+    @property
+    def box(self):
+        """Caja de la imagen actual en coordenadas de la imagen original (orientada)."""
+        if self.operations:
+            return self.operations[-1].box
+        width, height = oriented_size(self.source.size, self.exif_orientation)
+        return (0, 0, width, height)
+
+    @property
+    def size(self):
+        """Tamaño de la imagen actual."""
+        x1, y1, x2, y2 = self.box
+        return (x2 - x1, y2 - y1)
+
+    @property
+    def is_rectangular(self):
+        """Indica si ningún recorte de la cadena aplica una máscara."""
+        return not any(needs_mask(op.shape) for op in self.operations)
+
+    def push(self, crop_coords, crop_shape="rectangular"):
+        """Añade un recorte expresado en coordenadas de la imagen actual."""
+        left, top, right, bottom = self.box
+        x1, y1, x2, y2 = crop_coords
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+
+        # Translate to source coordinates, never leaving the current image
+        box = (
+            max(left, min(left + x1, right)),
+            max(top, min(top + y1, bottom)),
+            max(left, min(left + x2, right)),
+            max(top, min(top + y2, bottom)),
+        )
+        self.operations.append(CropOperation(box, crop_shape))
+        return box
+
+    def render(self):
+        """Materializa la imagen actual con un solo recorte de la original."""
+        if not self.operations:
+            return orient(self.source, self.exif_orientation)
+
+        box = self.box
+        result = ImageProcessor.crop_image(self.source, box, self.operations[-1].shape, self.supersample,
+                                           exif_orientation=self.exif_orientation)
+
+        # Masks from earlier crops still clip the result, relative to the final box
+        for op in self.operations[:-1]:
+            if needs_mask(op.shape):
+                bounds = (op.box[0] - box[0], op.box[1] - box[1],
+                          op.box[2] - box[0], op.box[3] - box[1])
+                result = ImageProcessor.apply_shape(result, op.shape, bounds, self.supersample)
+        return result
@@ -0,0 +1,149 @@
+"""Varias versiones (renditions) de un mismo recorte a partir de una sola decodificación.
+
+Ejemplo: un JPEG de 2048 px, un WebP de 1024 px, una miniatura PNG de 256 px y un
+avatar circular de 512 px salen de decodificar y recortar el original una sola vez.
+Los tamaños se calculan en cascada, de mayor a menor, y cada nivel se obtiene del
+anterior en lugar del original, así que cada reducción trabaja con menos píxeles.
+Las formas se aplican al tamaño final, y las codificaciones, que en Pillow liberan
+el GIL, se hacen en paralelo en hilos mientras se calculan los niveles siguientes.
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import masks
+from image_processor import ImageProcessor
+from tracing import span
+from utils import extension_for
+
+# Formas que recortan la caja a 1:1
+SQUARE_SHAPES = ("cuadrado", "circular")
+# Formas que puede pedir una versión (las que no necesitan parámetros)
+RENDITION_SHAPES = ("rectangular", "cuadrado", "circular", "elipse")
+
+_FORMATS = {'JPG': 'JPEG', 'JPEG': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP', 'TIFF': 'TIFF', 'TIF': 'TIFF',
+            'BMP': 'BMP', 'GIF': 'GIF'}
+
+# name: sufijo del archivo; max_size: lado mayor en píxeles (None: tamaño del recorte);
+# file_format: None para el del original; shape: None para la del recorte; quality: None para la general
+Rendition = namedtuple('Rendition', ['name', 'max_size', 'file_format', 'shape', 'quality'])
+
+def parse_rendition(value):
+    """Convierte "[nombre=]TAMAÑO[:FORMATO][:FORMA][:qCALIDAD]" en una Rendition.
+
+    Por ejemplo "2048:jpeg", "1024:webp:q80" o "avatar=512:png:circular". El
+    tamaño es el lado mayor en píxeles ("orig" para no reducir), y el nombre por
+    defecto es el tamaño (más la forma, si tiene).
+    """
+    name, _, spec = value.rpartition('=')
+    parts = spec.split(':')
+    size = parts[0].strip().lower()
+    if size in ('orig', 'original'):
+        max_size = None
+    elif size.isdigit() and int(size) > 0:
+        max_size = int(size)
+    else:
+        raise ValueError(f"Tamaño no válido en {value}: {parts[0]}")
+
+    file_format = shape = quality = None
+    for part in parts[1:]:
+        part = part.strip()
+        if part.upper() in _FORMATS:
+            file_format = _FORMATS[part.upper()]
+        elif part.lower() in RENDITION_SHAPES:
+            shape = part.lower()
+        elif part[:1].lower() == 'q' and part[1:].isdigit():
+            quality = int(part[1:])
+        else:
+            raise ValueError(f"Opción desconocida en {value}: {part}")
+
+    if not name:
+        name = size if shape is None else f"{size}-{shape}"
+    return Rendition(name, max_size, file_format, shape, quality)
+
+def rendition_scale(crop_size, rendition, crop_shape="rectangular"):
+    """Factor (<= 1) al que hay que reducir el recorte para una versión."""
+    if rendition.max_size is None:
+        return 1.0
+    width, height = crop_size
+    shape = rendition.shape or crop_shape
+    # A square rendition is cut from the middle of the crop: its side is the short one
+    side = min(width, height) if masks.shape_name(shape) in SQUARE_SHAPES else max(width, height)
+    return min(1.0, rendition.max_size / side)
+
+def scaled_size(crop_size, scale):
+    width, height = crop_size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def cascade(image, sizes):
+    """Genera (tamaño, imagen) de mayor a menor, calculando cada nivel a partir del anterior."""
+    current = image
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        if size != current.size:
+            with span("resize_level", source=f"{current.size[0]}x{current.size[1]}", target=f"{size[0]}x{size[1]}"):
+                current = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        yield size, current
+
+def rendition_path(base_path, rendition, file_format):
+    """Ruta de una versión: el nombre base con el sufijo de la versión y la extensión de su formato."""
+    stem = os.path.splitext(base_path)[0]
+    return f"{stem}-{rendition.name}{extension_for(file_format)}"
+
+def finish_rendition(level, rendition, crop_shape="rectangular", scale=1.0, supersample=1):
+    """Aplica a un nivel de la cascada el recorte 1:1 y la máscara de la versión."""
+    shape = rendition.shape or crop_shape
+    if rendition.shape is None:
+        # The crop's own shape was given for the full-size crop
+        shape = masks.scale_shape(shape, scale)
+    image = level
+    if masks.shape_name(shape) in SQUARE_SHAPES:
+        box = ImageProcessor.fit_ratio((0, 0) + level.size, 1.0)
+        if box != (0, 0) + level.size:
+            image = level.crop(box)
+    if masks.needs_mask(shape):
+        if image is level:
+            # Levels are shared with smaller renditions; masks are written in place
+            image = level.copy()
+        image = ImageProcessor.apply_shape(image, shape, supersample=supersample)
+    return image
+
+def save_renditions(crop, renditions, base_path, crop_shape="rectangular", file_format=None,
+                    quality=95, supersample=1, workers=None, metadata=None):
+    """Guarda todas las versiones de un recorte ya hecho (sin forma aplicada).
+
+    Las formas de las versiones, y la del recorte para las que no indican una, se
+    aplican al tamaño final. Todas llevan el EXIF y el perfil ICC de `metadata`.
+    Devuelve las rutas guardadas, en el orden de `renditions`.
+    """
+    if crop.mode in ('1', 'P'):
+        # Pillow resizes these with nearest neighbour only
+        crop = crop.convert('RGBA' if masks.has_alpha(crop) else 'RGB')
+    scales = [rendition_scale(crop.size, r, crop_shape) for r in renditions]
+    by_size = {}
+    for index, scale in enumerate(scales):
+        by_size.setdefault(scaled_size(crop.size, scale), []).append(index)
+
+    paths = [None] * len(renditions)
+    futures = []
+    workers = workers or min(len(renditions), os.cpu_count() or 1)
+    with span("save_renditions", image=crop, renditions=len(renditions)), \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="codificacion") as executor:
+        for size, level in cascade(crop, by_size):
+            for index in by_size[size]:
+                rendition = renditions[index]
+                output_format = rendition.file_format or file_format
+                image = finish_rendition(level, rendition, crop_shape, scales[index], supersample)
+                if output_format == 'JPEG' and image.mode not in ('RGB', 'RGBA', 'L', 'CMYK'):
+                    # save_image flattens RGBA; other modes JPEG can't hold are converted first
+                    image = image.convert('RGBA' if masks.has_alpha(image) else 'RGB')
+                paths[index] = rendition_path(base_path, rendition, output_format)
+                futures.append(executor.submit(
+                    ImageProcessor.save_image, image, paths[index], output_format, rendition.quality or quality,
+                    metadata
+                ))
+        # Surface the first encoding error, if any
+        for future in futures:
+            future.result()
+    return paths
@@ -0,0 +1,271 @@
+"""Tira de miniaturas de las imágenes de una carpeta.
+
+La tira está virtualizada: solo las miniaturas que caben en pantalla existen como
+elementos del lienzo y PhotoImage, así que abrir una carpeta de 20.000 imágenes
+cuesta lo mismo que listarla. Las miniaturas se generan en un grupo de procesos,
+decodificando a tamaño reducido (thumbnail() usa el escalado DCT de los JPEG),
+primero las visibles y después las cercanas; van apareciendo según terminan. Las
+que salen de la zona visible antes de empezar se cancelan. Las ya generadas se
+guardan en la caché de vistas previas en disco y, en memoria, en una LRU limitada
+por bytes.
+"""
+import multiprocessing
+import os
+import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageTk
+
+from orientation import get_orientation, orient
+from preview_cache import PreviewCache, file_key
+from tile_pyramid import TileCache
+from tracing import span
+from utils import list_image_files
+
+THUMB_SIZE = 96
+# Ancho de cada hueco de la tira (miniatura y margen)
+SLOT_SIZE = THUMB_SIZE + 8
+# Memoria máxima de las miniaturas decodificadas que se guardan fuera de pantalla
+THUMB_CACHE_BYTES = 32 * 1024 * 1024
+# Huecos a cada lado de la zona visible cuyas miniaturas se piden por adelantado
+PREFETCH_SLOTS = 24
+
+_cache = None
+
+def make_thumbnail(file_path, size=THUMB_SIZE):
+    """Miniatura RGB o RGBA de un archivo, de la caché en disco o decodificada a tamaño reducido.
+
+    Se ejecuta en los procesos del grupo; devuelve None si el archivo no se puede leer.
+    """
+    global _cache
+    if _cache is None:
+        _cache = PreviewCache()
+    name = f"thumb-{size}"
+    with span("make_thumbnail", path=os.path.basename(file_path)) as s:
+        try:
+            key = file_key(file_path)
+            thumb = _cache.get(key, name)
+            s.set(cached=thumb is not None)
+            if thumb is not None:
+                return thumb
+            with Image.open(file_path) as image:
+                exif_orientation = get_orientation(image)
+                alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+                if image.mode in ("P", "1"):
+                    # Pillow resizes these with nearest neighbour only
+                    image = image.convert("RGBA" if alpha else "RGB")
+                # thumbnail() drafts JPEGs to the smallest DCT scale above the target first
+                image.thumbnail((size, size), Image.Resampling.BILINEAR)
+                thumb = orient(image.convert("RGBA" if alpha else "RGB"), exif_orientation)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return None
+        _cache.put(key, name, thumb)
+    return thumb
+
+def _new_executor(workers):
+    # The UI already runs other threads: forking from it could copy a held lock
+    # into the children, so the workers come from a fork server where available
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+class Filmstrip:
+    """Tira horizontal con las miniaturas de una carpeta; al pulsar una se llama a on_select(ruta).
+
+    `post(callback, *args)` debe ejecutar la llamada en el hilo de Tk (las
+    miniaturas terminan en hilos del grupo de procesos).
+    """
+
+    def __init__(self, parent, post, on_select, workers=None):
+        self.post = post
+        self.on_select = on_select
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.executor = None
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=SLOT_SIZE, bg="#e0e0e0", highlightthickness=0,
+                                xscrollincrement=SLOT_SIZE)
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self._on_scrollbar)
+        self.canvas.configure(xscrollcommand=self._on_scroll)
+        self.canvas.pack(side=tk.TOP, fill=tk.X)
+        self.scrollbar.pack(side=tk.TOP, fill=tk.X)
+
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Configure>", lambda event: self.refresh())
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+
+        self.paths = []
+        self.indices = {}  # ruta absoluta -> índice en paths
+        self.current = None  # Índice de la imagen abierta
+        self.generation = 0  # Cada carpeta nueva invalida las miniaturas pendientes de la anterior
+        self.thumbnails = TileCache(THUMB_CACHE_BYTES)  # índice -> imagen PIL
+        self.failed = set()  # Índices que no se pudieron leer
+        self.pending = {}  # índice -> Future
+        self.slots = {}  # índice visible -> (marco, imagen del lienzo o None, PhotoImage o None)
+
+    def set_folder(self, directory, selected_path=None):
+        """Muestra las imágenes de una carpeta, marcando y centrando selected_path."""
+        with span("filmstrip_set_folder") as s:
+            paths = list_image_files(os.path.abspath(directory))
+            s.set(files=len(paths))
+        self._cancel_pending()
+        self.generation += 1
+        self.paths = paths
+        self.indices = {path: index for index, path in enumerate(paths)}
+        self.thumbnails.clear()
+        self.failed.clear()
+        self.canvas.delete("all")
+        self.slots = {}
+        self.canvas.configure(scrollregion=(0, 0, len(paths) * SLOT_SIZE, SLOT_SIZE))
+        if not self.frame.winfo_manager():
+            self.frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+        self.current = None
+        self.set_current(selected_path)
+
+    def set_current(self, file_path):
+        """Marca la imagen abierta y desplaza la tira hasta ella si no se ve."""
+        index = self.index_of(file_path)
+        if index is None:
+            self.current = None
+            self.refresh()
+            return
+        previous, self.current = self.current, index
+        for i in (previous, index):
+            if i in self.slots:
+                self._style_slot(i)
+        first, last = self.visible_range()
+        if not first <= index < last:
+            # Centre the current thumbnail
+            width = max(1, self.canvas.winfo_width())
+            left = index * SLOT_SIZE + SLOT_SIZE / 2 - width / 2
+            self.canvas.xview_moveto(max(0.0, left / max(1, len(self.paths) * SLOT_SIZE)))
+        self.refresh()
+
+    def index_of(self, file_path):
+        return self.indices.get(os.path.abspath(file_path)) if file_path else None
+
+    def visible_range(self):
+        """Índices [primero, último) de los huecos que se ven ahora en la tira."""
+        left = self.canvas.canvasx(0)
+        width = max(1, self.canvas.winfo_width())
+        first = max(0, int(left // SLOT_SIZE))
+        last = min(len(self.paths), int((left + width) // SLOT_SIZE) + 1)
+        return first, last
+
+    def refresh(self):
+        """Crea los elementos de los huecos visibles, borra los demás y pide las miniaturas que faltan."""
+        if not self.paths:
+            return
+        first, last = self.visible_range()
+        for index in [i for i in self.slots if not first <= i < last]:
+            frame, item, _ = self.slots.pop(index)
+            self.canvas.delete(frame)
+            if item:
+                self.canvas.delete(item)
+        for index in range(first, last):
+            if index not in self.slots:
+                x = index * SLOT_SIZE
+                frame = self.canvas.create_rectangle(x + 2, 2, x + SLOT_SIZE - 2, SLOT_SIZE - 2, width=2)
+                self.slots[index] = (frame, None, None)
+                self._style_slot(index)
+                self._show_thumbnail(index)
+        self._request(first, last)
+
+    def _style_slot(self, index):
+        frame = self.slots[index][0]
+        if index == self.current:
+            self.canvas.itemconfigure(frame, outline="#1e6fd9", fill="#cfe0f7")
+        else:
+            self.canvas.itemconfigure(frame, outline="#c8c8c8", fill="#d8d8d8")
+
+    def _show_thumbnail(self, index):
+        """Instancia la PhotoImage de un hueco visible si su miniatura ya está generada."""
+        thumb = self.thumbnails.get(index)
+        frame, item, photo = self.slots[index]
+        if thumb is None or item is not None:
+            return
+        photo = ImageTk.PhotoImage(thumb)
+        x = index * SLOT_SIZE + SLOT_SIZE / 2
+        item = self.canvas.create_image(x, SLOT_SIZE / 2, image=photo)
+        self.slots[index] = (frame, item, photo)
+
+    def _request(self, first, last):
+        """Pide las miniaturas de la zona visible y de sus alrededores, de dentro hacia fuera."""
+        start = max(0, first - PREFETCH_SLOTS)
+        end = min(len(self.paths), last + PREFETCH_SLOTS)
+
+        # Whatever scrolled out of the wanted range and hasn't started is dropped
+        for index in [i for i in self.pending if not start <= i < end]:
+            if self.pending[index].cancel():
+                del self.pending[index]
+
+        center = (first + last) / 2
+        wanted = sorted(
+            (i for i in range(start, end)
+             if i not in self.pending and i not in self.failed and i not in self.thumbnails),
+            key=lambda i: (not first <= i < last, abs(i - center))
+        )
+        # A few per worker in flight keeps them busy without queueing the whole folder
+        room = self.workers * 4 - len(self.pending)
+        if room <= 0 or not wanted:
+            return
+        if self.executor is None:
+            self.executor = _new_executor(self.workers)
+        generation = self.generation
+        for index in wanted[:room]:
+            future = self.executor.submit(make_thumbnail, self.paths[index])
+            self.pending[index] = future
+            future.add_done_callback(
+                lambda f, index=index: self.post(self._on_thumbnail, generation, index, f)
+            )
+
+    def _on_thumbnail(self, generation, index, future):
+        if generation != self.generation:
+            return
+        if self.pending.get(index) is future:
+            del self.pending[index]
+        if future.cancelled():
+            return
+        try:
+            thumb = future.result()
+        except Exception:
+            # A worker that died takes its thumbnail with it; the rest go on
+            thumb = None
+        if thumb is None:
+            self.failed.add(index)
+        else:
+            self.thumbnails.put(index, thumb, thumb.width * thumb.height * len(thumb.getbands()))
+            if index in self.slots:
+                self._show_thumbnail(index)
+        # Keep the workers fed with whatever is still missing around the view
+        self._request(*self.visible_range())
+
+    def _cancel_pending(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def _on_scrollbar(self, *args):
+        self.canvas.xview(*args)
+
+    def _on_wheel(self, event):
+        step = -1 if event.num == 4 or getattr(event, "delta", 0) > 0 else 1
+        self.canvas.xview_scroll(step * 3, "units")
+
+    def _on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // SLOT_SIZE)
+        if 0 <= index < len(self.paths):
+            self.on_select(self.paths[index])
+
+    def close(self):
+        """Detiene el grupo de procesos sin esperar a las miniaturas pendientes."""
+        self._cancel_pending()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+
+from utils import image_nbytes
+
+class HistoryState:
+    """Un estado del historial: los recortes aplicados y las opciones elegidas.
+
+    La imagen resultante es opcional; si no está (o se ha expulsado por memoria)
+    se vuelve a calcular desde la imagen original al volver a este estado.
+    """
+
+    __slots__ = ("operations", "shape", "ratio", "image")
+
+    def __init__(self, operations, shape, ratio, image=None):
+        self.operations = tuple(operations)
+        self.shape = shape
+        self.ratio = ratio
+        self.image = image
+
+    def same_as(self, other):
+        return (self.operations, self.shape, self.ratio) == (other.operations, other.shape, other.ratio)
+
+class CropHistory:
+    """Historial de deshacer/rehacer para recortes, formas y proporciones.
+
+    Guarda operaciones, no mapas de bits. Las imágenes ya calculadas se conservan
+    mientras quepan en `max_bytes`; al superarlo se liberan primero las que se
+    materializaron hace más tiempo, nunca la del estado actual.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._states = []
+        self._index = -1
+        self._materialized = OrderedDict()  # id(state) -> state, oldest first
+
+    @property
+    def current(self):
+        return self._states[self._index] if self._states else None
+
+    def can_undo(self):
+        return self._index > 0
+
+    def can_redo(self):
+        return self._index < len(self._states) - 1
+
+    def clear(self):
+        self._states = []
+        self._index = -1
+        self._materialized.clear()
+        self.current_bytes = 0
+
+    def record(self, operations, shape, ratio, image=None):
+        """Añade un estado nuevo tras el actual, descartando lo que se pudiera rehacer."""
+        state = HistoryState(operations, shape, ratio)
+        if self.current and state.same_as(self.current):
+            return self.current
+
+        for dropped in self._states[self._index + 1:]:
+            self._forget_image(dropped)
+        del self._states[self._index + 1:]
+
+        self._states.append(state)
+        self._index += 1
+        if image is not None:
+            self._store_image(state, image)
+        return state
+
+    def undo(self):
+        """Retrocede un estado y lo devuelve (o None si no hay nada que deshacer)."""
+        if not self.can_undo():
+            return None
+        self._index -= 1
+        return self.current
+
+    def redo(self):
+        """Avanza un estado y lo devuelve (o None si no hay nada que rehacer)."""
+        if not self.can_redo():
+            return None
+        self._index += 1
+        return self.current
+
+    def materialize(self, state, render):
+        """Devuelve la imagen de un estado, calculándola con `render()` si no está guardada."""
+        if state.image is None:
+            self._store_image(state, render())
+        else:
+            self._materialized.move_to_end(id(state))
+        return state.image
+
+    def _store_image(self, state, image):
+        self._forget_image(state)
+        state.image = image
+        self._materialized[id(state)] = state
+        self.current_bytes += image_nbytes(image)
+        self._enforce_budget()
+
+    def _forget_image(self, state):
+        if self._materialized.pop(id(state), None) is not None:
+            self.current_bytes -= image_nbytes(state.image)
+        state.image = None
+
+    def _enforce_budget(self):
+        current = self.current
+        for state in list(self._materialized.values()):
+            if self.current_bytes <= self.max_bytes:
+                break
+            if state is not current:
+                self._forget_image(state)
@@ -1,10 +1,49 @@
-from PIL import Image, ImageDraw
+import os
+
+from PIL import Image, ImageFile
+
+import jpeg_lossless
+import masks
+import memory
+import orientation
+import rawcrop
+import tiff_region
+import trim
+from tracing import span
+from utils import atomic_write
+
+# Formatos en los que save_image conserva el EXIF y el perfil ICC del original
+EXIF_FORMATS = ('JPEG', 'PNG', 'WEBP')
+ICC_FORMATS = ('JPEG', 'PNG', 'WEBP', 'TIFF')
+
+class _Cancelled(Exception):
+    pass
+
+class _ReadProgress:
+    """Archivo que avisa cada `every` bytes leídos, para los formatos que Pillow decodifica leyendo él mismo."""
+    
+    def __init__(self, f, on_read, every):
+        self.f = f
+        self.on_read = on_read
+        self.every = every
+        self.pending = 0
+    
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.pending += len(data)
+        if self.pending >= self.every:
+            self.pending = 0
+            self.on_read(self.f.tell())
+        return data
+    
+    def __getattr__(self, name):
+        return getattr(self.f, name)
 
 class ImageProcessor:
     @staticmethod
-    def resize_to_fit(image, target_width, target_height):
-        """Redimensiona una imagen para que quepa en las dimensiones objetivo manteniendo la proporción."""
-        img_width, img_height = image.size
+    def fit_size(image_size, target_width, target_height):
+        """Calcula el tamaño con el que una imagen cabe en las dimensiones objetivo manteniendo la proporción."""
+        img_width, img_height = image_size
         aspect_ratio = img_width / img_height
         
         if img_width > img_height:
@@ -20,56 +59,332 @@ class ImageProcessor:
                 new_width = target_width
                 new_height = int(new_width / aspect_ratio)
         
-        resized_image = image.copy()
-        resized_image.thumbnail((new_width, new_height), Image.Resampling.LANCZOS)
-        return resized_image, (new_width, new_height)
+        return max(1, new_width), max(1, new_height)
+    
+    @staticmethod
+    def resize_to_fit(image, target_width, target_height, exif_orientation=1):
+        """Redimensiona una imagen para que quepa en las dimensiones objetivo manteniendo la proporción.
+        
+        Con exif_orientation se devuelve ya orientada (girando solo la versión reducida).
+        """
+        raw_target = orientation.oriented_size((target_width, target_height), exif_orientation)
+        new_width, new_height = ImageProcessor.fit_size(image.size, *raw_target)
+        
+        with span("resize_to_fit", image=image, target=f"{new_width}x{new_height}"):
+            with span("copy"):
+                resized_image = image.copy()
+            with span("thumbnail_lanczos"):
+                resized_image.thumbnail((new_width, new_height), Image.Resampling.LANCZOS)
+            resized_image = orientation.orient(resized_image, exif_orientation)
+        return resized_image, orientation.oriented_size((new_width, new_height), exif_orientation)
+    
+    @staticmethod
+    def quick_preview(image, target_width, target_height, exif_orientation=1):
+        """Vista previa rápida (reduce y bilineal) del mismo tamaño que daría resize_to_fit.
+        
+        Sirve para mostrar algo mientras se decodifica: no copia la imagen entera.
+        """
+        raw_target = orientation.oriented_size((target_width, target_height), exif_orientation)
+        new_size = ImageProcessor.fit_size(image.size, *raw_target)
+        with span("quick_preview", image=image, target=f"{new_size[0]}x{new_size[1]}"):
+            factor = min(image.width // new_size[0], image.height // new_size[1])
+            if image.mode in ('1', 'P') or factor < 2:
+                # Palette images can't be averaged; nearest neighbour is enough for a first look
+                preview = image.resize(new_size, Image.Resampling.NEAREST)
+            else:
+                preview = image.reduce(factor).resize(new_size, Image.Resampling.BILINEAR)
+        return orientation.orient(preview, exif_orientation)
     
     @staticmethod
-    def crop_image(image, crop_coords, crop_shape="rectangular"):
-        """Recorta una imagen según las coordenadas y forma especificadas."""
+    def open_preview(file_path, target_width, target_height):
+        """Abre una imagen directamente al tamaño de visualización, sin decodificarla a resolución completa.
+        
+        Con JPEG se usa el escalado DCT del decodificador (1/2, 1/4 o 1/8) y solo se
+        remuestrea el resto. El tamaño devuelto es exactamente el que daría resize_to_fit,
+        así que las coordenadas de la vista previa se siguen convirtiendo con precisión
+        a las de la imagen original. La vista previa se devuelve orientada según EXIF.
+        """
+        with span("open_preview", path=os.path.basename(file_path)) as s, Image.open(file_path) as image:
+            s.set_image(image)
+            exif_orientation = orientation.get_orientation(image)
+            raw_target = orientation.oriented_size((target_width, target_height), exif_orientation)
+            new_size = ImageProcessor.fit_size(image.size, *raw_target)
+            if image.format == 'JPEG':
+                # draft() picks the largest DCT scale that still yields at least new_size
+                image.draft(image.mode, new_size)
+            elif rawcrop.is_mappable(image):
+                # Uncompressed pixels are sampled straight from the file at about
+                # twice the target size, instead of decoding every row
+                step = max(1, min(image.width // new_size[0], image.height // new_size[1]) // 2)
+                with span("mapped_sample", step=step):
+                    image = rawcrop.read_region(image, (0, 0) + image.size, step) or image
+            with span("decode", image=image):
+                image.load()
+            if image.size == new_size:
+                preview = image.copy()
+            else:
+                with span("resize_lanczos", target=f"{new_size[0]}x{new_size[1]}"):
+                    preview = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            preview = orientation.orient(preview, exif_orientation)
+        return preview, preview.size
+    
+    @staticmethod
+    def fit_ratio(crop_coords, ratio):
+        """Reduce una caja de recorte a la proporción indicada, centrada en la caja original."""
+        x1, y1, x2, y2 = crop_coords
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        if not ratio:
+            return (x1, y1, x2, y2)
+        
+        width, height = x2 - x1, y2 - y1
+        if width / height > ratio:
+            new_width, new_height = int(round(height * ratio)), height
+        else:
+            new_width, new_height = width, int(round(width / ratio))
+        
+        left = x1 + (width - new_width) // 2
+        top = y1 + (height - new_height) // 2
+        return (left, top, left + new_width, top + new_height)
+    
+    @staticmethod
+    def crop_region(image, crop_coords, exif_orientation=1, region_only=False):
+        """Recorta una región rectangular decodificando solo lo necesario cuando el formato lo permite.
+        
+        Con exif_orientation, crop_coords está en coordenadas de la imagen orientada:
+        se recorta la caja correspondiente del archivo y solo se gira el recorte.
+        Con region_only (ver memory.plan_crop), si no se puede leer solo la región
+        se lanza MemoryBudgetError en lugar de decodificar la imagen entera.
+        """
+        if exif_orientation != 1:
+            raw_box = orientation.to_raw_box(crop_coords, image.size, exif_orientation)
+            region = ImageProcessor.crop_region(image, raw_box, region_only=region_only)
+            with span("orient", image=region, orientation=exif_orientation):
+                return orientation.orient(region, exif_orientation)
+        # Uncompressed pixels need no decoding at all: read just the crop's bytes
+        if rawcrop.is_mappable(image):
+            with span("mapped_read", image=image) as s:
+                region = rawcrop.read_region(image, crop_coords)
+                s.set(read=region is not None)
+            if region is not None:
+                return region
+        if tiff_region.is_region_readable(image):
+            with span("region_decode", image=image) as s:
+                try:
+                    region = tiff_region.read_region(image, crop_coords)
+                except OSError:
+                    region = None
+                s.set(decoded=region is not None)
+            if region is not None:
+                return region
+        if getattr(image, "tile", None):
+            # Still lazy: the crop would decode the whole file first
+            if region_only:
+                raise memory.MemoryBudgetError(
+                    "No se pudo leer solo la región y la imagen entera no cabe en el presupuesto"
+                )
+            with span("decode", image=image):
+                image.load()
+        with span("crop", image=image):
+            return image.crop(crop_coords)
+    
+    @staticmethod
+    def crop_image(image, crop_coords, crop_shape="rectangular", supersample=1, band_rows=None, cache_mask=True,
+                   exif_orientation=1, region_only=False):
+        """Recorta una imagen según las coordenadas y forma especificadas.
+        
+        band_rows, cache_mask y region_only vienen de memory.plan_crop cuando hay que
+        ajustarse a un presupuesto de memoria; ver apply_shape y crop_region. Con exif_orientation las
+        coordenadas y la forma son las de la imagen orientada; ver crop_region.
+        """
         x1, y1, x2, y2 = crop_coords
         
         # Sort coordinates
         x1, x2 = min(x1, x2), max(x1, x2)
         y1, y2 = min(y1, y2), max(y1, y2)
         
-        if crop_shape == "circular":
-            # For circular crop, create a circular mask
-            temp_crop = image.crop((x1, y1, x2, y2))
-            
-            # Create a mask with a white circle on black background
-            mask = Image.new('L', temp_crop.size, 0)
-            draw = ImageDraw.Draw(mask)
-            width, height = temp_crop.size
-            draw.ellipse((0, 0, width, height), fill=255)
-            
-            # Create a transparent image for the result
-            result = Image.new('RGBA', temp_crop.size, (0, 0, 0, 0))
-            
-            # Convert temp_crop to RGBA if it's not already
-            if temp_crop.mode != 'RGBA':
-                temp_crop = temp_crop.convert('RGBA')
-            
-            # Paste the cropped image using the mask
-            result.paste(temp_crop, (0, 0), mask)
-        else:
+        with span("crop_image", image=image, shape=masks.shape_name(crop_shape)) as s:
             # For rectangular or square, just crop normally
-            result = image.crop((x1, y1, x2, y2))
-        
+            result = ImageProcessor.crop_region(image, (x1, y1, x2, y2), exif_orientation, region_only)
+            result = ImageProcessor.apply_shape(result, crop_shape, supersample=supersample,
+                                                band_rows=band_rows, cache_mask=cache_mask)
+            s.set_image(result, "result_")
         return result
     
     @staticmethod
-    def save_image(image, save_path, file_format, quality=95):
-        """Guarda una imagen en el formato especificado."""
-        if file_format == 'JPEG':
-            # JPEG doesn't support transparency, convert to RGB if needed
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-            image.save(save_path, format=file_format, quality=quality)
-        else:
-            image.save(save_path, format=file_format)
+    def find_trim_box(image, tolerance=trim.TRIM_TOLERANCE, exif_orientation=1):
+        """Caja del contenido sin los márgenes uniformes (del color de las esquinas).
+        
+        `tolerance` es la diferencia máxima por canal, de 0 a 255, que todavía se
+        considera margen; sirve para fondos escaneados con ruido o compresión. Devuelve
+        None si la imagen es toda del color del fondo. Ver trim.find_content_box.
+        Con exif_orientation la caja se devuelve en coordenadas de la imagen orientada.
+        """
+        with span("find_trim_box", image=image, tolerance=tolerance) as s:
+            box = trim.find_content_box(image, tolerance)
+            if box and exif_orientation != 1:
+                box = orientation.to_oriented_box(box, image.size, exif_orientation)
+            s.set(box=list(box) if box else None)
+        return box
+    
+    @staticmethod
+    def apply_shape(image, crop_shape, bounds=None, supersample=1, band_rows=None, cache_mask=True):
+        """Aplica la máscara de la forma a una imagen ya recortada.
+        
+        `bounds` es la caja de la forma relativa a la imagen (por defecto, la imagen
+        entera); puede sobresalir de ella cuando la forma procede de un recorte anterior.
+        Con supersample > 1 el borde se suaviza promediando varias subfilas por píxel.
+        La máscara se escribe en el canal alfa de la propia imagen recortada; se
+        calcula en bandas de band_rows filas y, con cache_mask=False, no se guarda en caché.
+        """
+        if not masks.needs_mask(crop_shape):
+            return image
+        with span("apply_shape", image=image, shape=masks.shape_name(crop_shape), supersample=supersample):
+            with span("mask"):
+                mask = masks.get_mask(crop_shape, image.size, bounds, supersample, band_rows, cache_mask)
+            return masks.apply_mask(image, mask)
+    
+    @staticmethod
+    def save_image(image, save_path, file_format, quality=95, metadata=None):
+        """Guarda una imagen en el formato especificado.
+        
+        Se escribe en un temporal que solo sustituye a save_path cuando está completo
+        en disco, así que un fallo a mitad nunca deja un archivo truncado. `metadata`
+        (de read_metadata, al abrir el original) aporta el EXIF y el perfil ICC.
+        """
+        with span("save_image", image=image, format=file_format, path=os.path.basename(save_path)):
+            if file_format == 'JPEG':
+                # JPEG doesn't support transparency: flatten onto black, which is what
+                # shows outside a shaped crop
+                if image.mode == 'RGBA':
+                    with span("flatten_alpha"):
+                        flattened = Image.new('RGB', image.size, (0, 0, 0))
+                        flattened.paste(image, mask=image.getchannel('A'))
+                    image = flattened
+                options = {'quality': quality}
+            else:
+                options = {}
+            if metadata:
+                if metadata.exif and file_format in EXIF_FORMATS:
+                    options['exif'] = metadata.exif
+                if metadata.icc_profile and file_format in ICC_FORMATS:
+                    options['icc_profile'] = metadata.icc_profile
+            with atomic_write(save_path) as f:
+                with span("encode", format=file_format):
+                    image.save(f, format=file_format, **options)
+    
+    @staticmethod
+    def save_crop_lossless(source_path, crop_coords, save_path, snap_to_mcu=True, exif_orientation=1,
+                           source_size=None):
+        """Guarda un recorte rectangular de un JPEG copiando sus bloques comprimidos, sin recodificar.
+        
+        Si snap_to_mcu es True la caja se desplaza hasta la rejilla de MCU (8 o 16 píxeles).
+        Devuelve la caja recortada, o None si no es posible y hay que usar save_image.
+        
+        Con exif_orientation (y source_size, el tamaño del archivo sin orientar) la
+        caja está en coordenadas de la imagen orientada: se recorta la caja
+        correspondiente del archivo y se conserva su EXIF, orientación incluida, que
+        sigue siendo válida para el recorte.
+        """
+        if exif_orientation != 1:
+            crop_coords = orientation.to_raw_box(crop_coords, source_size, exif_orientation)
+        with span("save_crop_lossless", path=os.path.basename(save_path)) as s:
+            box = jpeg_lossless.crop_lossless(source_path, crop_coords, save_path, snap_to_mcu)
+            s.set(lossless=box is not None)
+        if box and exif_orientation != 1:
+            box = orientation.to_oriented_box(box, source_size, exif_orientation)
+        return box
     
     @staticmethod
     def open_image(file_path):
         """Abre una imagen desde un archivo."""
-        return Image.open(file_path)
\ No newline at end of file
+        with span("open_image", path=os.path.basename(file_path)) as s:
+            image = Image.open(file_path)
+            s.set_image(image)
+        return image
+    
+    @staticmethod
+    def read_metadata(image):
+        """Orientación, EXIF y perfil ICC de una imagen abierta, para recortarla derecha y guardarlos con el recorte."""
+        return orientation.read_metadata(image)
+    
+    @staticmethod
+    def supports_region_reads(image):
+        """Indica si crop_region puede decodificar solo una parte de la imagen sin cargarla entera."""
+        return tiff_region.is_region_readable(image) or rawcrop.is_mappable(image)
+    
+    @staticmethod
+    def supports_reduced_decode(image):
+        """Indica si open_preview puede decodificar la imagen directamente a menor escala."""
+        return image.format == 'JPEG'
+    
+    @staticmethod
+    def decode_image(file_path, on_progress=None, is_cancelled=None, chunk_size=1024 * 1024, on_partial=None):
+        """Decodifica una imagen completa leyendo el archivo por bloques.
+        
+        Tras cada bloque se llama a on_progress(fracción leída) y se consulta
+        is_cancelled(); si devuelve True se abandona la decodificación y se devuelve None.
+        En los formatos que se decodifican por partes (PNG, BMP, GIF, TIFF sin
+        comprimir...) también se llama a on_partial(imagen) con lo decodificado hasta
+        entonces (el resto, a cero); esa imagen solo puede leerse durante la llamada.
+        """
+        with span("decode_image", path=os.path.basename(file_path)) as s:
+            with Image.open(file_path) as header:
+                # PNG reads its own chunks from the file instead of taking fed data
+                streamed = hasattr(header, "load_read")
+            if streamed:
+                image = ImageProcessor._decode_streamed(file_path, on_progress, is_cancelled, chunk_size, on_partial)
+            else:
+                image = ImageProcessor._decode_chunks(file_path, on_progress, is_cancelled, chunk_size, on_partial)
+            if image is not None:
+                s.set_image(image)
+        return image
+    
+    @staticmethod
+    def _decode_streamed(file_path, on_progress, is_cancelled, chunk_size, on_partial):
+        total = os.path.getsize(file_path) or 1
+        image = None
+        
+        def on_read(position):
+            if is_cancelled and is_cancelled():
+                raise _Cancelled()
+            if on_progress:
+                on_progress(position / total)
+            if on_partial and image is not None:
+                # The pixel buffer is allocated before the first row is read and filled in place
+                on_partial(image._new(image.im))
+        
+        with open(file_path, 'rb') as f:
+            reader = _ReadProgress(f, on_read, chunk_size)
+            try:
+                image = Image.open(reader)
+                image.load()
+            except _Cancelled:
+                return None
+        return image
+    
+    @staticmethod
+    def _decode_chunks(file_path, on_progress, is_cancelled, chunk_size, on_partial):
+        total = os.path.getsize(file_path) or 1
+        parser = ImageFile.Parser()
+        try:
+            with open(file_path, 'rb') as f:
+                done = 0
+                while True:
+                    if is_cancelled and is_cancelled():
+                        return None
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    parser.feed(data)
+                    done += len(data)
+                    if on_progress:
+                        on_progress(done / total)
+                    if on_partial and parser.decoder:
+                        on_partial(parser.image)
+            return parser.close()
+        except (OSError, SyntaxError, ValueError):
+            # Formats the incremental parser cannot follow are decoded in one go
+            image = Image.open(file_path)
+            image.load()
+            return image
\ No newline at end of file
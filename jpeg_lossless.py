@@ -0,0 +1,102 @@
+"""Recorte JPEG sin pérdida.
+
+Un recorte rectangular de un JPEG cuya esquina superior izquierda cae en la
+rejilla de MCU (8 o 16 píxeles, según el submuestreo de color) puede hacerse
+copiando los bloques DCT ya codificados, sin decodificar ni volver a
+comprimir. Para ello se usa `jpegtran -crop` (libjpeg / libjpeg-turbo) si está
+instalado; si no, o si el recorte no se puede alinear, quien llama debe
+recurrir a la recodificación normal.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+from PIL import Image
+
+from utils import fsync_directory
+
+_jpegtran_path = None
+
+def find_jpegtran():
+    """Devuelve la ruta de jpegtran, o None si no está disponible."""
+    global _jpegtran_path
+    if _jpegtran_path is None:
+        _jpegtran_path = os.environ.get("JPEGTRAN") or shutil.which("jpegtran") or ""
+    return _jpegtran_path or None
+
+def mcu_size(image):
+    """Devuelve el tamaño (ancho, alto) del MCU de un JPEG abierto con Pillow."""
+    # Pillow keeps the SOF components as (id, h_sampling, v_sampling, quant_table)
+    layers = getattr(image, "layer", None) or [(None, 1, 1, None)]
+    max_h = max(layer[1] for layer in layers)
+    max_v = max(layer[2] for layer in layers)
+    return 8 * max_h, 8 * max_v
+
+def align_box(crop_coords, mcu):
+    """Desplaza la caja hacia arriba y a la izquierda hasta la rejilla de MCU, conservando su tamaño."""
+    x1, y1, x2, y2 = crop_coords
+    mcu_width, mcu_height = mcu
+    dx = x1 % mcu_width
+    dy = y1 % mcu_height
+    return (x1 - dx, y1 - dy, x2 - dx, y2 - dy)
+
+def is_aligned(crop_coords, mcu):
+    """Indica si la esquina superior izquierda de la caja cae en la rejilla de MCU."""
+    return crop_coords[0] % mcu[0] == 0 and crop_coords[1] % mcu[1] == 0
+
+def crop_lossless(source_path, crop_coords, save_path, snap_to_mcu=True):
+    """Recorta un JPEG sin recodificarlo.
+
+    Devuelve la caja realmente recortada (que puede estar desplazada hasta la
+    rejilla de MCU si snap_to_mcu es True) o None si no es posible hacerlo sin
+    pérdida; en ese caso no se escribe nada.
+    """
+    jpegtran = find_jpegtran()
+    if not jpegtran:
+        return None
+
+    with Image.open(source_path) as image:
+        if image.format != "JPEG":
+            return None
+        width, height = image.size
+        mcu = mcu_size(image)
+
+    x1, y1, x2, y2 = (int(v) for v in crop_coords)
+    x1, x2 = sorted((max(0, min(x1, width)), max(0, min(x2, width))))
+    y1, y2 = sorted((max(0, min(y1, height)), max(0, min(y2, height))))
+    if x2 <= x1 or y2 <= y1:
+        return None
+
+    box = (x1, y1, x2, y2)
+    if not is_aligned(box, mcu):
+        if not snap_to_mcu:
+            return None
+        box = align_box(box, mcu)
+
+    # jpegtran writes to a temporary file next to the destination, so a failed
+    # run never leaves a truncated output or clobbers an existing file
+    x1, y1, x2, y2 = box
+    fd, temp_path = tempfile.mkstemp(suffix=".jpg", dir=os.path.dirname(os.path.abspath(save_path)))
+    os.close(fd)
+    command = [
+        jpegtran, "-copy", "all",
+        "-crop", f"{x2 - x1}x{y2 - y1}+{x1}+{y1}",
+        "-outfile", temp_path, source_path
+    ]
+    try:
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if completed.returncode == 0:
+            # Make sure the data is on disk before the rename makes it visible
+            with open(temp_path, "rb") as f:
+                os.fsync(f.fileno())
+            # mkstemp creates the file as 0600; give it the source's permissions instead
+            shutil.copymode(source_path, temp_path)
+            os.replace(temp_path, save_path)
+            fsync_directory(os.path.dirname(os.path.abspath(save_path)))
+            return box
+    except OSError:
+        pass
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return None
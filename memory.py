@@ -0,0 +1,152 @@
+"""Estimación de la memoria de cada etapa del recorte y presupuesto de memoria.
+
+Aquí no se mide nada: Pillow reserva los píxeles fuera del alcance de tracemalloc
+y el RSS de un proceso casi nunca baja, así que ninguno de los dos dice cuánto
+necesita una etapa. En su lugar se estiman los búferes que cada etapa de
+crop_image mantiene vivos a la vez (origen decodificado, recorte, conversión a
+RGBA, máscara y temporales de NumPy), que es lo que decide si un trabajador se
+queda sin memoria. Como solo hace falta la cabecera de la imagen, la estimación
+se puede hacer antes de decodificar.
+
+plan_crop elige con esas estimaciones la estrategia más barata que cabe en un
+presupuesto: leer o decodificar solo la región cuando el formato lo permite,
+calcular la máscara en bandas más estrechas y no guardarla en caché. Cuando el
+formato no permite leer regiones no hay estrategia más barata para la
+decodificación: la estimación incluye la imagen entera y quien reparte el
+presupuesto (batch.py, watch.py) reserva esa memoria, así que se procesan menos
+imágenes a la vez.
+"""
+import re
+from collections import namedtuple
+
+import masks
+import rawcrop
+import tiff_region
+from orientation import to_raw_box
+from utils import pixel_nbytes
+
+# Memoria de un proceso trabajador sin ninguna imagen (intérprete, Pillow y NumPy)
+WORKER_OVERHEAD = 64 * 1024 * 1024
+# Banda de máscara más estrecha que se usa para encajar en un presupuesto
+MIN_BAND_ROWS = 16
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+class MemoryBudgetError(MemoryError):
+    """El recorte no cabe en el presupuesto ni con la estrategia más barata."""
+
+# stages: tuplas (etapa, bytes vivos estimados) en el orden de ejecución; peak: el máximo de
+# todas; region_only: el plan solo cabe leyendo la región, así que no se puede decodificar entera
+CropPlan = namedtuple('CropPlan', ['stages', 'peak', 'region_only', 'band_rows', 'cache_mask'])
+
+def parse_size(value):
+    """Convierte un tamaño como "512M", "2G" o "1500000" en bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Tamaño no válido: {value}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+def format_bytes(nbytes):
+    """Formatea una cantidad de bytes en megabytes."""
+    return f"{nbytes / (1024 * 1024):.1f} MB"
+
+def estimate_stages(image, box, crop_shape, band_rows=None, save_format=None, exif_orientation=1,
+                    region_reads=True):
+    """Bytes vivos estimados en cada etapa de crop_image (y de save_image si se da save_format).
+
+    `image` es la imagen tal como llega a crop_image (basta con la cabecera) y
+    `box` la caja ya ordenada y dentro de la imagen, orientada según
+    exif_orientation como en crop_image. Con region_reads=False se estima la
+    decodificación entera aunque el formato permita leer solo la región.
+    """
+    x1, y1, x2, y2 = box
+    size = (x2 - x1, y2 - y1)
+    width, height = size
+    crop_bytes = pixel_nbytes(image.mode, size)
+    stages = []
+
+    if region_reads and rawcrop.is_mappable(image):
+        # Only the crop's bytes are read from the mapped file (at most one copy of the crop)
+        stages.append(("mapped_read", crop_bytes))
+        live = crop_bytes
+    elif region_reads and tiff_region.is_region_readable(image):
+        # Only the strips or tiles under the box are decoded, then cropped
+        raw_box = to_raw_box(box, image.size, exif_orientation)
+        region = pixel_nbytes(image.mode, tiff_region.region_size(image, raw_box))
+        stages.append(("region_decode", region + crop_bytes))
+        live = crop_bytes
+    else:
+        # The caller keeps the decoded source alive until crop_image returns
+        source = pixel_nbytes(image.mode, image.size)
+        stages.append(("decode", source))
+        stages.append(("crop", source + crop_bytes))
+        live = source + crop_bytes
+    if exif_orientation != 1:
+        # The crop is transposed into a new image; the untransposed one is dropped right after
+        stages.append(("orient", live + crop_bytes))
+
+    result_bytes = crop_bytes
+    result_mode = image.mode
+    if masks.needs_mask(crop_shape):
+        has_alpha = masks.has_alpha(image)
+        if image.mode != 'RGBA' and (image.mode != 'RGB' or has_alpha):
+            # A real conversion: the crop stays referenced until apply_shape returns
+            result_bytes = pixel_nbytes('RGBA', size)
+            live += result_bytes
+            stages.append(("convert_rgba", live))
+        result_mode = 'RGBA'
+        mask_bytes = width * height
+        band_rows = min(height, band_rows or masks.band_rows_for(width))
+        stages.append(("mask", live + mask_bytes + band_rows * width * masks.COVERAGE_BYTES_PER_PIXEL))
+        # Multiplying an existing alpha goes through two uint16 arrays and an 'L' copy
+        alpha_bytes = 6 * width * height if has_alpha else 0
+        stages.append(("write_alpha", live + mask_bytes + alpha_bytes))
+
+    if save_format:
+        # The source is closed by now; JPEG flattens an RGBA result onto a new RGB image
+        flatten = 5 * width * height if save_format == 'JPEG' and result_mode == 'RGBA' else 0
+        stages.append(("save", result_bytes + flatten))
+    return stages
+
+def plan_crop(image, box, crop_shape, budget=None, save_format=None, exif_orientation=1):
+    """Elige cómo recortar dentro de `budget` bytes (None: sin límite) y estima su memoria.
+
+    Lanza MemoryBudgetError si ni con la estrategia más barata cabe en el presupuesto.
+    """
+    band_rows = None
+    stages = estimate_stages(image, box, crop_shape, band_rows, save_format, exif_orientation)
+    peak = max(nbytes for _, nbytes in stages)
+    if budget is None:
+        return CropPlan(stages, peak, False, band_rows, True)
+
+    width = box[2] - box[0]
+    if peak > budget and masks.needs_mask(crop_shape):
+        # Narrower mask bands are the only stage that can shrink
+        mask_stage = dict(stages)["mask"]
+        default_rows = masks.band_rows_for(width)
+        fixed = mask_stage - min(box[3] - box[1], default_rows) * width * masks.COVERAGE_BYTES_PER_PIXEL
+        band_rows = (budget - fixed) // (width * masks.COVERAGE_BYTES_PER_PIXEL)
+        band_rows = max(MIN_BAND_ROWS, min(default_rows, band_rows))
+        stages = estimate_stages(image, box, crop_shape, band_rows, save_format, exif_orientation)
+        peak = max(nbytes for _, nbytes in stages)
+
+    if peak > budget:
+        stage = max(stages, key=lambda item: item[1])[0]
+        raise MemoryBudgetError(
+            f"El recorte necesita {format_bytes(peak)} (etapa {stage}) y el presupuesto es de {format_bytes(budget)}"
+        )
+    # Cached masks outlive the crop; keep them only if a full cache still fits
+    cache_mask = peak + masks.MASK_CACHE_BYTES <= budget
+    # If the region read fails, crop_region decodes the whole image; that is only
+    # allowed when the whole image fits as well
+    region_only = False
+    if tiff_region.is_region_readable(image) or rawcrop.is_mappable(image):
+        full = estimate_stages(image, box, crop_shape, band_rows, save_format, exif_orientation, region_reads=False)
+        region_only = max(nbytes for _, nbytes in full) > budget
+    return CropPlan(stages, peak, region_only, band_rows, cache_mask)
+
+def stage_args(plan):
+    """Memoria estimada de cada etapa de un plan en MB, para añadirla a una traza."""
+    args = {f"est_mem_{stage}_mb": round(nbytes / (1024 * 1024), 1) for stage, nbytes in plan.stages}
+    args["est_mem_peak_mb"] = round(plan.peak / (1024 * 1024), 1)
+    return args
@@ -0,0 +1,113 @@
+"""Orientación EXIF y metadatos que se conservan al guardar.
+
+Las fotos de móvil suelen guardar los píxeles tal como salen del sensor y una
+etiqueta EXIF (Orientation) que indica cómo girarlos o voltearlos para verlos
+derechos. Girar la imagen entera al abrirla duplicaría la memoria y el tiempo de
+carga, así que solo se orienta la vista previa: la selección se hace en
+coordenadas de la imagen orientada, se lleva a las del archivo con la
+transformación inversa y, tras recortar, solo se gira el recorte.
+"""
+from collections import namedtuple
+
+from PIL import Image
+
+ORIENTATION_TAG = 0x0112
+
+# Transposición que pone derecha una imagen con cada valor de la etiqueta (como ImageOps.exif_transpose)
+TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Orientación de la imagen ya orientada vista desde el archivo: los giros de 90 se invierten, el resto son simétricos
+INVERSE = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 8, 7: 7, 8: 6}
+
+# orientation: valor de la etiqueta (1 si no hay); exif: bytes para save(exif=...) con la
+# orientación ya puesta a 1 (o None); icc_profile: perfil de color (o None)
+ImageMetadata = namedtuple("ImageMetadata", ["orientation", "exif", "icc_profile"])
+
+def _header_exif(image):
+    """Etiquetas EXIF de una imagen abierta, leídas solo de la cabecera.
+
+    En PNG, getexif() carga (decodifica) la imagen entera por si hay un bloque
+    eXIf tras los píxeles; aquí solo se usan los bloques anteriores, que Pillow
+    ya leyó al abrirla. El resto de formatos traen el EXIF en la cabecera.
+    """
+    if image.format != "PNG":
+        return image.getexif()
+    tags = Image.Exif()
+    exif = image.info.get("exif")
+    if not exif and "Raw profile type exif" in image.info:
+        # Written as hex text by ImageMagick and others
+        exif = bytes.fromhex("".join(image.info["Raw profile type exif"].split("\n")[3:]))
+    if exif:
+        tags.load(exif)
+    return tags
+
+def get_orientation(image):
+    """Valor de la etiqueta Orientation de una imagen abierta (1 si no tiene o no es válido)."""
+    try:
+        orientation = _header_exif(image).get(ORIENTATION_TAG, 1)
+    except (OSError, SyntaxError, ValueError):
+        return 1
+    return orientation if orientation in INVERSE else 1
+
+def read_metadata(image):
+    """Metadatos de una imagen abierta, leídos de la cabecera sin decodificar los píxeles.
+
+    En PNG solo cuenta el EXIF anterior a los píxeles (ver _header_exif).
+    """
+    orientation = get_orientation(image)
+    exif = image.info.get("exif")
+    if exif:
+        try:
+            tags = Image.Exif()
+            tags.load(exif)
+            if ORIENTATION_TAG in tags:
+                # The saved pixels are already upright
+                tags[ORIENTATION_TAG] = 1
+            exif = tags.tobytes()
+        except (OSError, SyntaxError, ValueError):
+            exif = None
+    return ImageMetadata(orientation, exif or None, image.info.get("icc_profile") or None)
+
+def swaps_axes(orientation):
+    """Indica si la orientación intercambia ancho y alto (giros de 90 grados y trasposiciones)."""
+    return orientation in (5, 6, 7, 8)
+
+def oriented_size(size, orientation):
+    """Tamaño de una imagen de tamaño `size` una vez orientada."""
+    width, height = size
+    return (height, width) if swaps_axes(orientation) else (width, height)
+
+def orient(image, orientation):
+    """Aplica la orientación a una imagen (que debe ser pequeña: una vista previa o un recorte)."""
+    if orientation not in TRANSPOSE:
+        return image
+    return image.transpose(TRANSPOSE[orientation])
+
+def to_oriented_box(box, size, orientation):
+    """Lleva una caja en píxeles del archivo (de tamaño `size`) a la imagen orientada."""
+    width, height = size
+    x1, y1, x2, y2 = box
+    if orientation in (2, 3):
+        x1, x2 = width - x2, width - x1
+    if orientation in (3, 4):
+        y1, y2 = height - y2, height - y1
+    if orientation == 5:
+        return (y1, x1, y2, x2)
+    if orientation == 6:
+        return (height - y2, x1, height - y1, x2)
+    if orientation == 7:
+        return (height - y2, width - x2, height - y1, width - x1)
+    if orientation == 8:
+        return (y1, width - x2, y2, width - x1)
+    return (x1, y1, x2, y2)
+
+def to_raw_box(box, size, orientation):
+    """Lleva una caja de la imagen orientada a píxeles del archivo, de tamaño `size` sin orientar."""
+    return to_oriented_box(box, oriented_size(size, orientation), INVERSE[orientation])
@@ -0,0 +1,196 @@
+"""Decodificación anticipada de las imágenes vecinas de la carpeta.
+
+Mientras se recorta una imagen, las N siguientes y anteriores se decodifican en
+hilos de fondo (Pillow libera el GIL al decodificar) y se guardan, junto con su
+vista previa, en una LRU limitada por bytes decodificados. Al pasar a la
+siguiente, la carga la recoge ya hecha (o espera a la que está en curso en lugar
+de empezar otra). Las decodificaciones que quedan fuera de la ventana se
+cancelan, y la imagen que se deja vuelve a la caché para poder volver a ella.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from image_processor import ImageProcessor
+from orientation import get_orientation
+from preview_cache import file_key, preview_name
+from tile_pyramid import TileCache
+from tracing import span
+from utils import image_nbytes, pixel_nbytes
+
+# Imágenes vecinas que se decodifican a cada lado de la actual
+PREFETCH_COUNT = 2
+# Memoria máxima de las imágenes decodificadas por adelantado (y sus vistas previas)
+PREFETCH_BYTES = 768 * 1024 * 1024
+
+def _file_state(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def _is_lazy(image):
+    # Region-readable files stay undecoded and keep their file open
+    return bool(getattr(image, "tile", None))
+
+def _discard(entry):
+    """Cierra la imagen de una entrada que sale de la caché si aún tiene el archivo abierto."""
+    image = entry[0]
+    if _is_lazy(image):
+        image.close()
+
+def decode_for_display(file_path, preview_size, cancel, preview_cache=None):
+    """Abre y decodifica una imagen igual que la carga de la interfaz; devuelve (imagen, vista previa).
+
+    Los TIFF legibles por regiones se quedan sin decodificar, como en la carga
+    normal. Devuelve None si se cancela.
+    """
+    key = file_key(file_path) if preview_cache else None
+    name = preview_name(preview_size)
+    preview = preview_cache.get(key, name) if key else None
+    cached = preview is not None
+    image = ImageProcessor.open_image(file_path)
+    region_reads = ImageProcessor.supports_region_reads(image)
+    if preview is None and (region_reads or ImageProcessor.supports_reduced_decode(image)):
+        preview, _ = ImageProcessor.open_preview(file_path, *preview_size)
+    if not region_reads:
+        image.close()
+        image = ImageProcessor.decode_image(file_path, is_cancelled=cancel.is_set)
+        if image is None:
+            return None
+    if preview is None:
+        preview, _ = ImageProcessor.resize_to_fit(image, *preview_size, get_orientation(image))
+    if key and not cached:
+        preview_cache.put(key, name, preview)
+    return image, preview
+
+class _Job:
+    def __init__(self):
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.future = None
+
+class DecodePrefetcher:
+    """Decodifica por adelantado una ventana de archivos y guarda los resultados en una LRU por bytes."""
+
+    def __init__(self, preview_size, preview_cache=None, max_bytes=PREFETCH_BYTES, workers=2):
+        self.preview_size = preview_size
+        self.preview_cache = preview_cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precarga")
+        self._lock = threading.Lock()
+        self._cache = TileCache(max_bytes, on_evict=_discard)  # ruta -> (imagen, vista previa, estado del archivo)
+        self._jobs = {}  # ruta -> _Job en curso o en cola
+        self._reserved = 0  # Bytes de las decodificaciones en curso
+
+    def set_window(self, file_paths):
+        """Pide las rutas dadas (en orden de prioridad) y cancela o descarta las que ya no están."""
+        file_paths = [os.path.abspath(path) for path in file_paths]
+        wanted = set(file_paths)
+        with self._lock:
+            for path, job in list(self._jobs.items()):
+                if path not in wanted:
+                    job.cancel.set()
+                    job.future.cancel()
+                    del self._jobs[path]
+            # Decoded images outside the window would only crowd out the ones inside it
+            for path in self._cache.keys():
+                if path not in wanted:
+                    _discard(self._cache.pop(path))
+            for path in file_paths:
+                if path in self._jobs or path in self._cache:
+                    continue
+                job = _Job()
+                self._jobs[path] = job
+                job.future = self.executor.submit(self._run, path, job)
+
+    def _run(self, file_path, job):
+        try:
+            if job.cancel.is_set():
+                return
+            state = _file_state(file_path)
+            with Image.open(file_path) as header:
+                if ImageProcessor.supports_region_reads(header):
+                    # Stored undecoded (see put): only its preview takes memory
+                    need = pixel_nbytes("RGBA", self.preview_size)
+                else:
+                    need = pixel_nbytes(header.mode, header.size)
+            with self._lock:
+                # Requests come nearest first: one that doesn't fit next to those is skipped
+                if (len(self._cache) or self._reserved) and \
+                        self._cache.current_bytes + self._reserved + need > self._cache.max_bytes:
+                    return
+                self._reserved += need
+            try:
+                with span("prefetch", path=os.path.basename(file_path)) as s:
+                    result = decode_for_display(file_path, self.preview_size, job.cancel, self.preview_cache)
+                    s.set(cancelled=result is None)
+                if result is not None:
+                    self.put(file_path, *result, state=state, job=job)
+            finally:
+                with self._lock:
+                    self._reserved -= need
+        except Exception:
+            # A file that can't be read is reported when it is actually opened
+            pass
+        finally:
+            with self._lock:
+                if self._jobs.get(file_path) is job:
+                    del self._jobs[file_path]
+            job.done.set()
+
+    def put(self, file_path, image, preview, state=None, job=None):
+        """Guarda una imagen ya decodificada (p. ej. la que se acaba de dejar) para recuperarla después."""
+        if job is not None and job.cancel.is_set():
+            _discard((image, preview))
+            return
+        file_path = os.path.abspath(file_path)
+        try:
+            state = state or _file_state(file_path)
+        except OSError:
+            _discard((image, preview))
+            return
+        nbytes = (0 if _is_lazy(image) else image_nbytes(image)) + image_nbytes(preview)
+        with self._lock:
+            old = self._cache.pop(file_path)
+            if old is not None and old[0] is not image:
+                _discard(old)
+            self._cache.put(file_path, (image, preview, state), nbytes)
+
+    def take(self, file_path, cancel=None):
+        """Saca de la caché la imagen y vista previa de un archivo, esperando si se está decodificando.
+
+        Devuelve (imagen, vista previa) o None si no está, si el archivo ha
+        cambiado o si `cancel` se activa mientras se espera. Quien la recibe pasa
+        a ser su dueño.
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            job = self._jobs.get(file_path)
+        if job is not None:
+            while not job.done.wait(0.05):
+                if cancel is not None and cancel.is_set():
+                    return None
+        with self._lock:
+            entry = self._cache.pop(file_path)
+        if entry is None:
+            return None
+        image, preview, state = entry
+        try:
+            changed = _file_state(file_path) != state
+        except OSError:
+            changed = True
+        if changed:
+            _discard(entry)
+            return None
+        return image, preview
+
+    def clear(self):
+        """Cancela todo lo pendiente y vacía la caché."""
+        self.set_window([])
+        with self._lock:
+            for path in self._cache.keys():
+                _discard(self._cache.pop(path))
+
+    def close(self):
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
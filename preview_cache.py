@@ -0,0 +1,179 @@
+"""Caché en disco de vistas previas y niveles de la pirámide.
+
+Al reabrir una imagen, la vista previa (y los niveles reducidos que se usaron
+con zoom) se leen de la caché en lugar de decodificar y remuestrear el original.
+Cada entrada se identifica por la ruta, el tamaño y la fecha de modificación del
+archivo más un hash rápido de su principio y su final, así que un archivo
+modificado nunca devuelve una vista previa antigua.
+
+Las entradas se escriben con atomic_write (temporal + rename), de modo que otros
+procesos o hilos nunca leen una a medias; una entrada que desaparece o está dañada
+se trata como un fallo de caché. Cuando la caché supera su tamaño se borran las
+entradas usadas hace más tiempo (cada acierto actualiza la fecha de la entrada).
+"""
+import hashlib
+import os
+import threading
+import time
+
+from PIL import Image
+
+from tracing import span
+from utils import atomic_write
+
+CACHE_DIR_ENV = "RECORTA_CACHE_DIR"
+# Tamaño máximo de la caché en disco
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+# Al superar el máximo se borra hasta quedar en esta fracción, para no recorrer el directorio en cada escritura
+EVICT_TO = 0.9
+# Bytes del principio y del final del archivo que entran en el hash
+HASH_BYTES = 64 * 1024
+# Forma parte de la clave: cambiarlo invalida las entradas escritas por versiones anteriores
+# (la 2 guarda las vistas previas y miniaturas ya orientadas según EXIF; la 3, los niveles sin pérdida)
+CACHE_VERSION = 3
+# Temporales de escrituras interrumpidas que se borran al recorrer la caché
+STALE_TEMP_SECONDS = 3600
+PREVIEW_QUALITY = 90
+
+def default_cache_dir():
+    """Directorio de la caché: RECORTA_CACHE_DIR o la caché del usuario (XDG_CACHE_HOME)."""
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if directory:
+        return directory
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "recorta-imagen", "previews")
+
+def file_key(file_path):
+    """Clave de un archivo: ruta, tamaño, fecha de modificación y hash de sus extremos."""
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    header = f"{CACHE_VERSION}\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0"
+    digest.update(header.encode("utf-8", "surrogateescape"))
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_BYTES))
+        if stat.st_size > 2 * HASH_BYTES:
+            f.seek(-HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(HASH_BYTES))
+    return digest.hexdigest()
+
+def preview_name(size):
+    """Nombre de la entrada de una vista previa ajustada a `size` (ancho, alto)."""
+    return f"preview-{size[0]}x{size[1]}"
+
+class PreviewCache:
+    """Caché LRU en disco, limitada por bytes, de imágenes asociadas a un archivo.
+
+    `key` viene de file_key y `name` distingue las imágenes de un mismo archivo
+    (p. ej. "preview-1920x1080" o "level-2").
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Unknown until the directory is first scanned
+
+    def _path(self, key, name, extension):
+        return os.path.join(self.directory, f"{key}-{name}{extension}")
+
+    def get(self, key, name):
+        """Devuelve la imagen guardada, ya decodificada, o None si no está."""
+        with span("preview_cache_get", entry=name) as s:
+            for extension in (".jpg", ".png"):
+                path = self._path(key, name, extension)
+                try:
+                    with Image.open(path) as image:
+                        image.load()
+                except FileNotFoundError:
+                    continue
+                except (OSError, SyntaxError, ValueError):
+                    # Damaged entry: drop it and treat it as a miss
+                    self._remove(path)
+                    continue
+                try:
+                    # Recently used entries are evicted last
+                    os.utime(path)
+                except OSError:
+                    pass
+                s.set(hit=True)
+                return image
+            s.set(hit=False)
+        return None
+
+    def put(self, key, name, image, lossless=False):
+        """Guarda una imagen (JPEG si no tiene transparencia, PNG si la tiene) y hace sitio si hace falta.
+
+        Con lossless=True siempre se guarda en PNG, para imágenes que se vuelven
+        a usar como fuente (los niveles de la pirámide) y no deben acumular
+        artefactos de JPEG.
+        """
+        with span("preview_cache_put", entry=name, image=image):
+            if image.mode not in ("RGB", "L", "RGBA", "LA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            if image.mode in ("RGB", "L") and not lossless:
+                extension, options = ".jpg", {"format": "JPEG", "quality": PREVIEW_QUALITY}
+            else:
+                extension, options = ".png", {"format": "PNG", "compress_level": 1}
+            path = self._path(key, name, extension)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with atomic_write(path) as f:
+                    image.save(f, **options)
+                nbytes = os.path.getsize(path)
+            except OSError:
+                # A full or read-only disk only costs the cache
+                return
+            with self._lock:
+                if self._total_bytes is not None:
+                    self._total_bytes += nbytes
+                if self._total_bytes is None or self._total_bytes > self.max_bytes:
+                    self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            # Another process may have evicted it already
+            return False
+
+    def _evict(self):
+        """Recorre la caché y borra las entradas menos usadas hasta quedar por debajo del límite."""
+        entries = []
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.startswith("."):
+                        # atomic_write temporaries; only old ones are abandoned
+                        if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                            self._remove(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if self._remove(path):
+                    total -= size
+        self._total_bytes = total
+
+    def clear(self):
+        """Borra todas las entradas."""
+        with self._lock:
+            try:
+                with os.scandir(self.directory) as it:
+                    for entry in it:
+                        self._remove(entry.path)
+            except OSError:
+                pass
+            self._total_bytes = 0
@@ -0,0 +1,171 @@
+"""Recorte de imágenes sin comprimir leyendo el archivo proyectado en memoria.
+
+En BMP, PPM/PGM y TIFF sin compresión los píxeles están en el archivo tal cual,
+fila tras fila (en BMP, de abajo arriba). El archivo se proyecta con mmap y se ve
+como un búfer con paso (stride) de una fila: un recorte es solo un desplazamiento
+y un tamaño sobre ese búfer, y el sistema lee del disco únicamente las páginas de
+las filas que lo cruzan. La memoria y la E/S dependen del recorte, no de la
+imagen.
+
+Cuando el modo de los píxeles del archivo coincide con el de Pillow (L, P, RGBA,
+CMYK, I;16) la imagen devuelta comparte la memoria del archivo y no se copia nada
+hasta que el codificador la lee. En RGB (Pillow usa 4 bytes por píxel) o BGR se
+copian solo los bytes del recorte. Mientras exista una imagen que comparte la
+memoria, el archivo no debe truncarse; sustituirlo con atomic_write es seguro.
+"""
+import mmap
+
+import numpy as np
+from PIL import Image
+
+# Formatos cuyos píxeles sin comprimir se leen directamente
+RAW_FORMATS = ('BMP', 'PPM', 'TIFF')
+# Bytes por píxel de cada modo de los datos del archivo
+RAW_BYTES = {
+    'L': 1, 'P': 1,
+    'LA': 2, 'I;16': 2, 'I;16L': 2, 'I;16B': 2,
+    'RGB': 3, 'BGR': 3,
+    'RGBA': 4, 'RGBX': 4, 'BGRA': 4, 'BGRX': 4, 'CMYK': 4,
+}
+# Modos que Pillow puede usar sin copiar sobre un búfer ajeno (los de Image.frombuffer)
+MAP_MODES = ('L', 'P', 'RGBX', 'RGBA', 'CMYK', 'I;16', 'I;16L', 'I;16B')
+
+def _tile_args(tile):
+    """(modo de los datos, paso en bytes o 0, orientación 1 o -1) de una entrada de image.tile."""
+    args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+    return rawmode, stride, orientation
+
+def _strips(image):
+    """Franjas de filas del archivo: lista de (fila inicial, fila final, posición, paso, orientación).
+
+    Devuelve None si los píxeles no están sin comprimir, en franjas de ancho
+    completo que cubren la imagen en orden y con un modo que se puede leer por bytes.
+    """
+    if image.format not in RAW_FORMATS or not getattr(image, 'tile', None):
+        return None
+    width, height = image.size
+    rawmode = None
+    strips = []
+    for tile in image.tile:
+        if tile[0] != 'raw':
+            return None
+        x1, y1, x2, y2 = tile[1]
+        mode, stride, orientation = _tile_args(tile)
+        if mode not in RAW_BYTES or (rawmode and mode != rawmode) or orientation not in (1, -1):
+            return None
+        expected = strips[-1][1] if strips else 0
+        if x1 != 0 or x2 != width or y1 != expected or y2 <= y1:
+            return None
+        rawmode = mode
+        stride = stride or width * RAW_BYTES[mode]
+        if stride < width * RAW_BYTES[mode]:
+            return None
+        if strips and orientation == 1 == strips[-1][4] and stride == strips[-1][3] \
+                and tile[2] == strips[-1][2] + (y1 - strips[-1][0]) * stride:
+            # Strips written back to back are one block of rows
+            strips[-1] = (strips[-1][0], y2) + strips[-1][2:]
+            continue
+        strips.append((y1, y2, tile[2], stride, orientation))
+    if not strips or strips[-1][1] != height:
+        return None
+    return strips
+
+def _rawmode(image):
+    return _tile_args(image.tile[0])[0]
+
+def is_mappable(image):
+    """Indica si una imagen abierta y sin cargar puede recortarse leyendo su archivo con mmap."""
+    try:
+        image.fp.fileno()
+    except (AttributeError, OSError, ValueError):
+        # Not a real file (e.g. BytesIO), or already closed
+        return False
+    return _strips(image) is not None
+
+def _map(image):
+    return mmap.mmap(image.fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _strip_rows(data, strip, width, bpp, box, step):
+    """Vista de NumPy, sin copiar, de los píxeles de `box` dentro de una franja (filas de arriba abajo)."""
+    top, bottom, offset, stride, orientation = strip
+    x1, y1, x2, y2 = box
+    rows = np.frombuffer(data, dtype=np.uint8, count=(bottom - top) * stride, offset=offset)
+    rows = rows.reshape(bottom - top, stride)
+    if orientation < 0:
+        # Stored bottom-up
+        rows = rows[::-1]
+    pixels = rows[:, :width * bpp].reshape(bottom - top, width, bpp)
+    return pixels[y1 - top:y2 - top:step, x1:x2:step]
+
+def _shared(image, data, strip, box):
+    """La región como imagen que comparte la memoria del archivo, o None si no es posible."""
+    top, bottom, offset, stride, orientation = strip
+    x1, y1, x2, y2 = box
+    if image.mode not in MAP_MODES or _rawmode(image) != image.mode or not top <= y1 < y2 <= bottom:
+        return None
+    bpp = RAW_BYTES[image.mode]
+    # Position of the first stored row of the region: the top one, or the bottom one if bottom-up
+    first_row = y1 - top if orientation > 0 else bottom - y2
+    start = offset + first_row * stride + x1 * bpp
+    if start + (y2 - y1) * stride > len(data):
+        # Pillow wants whole strides after every row, which the last rows of the file may lack
+        return None
+    return Image.frombuffer(image.mode, (x2 - x1, y2 - y1), memoryview(data)[start:], 'raw',
+                            image.mode, stride, orientation)
+
+def read_region(image, box, step=1):
+    """Lee la región `box` de una imagen sin cargar, directamente de su archivo.
+
+    Con step > 1 se toma un píxel de cada `step` en cada eje (para vistas previas).
+    Devuelve el mismo resultado que image.crop(box) (con step=1), o None si la
+    imagen no se puede leer así y hay que recurrir al recorte normal.
+    """
+    strips = _strips(image)
+    if strips is None or not is_mappable(image):
+        return None
+    width, height = image.size
+    x1, y1, x2, y2 = (int(v) for v in box)
+    x1, x2 = max(0, min(x1, x2)), min(width, max(x1, x2))
+    y1, y2 = max(0, min(y1, y2)), min(height, max(y1, y2))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    rawmode = _rawmode(image)
+    bpp = RAW_BYTES[rawmode]
+    size = (len(range(x1, x2, step)), len(range(y1, y2, step)))
+
+    data = _map(image)
+    try:
+        region = None
+        hit = [strip for strip in strips if strip[0] < y2 and strip[1] > y1]
+        if step == 1 and len(hit) == 1:
+            region = _shared(image, data, hit[0], (x1, y1, x2, y2))
+        if region is None:
+            # Gather the region's bytes (and only those) from every strip it crosses
+            parts = []
+            for strip in hit:
+                # Rows of the region that fall in this strip, on the step grid
+                first = y1 + -(-(max(y1, strip[0]) - y1) // step) * step
+                last = min(y2, strip[1])
+                if first < last:
+                    parts.append(_strip_rows(data, strip, width, bpp, (x1, first, x2, last), step))
+            pixels = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            region = Image.frombytes(image.mode, size, pixels.tobytes(), 'raw', rawmode)
+            del pixels, parts
+            data.close()
+    except (ValueError, TypeError):
+        # A header that promises more than the file holds, or an unsupported mode
+        if not data.closed:
+            try:
+                data.close()
+            except BufferError:
+                pass
+        return None
+    if image.mode == 'P' and image.palette:
+        # getpalette() would load (decode) the whole source first
+        palette_mode, palette = image.palette.getdata()
+        region.putpalette(palette, palette_mode)
+    region.info.update(image.info)
+    return region
@@ -0,0 +1,168 @@
+"""Decodificación parcial de TIFF en teselas o tiras.
+
+Para recortar una región de un TIFF grande no hace falta decodificar la imagen
+entera: se copian (sin descomprimir) solo las teselas o tiras que cortan la caja
+a un TIFF mínimo en memoria con las mismas etiquetas de codificación, y Pillow
+decodifica ese TIFF. La memoria y la E/S dependen del tamaño del recorte, no del
+de la imagen original.
+"""
+import io
+import math
+
+from PIL import Image, TiffImagePlugin, TiffTags
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+STRIP_OFFSETS = 273
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+# Tags that describe how the pixel data is encoded; everything else is irrelevant to decoding
+CODING_TAGS = (
+    258,    # BitsPerSample
+    259,    # Compression
+    262,    # PhotometricInterpretation
+    266,    # FillOrder
+    277,    # SamplesPerPixel
+    284,    # PlanarConfiguration
+    317,    # Predictor
+    320,    # ColorMap
+    338,    # ExtraSamples
+    339,    # SampleFormat
+    347,    # JPEGTables
+    529,    # YCbCrCoefficients
+    530,    # YCbCrSubsampling
+    531,    # YCbCrPositioning
+    532,    # ReferenceBlackWhite
+)
+
+def _block_layout(tags, width, height):
+    """Devuelve (ancho de bloque, alto de bloque, bloques por fila, bloques por columna) de las teselas o tiras."""
+    if TILE_OFFSETS in tags:
+        block_width, block_height = tags[TILE_WIDTH], tags[TILE_LENGTH]
+    else:
+        block_width, block_height = width, min(tags.get(ROWS_PER_STRIP, height), height)
+    return (block_width, block_height,
+            math.ceil(width / block_width), math.ceil(height / block_height))
+
+def is_region_readable(image):
+    """Indica si una imagen abierta es un TIFF sin cargar dividido en varias teselas o tiras."""
+    if image.format != 'TIFF' or not getattr(image, 'tile', None):
+        return False
+    tags = image.tag_v2
+    offsets = tags.get(TILE_OFFSETS, tags.get(STRIP_OFFSETS))
+    return offsets is not None and len(offsets) > 1
+
+def region_size(image, box):
+    """Tamaño de lo que decodifica read_region para `box`: las teselas o tiras enteras que la cortan."""
+    tags = image.tag_v2
+    width, height = image.size
+    block_width, block_height, _, _ = _block_layout(tags, width, height)
+    x1, y1, x2, y2 = (int(v) for v in box)
+    x1, x2 = max(0, min(x1, x2)), min(width, max(x1, x2))
+    y1, y2 = max(0, min(y1, y2)), min(height, max(y1, y2))
+    region_width = min(math.ceil(x2 / block_width) * block_width, width) - x1 // block_width * block_width
+    region_height = min(math.ceil(y2 / block_height) * block_height, height) - y1 // block_height * block_height
+    return max(0, region_width), max(0, region_height)
+
+def read_region(image, box):
+    """Decodifica solo la región `box` de un TIFF abierto con Image.open y sin cargar.
+
+    Devuelve el mismo resultado que image.crop(box), o None si el archivo no se
+    puede leer por regiones (en ese caso hay que recurrir al recorte normal).
+    """
+    if not is_region_readable(image):
+        return None
+
+    tags = image.tag_v2
+    width, height = image.size
+    x1, y1, x2, y2 = (int(v) for v in box)
+    x1, x2 = max(0, min(x1, x2)), min(width, max(x1, x2))
+    y1, y2 = max(0, min(y1, y2)), min(height, max(y1, y2))
+    if x2 <= x1 or y2 <= y1:
+        return None
+
+    tiled = TILE_OFFSETS in tags
+    offsets = tags[TILE_OFFSETS if tiled else STRIP_OFFSETS]
+    byte_counts = tags.get(TILE_BYTE_COUNTS if tiled else STRIP_BYTE_COUNTS)
+    if byte_counts is None or len(byte_counts) != len(offsets):
+        return None
+
+    block_width, block_height, across, down = _block_layout(tags, width, height)
+    planes = tags.get(277, 1) if tags.get(PLANAR_CONFIGURATION, 1) == 2 else 1
+    if across * down * planes != len(offsets):
+        return None
+
+    # Blocks intersecting the box, in the order the TIFF stores them (plane by plane)
+    bx1, bx2 = x1 // block_width, math.ceil(x2 / block_width)
+    by1, by2 = y1 // block_height, math.ceil(y2 / block_height)
+    indices = [
+        plane * across * down + by * across + bx
+        for plane in range(planes)
+        for by in range(by1, by2)
+        for bx in range(bx1, bx2)
+    ]
+
+    # Region covered by those blocks, clipped to the image like the source is
+    region_x, region_y = bx1 * block_width, by1 * block_height
+    region_width = min(bx2 * block_width, width) - region_x
+    region_height = min(by2 * block_height, height) - region_y
+
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=tags._prefix + b"\x2A\x00\x08\x00\x00\x00")
+    for tag in CODING_TAGS:
+        if tag in tags:
+            ifd[tag] = tags[tag]
+            if tag in tags.tagtype:
+                ifd.tagtype[tag] = tags.tagtype[tag]
+    ifd[IMAGE_WIDTH] = region_width
+    ifd[IMAGE_LENGTH] = region_height
+    if tiled:
+        ifd[TILE_WIDTH] = block_width
+        ifd[TILE_LENGTH] = block_height
+    else:
+        ifd[ROWS_PER_STRIP] = block_height
+    offsets_tag = TILE_OFFSETS if tiled else STRIP_OFFSETS
+    counts_tag = TILE_BYTE_COUNTS if tiled else STRIP_BYTE_COUNTS
+    counts = tuple(byte_counts[i] for i in indices)
+    ifd[counts_tag] = counts
+    ifd.tagtype[counts_tag] = TiffTags.LONG
+    ifd.tagtype[offsets_tag] = TiffTags.LONG
+
+    # The blocks go right after the IFD. Pillow already writes StripOffsets
+    # relative to the end of the IFD; TileOffsets must be absolute, and the IFD
+    # size doesn't depend on their values, so it is laid out once to find them.
+    ifd[offsets_tag] = (0,) * len(indices)
+    try:
+        data_start = 8 + len(ifd.tobytes(8))
+    except NotImplementedError:
+        # Older Pillow versions can't write multi-strip directories
+        return None
+    position = data_start if tiled else 0
+    block_offsets = []
+    for count in counts:
+        block_offsets.append(position)
+        position += count
+    ifd[offsets_tag] = tuple(block_offsets)
+
+    buffer = io.BytesIO()
+    ifd.save(buffer)
+    if buffer.tell() != data_start:
+        return None
+
+    # Copy the still-compressed blocks straight from the source file
+    fp = image.fp
+    for i in indices:
+        fp.seek(offsets[i])
+        buffer.write(fp.read(byte_counts[i]))
+    buffer.seek(0)
+
+    with Image.open(buffer) as region:
+        if region.mode != image.mode or region.size != (region_width, region_height):
+            return None
+        region.load()
+        return region.crop((x1 - region_x, y1 - region_y, x2 - region_x, y2 - region_y))
@@ -0,0 +1,155 @@
+import math
+from collections import OrderedDict
+
+import orientation
+from utils import image_nbytes
+
+# Modes that Image.reduce() and ImageTk.PhotoImage handle directly
+PYRAMID_MODES = ("L", "LA", "RGB", "RGBA")
+# Memoria máxima de los niveles reducidos que se guardan (el nivel 0 es la propia imagen)
+LEVEL_CACHE_BYTES = 256 * 1024 * 1024
+
+class TileCache:
+    """Caché LRU limitada por bytes (no por número de elementos).
+
+    Si se da on_evict, se llama con cada valor expulsado por falta de espacio.
+    """
+
+    def __init__(self, max_bytes, on_evict=None):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """Devuelve el valor guardado para la clave (o None) y lo marca como usado recientemente."""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, nbytes):
+        """Guarda un valor con su tamaño en bytes, expulsando los menos usados si se supera el límite."""
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old[1]
+        self._items[key] = (value, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and len(self._items) > 1:
+            _, (evicted, evicted_bytes) = self._items.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            if self.on_evict:
+                self.on_evict(evicted)
+
+    def pop(self, key):
+        """Saca un valor de la caché y lo devuelve (o None)."""
+        item = self._items.pop(key, None)
+        if item is None:
+            return None
+        self.current_bytes -= item[1]
+        return item[0]
+
+    def keys(self):
+        return list(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.current_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+class TilePyramid:
+    """Pirámide de niveles de potencia de dos de una imagen, construidos bajo demanda y divididos en teselas.
+
+    El nivel 0 es la imagen original; el nivel n mide 1/2^n. Cada nivel se calcula
+    a partir del anterior cuando se necesita. Con load_level(n) se intenta antes
+    obtenerlo de otro sitio (una caché en disco), y store_level(n, imagen) recibe
+    cada nivel calculado. Los niveles se guardan en una LRU de max_level_bytes: uno
+    expulsado se vuelve a cargar o se reconstruye desde el nivel más fino que quede.
+
+    Con exif_orientation los niveles se guardan tal como está el archivo, pero el
+    tamaño, las teselas y sus cajas son los de la imagen orientada: cada tesela se
+    recorta de la zona correspondiente del nivel y se gira sola.
+    """
+
+    def __init__(self, image, tile_size=256, load_level=None, store_level=None, exif_orientation=1,
+                 max_level_bytes=LEVEL_CACHE_BYTES):
+        self.image = image
+        self.tile_size = tile_size
+        self.load_level = load_level
+        self.store_level = store_level
+        self.exif_orientation = exif_orientation
+        self._levels = TileCache(max_level_bytes)
+
+        # Stop once the whole level fits in a single tile
+        width, height = image.size
+        self.max_level = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+    @property
+    def size(self):
+        return orientation.oriented_size(self.image.size, self.exif_orientation)
+
+    def level_for_scale(self, scale):
+        """Devuelve el nivel más reducido cuya resolución sigue siendo mayor o igual que la escala pedida."""
+        if scale >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / scale))), self.max_level)
+
+    def level(self, n):
+        """Devuelve la imagen del nivel n, calculándola si no está guardada."""
+        if n == 0:
+            return self.image
+        level = self._levels.get(n)
+        if level is not None:
+            return level
+        loaded = self.load_level(n) if self.load_level else None
+        if loaded is not None and loaded.size == self._raw_level_size(n):
+            level = loaded
+        else:
+            previous = self.level(n - 1)
+            if previous.mode not in PYRAMID_MODES:
+                previous = previous.convert("RGBA" if "transparency" in previous.info else "RGB")
+            level = previous.reduce(2)
+            if self.store_level:
+                self.store_level(n, level)
+        self._levels.put(n, level, image_nbytes(level))
+        return level
+
+    def level_size(self, n):
+        return orientation.oriented_size(self._raw_level_size(n), self.exif_orientation)
+
+    def _raw_level_size(self, n):
+        width, height = self.image.size
+        return max(1, math.ceil(width / 2 ** n)), max(1, math.ceil(height / 2 ** n))
+
+    def visible_tiles(self, level, box):
+        """Devuelve los índices (tx, ty) de las teselas del nivel que cortan una caja en coordenadas del nivel."""
+        level_width, level_height = self.level_size(level)
+        x1, y1, x2, y2 = box
+        tx1 = max(0, int(x1 // self.tile_size))
+        ty1 = max(0, int(y1 // self.tile_size))
+        tx2 = min(math.ceil(level_width / self.tile_size), math.ceil(x2 / self.tile_size))
+        ty2 = min(math.ceil(level_height / self.tile_size), math.ceil(y2 / self.tile_size))
+        return [(tx, ty) for ty in range(ty1, ty2) for tx in range(tx1, tx2)]
+
+    def tile_box(self, level, tx, ty):
+        """Devuelve la caja de una tesela en coordenadas del nivel."""
+        level_width, level_height = self.level_size(level)
+        x1 = tx * self.tile_size
+        y1 = ty * self.tile_size
+        return (x1, y1, min(x1 + self.tile_size, level_width), min(y1 + self.tile_size, level_height))
+
+    def tile(self, level, tx, ty):
+        """Recorta una tesela del nivel indicado."""
+        box = self.tile_box(level, tx, ty)
+        if self.exif_orientation != 1:
+            box = orientation.to_raw_box(box, self._raw_level_size(level), self.exif_orientation)
+        tile = orientation.orient(self.level(level).crop(box), self.exif_orientation)
+        if tile.mode not in PYRAMID_MODES:
+            tile = tile.convert("RGBA" if "transparency" in tile.info else "RGB")
+        return tile
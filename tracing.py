@@ -0,0 +1,187 @@
+"""Trazas de rendimiento en formato Chrome Trace (chrome://tracing, ui.perfetto.dev).
+
+Uso:
+    with tracing.span("crop_image", image=image) as s:
+        ...
+        s.set_image(result)  # opcional: añade atributos al terminar
+
+Desactivado (lo normal), span() devuelve siempre el mismo objeto vacío y no mide
+ni guarda nada. Se activa con enable() o con la variable de entorno
+RECORTA_TRACE=ruta.json; al salir del programa la traza se escribe en esa ruta.
+Los procesos trabajadores recogen sus eventos con drain() y el proceso principal
+los junta con add_events().
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+from utils import atomic_write
+
+TRACE_ENV = "RECORTA_TRACE"
+
+_tracer = None
+
+class _NullSpan:
+    """Span que no hace nada: lo que devuelve span() con las trazas desactivadas."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def set_image(self, image, prefix=""):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def image_args(image, prefix=""):
+    """Atributos de una imagen para una traza: tamaño, modo y formato."""
+    width, height = image.size
+    args = {
+        prefix + "size": f"{width}x{height}",
+        prefix + "megapixels": round(width * height / 1e6, 2),
+        prefix + "mode": image.mode,
+    }
+    if getattr(image, "format", None):
+        args[prefix + "format"] = image.format
+    return args
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def set_image(self, image, prefix=""):
+        self.args.update(image_args(image, prefix))
+
+class Tracer:
+    """Acumula eventos completos ("X") de todos los hilos del proceso."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+
+    def record(self, name, start_ns, end_ns, args):
+        tid = threading.get_ident()
+        event = {
+            "name": name, "cat": "recorta", "ph": "X",
+            "ts": start_ns / 1000, "dur": (end_ns - start_ns) / 1000,
+            "pid": self.pid, "tid": tid, "args": args,
+        }
+        with self._lock:
+            if tid not in self._threads:
+                # Metadata event so the viewer shows thread names instead of ids
+                self._threads.add(tid)
+                self.events.append({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                })
+            self.events.append(event)
+
+    def drain(self):
+        """Devuelve los eventos acumulados y los olvida."""
+        with self._lock:
+            events, self.events = self.events, []
+            self._threads = set()
+        return events
+
+    def save(self, path=None):
+        """Escribe la traza en JSON para chrome://tracing o Perfetto."""
+        path = path or self.path
+        if not path:
+            return None
+        with self._lock:
+            document = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with atomic_write(path) as f:
+            f.write(json.dumps(document).encode("utf-8"))
+        return path
+
+def enable(path=None):
+    """Activa las trazas en este proceso. Si se da una ruta, la traza se guarda ahí al salir."""
+    global _tracer
+    if _tracer is None or _tracer.pid != os.getpid():
+        # A forked worker starts its own trace instead of resending the parent's events
+        _tracer = Tracer(path)
+        if path:
+            atexit.register(save)
+    elif path:
+        _tracer.path = path
+    return _tracer
+
+def enable_from_env():
+    """Activa las trazas si RECORTA_TRACE indica un archivo de salida."""
+    path = os.environ.get(TRACE_ENV)
+    if path:
+        enable(path)
+    return is_enabled()
+
+def disable():
+    global _tracer
+    _tracer = None
+
+def is_enabled():
+    return _tracer is not None
+
+def span(name, image=None, **args):
+    """Mide un bloque. Con las trazas desactivadas no cuesta más que la llamada."""
+    if _tracer is None:
+        return _NULL_SPAN
+    if image is not None:
+        args.update(image_args(image))
+    return _Span(_tracer, name, args)
+
+def traced(name):
+    """Decorador: mide cada llamada a la función como un span con ese nombre."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def drain():
+    """Eventos acumulados en este proceso (para enviarlos al proceso principal)."""
+    return _tracer.drain() if _tracer is not None else []
+
+def add_events(events):
+    """Añade eventos recogidos en otro proceso."""
+    if _tracer is not None and events:
+        with _tracer._lock:
+            _tracer.events.extend(events)
+
+def save(path=None):
+    """Escribe la traza acumulada; devuelve la ruta o None si no hay nada que guardar."""
+    return _tracer.save(path) if _tracer is not None else None
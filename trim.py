@@ -0,0 +1,130 @@
+"""Detección de márgenes uniformes para recortarlos automáticamente.
+
+El color del fondo se toma de las esquinas de la imagen. La caja del contenido se
+busca primero en una máscara reducida (unos cientos de bloques de lado) en la que
+un bloque tiene contenido si lo tiene cualquiera de sus píxeles, de modo que una
+marca de un píxel no se pierde y la caja solo puede salir más grande. Después se
+afina a resolución completa mirando solo una franja estrecha alrededor de cada
+borde encontrado.
+"""
+import numpy as np
+
+import masks
+
+# Diferencia máxima por canal (0-255) con el fondo que todavía se considera margen
+TRIM_TOLERANCE = 16
+# Lado mayor aproximado de la máscara reducida, en bloques
+PROXY_SIDE = 512
+# Píxeles que se comparan con el fondo de una vez al construir la máscara reducida
+BAND_PIXELS = 4 * 1024 * 1024
+
+def _numeric(image):
+    """La imagen en un modo de 8 bits por canal que NumPy lee directamente."""
+    if image.mode in ('L', 'LA', 'RGB', 'RGBA', 'CMYK'):
+        return image
+    return image.convert('RGBA' if masks.has_alpha(image) else 'RGB')
+
+def _pixels(image):
+    """Píxeles como array (alto, ancho, canales)."""
+    pixels = np.asarray(image)
+    return pixels[..., None] if pixels.ndim == 2 else pixels
+
+def background_color(image):
+    """Color del fondo: la mediana por canal de los cuatro píxeles de las esquinas."""
+    width, height = image.size
+    corners = [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]
+    pixels = np.concatenate([_pixels(_numeric(image.crop((x, y, x + 1, y + 1)))).reshape(1, -1)
+                             for x, y in corners])
+    return np.median(pixels, axis=0)
+
+def content_mask(pixels, background, tolerance):
+    """Máscara de los píxeles que se alejan del fondo más que `tolerance` en algún canal."""
+    if pixels.shape[-1] in (2, 4) and background[-1] == 0:
+        # A transparent margin: only the alpha channel tells content apart
+        return pixels[..., -1] > tolerance
+    # Compared as uint8 against the band [background - tolerance, background + tolerance]
+    # clipped to 0-255, which never needs a wider copy of the pixels
+    background = np.rint(background).astype(np.int16)
+    low = np.clip(background - tolerance, 0, 255).astype(np.uint8)
+    high = np.clip(background + tolerance, 0, 255).astype(np.uint8)
+    mask = np.zeros(pixels.shape[:2], dtype=bool)
+    for channel in range(pixels.shape[-1]):
+        # One channel at a time is several times faster than any(axis=-1) over a short axis
+        values = pixels[..., channel]
+        mask |= values < low[channel]
+        mask |= values > high[channel]
+    return mask
+
+def _bounds(flags):
+    """Primer índice marcado y uno más que el último (None si no hay ninguno)."""
+    indices = np.flatnonzero(flags)
+    if not len(indices):
+        return None
+    return int(indices[0]), int(indices[-1]) + 1
+
+def _refine(image, background, tolerance, box, axis, start, end, first):
+    """Afina un borde a resolución completa dentro de la franja [start, end) del eje dado.
+
+    axis 0 son columnas (bordes izquierdo y derecho) y 1 filas; `box` limita el
+    otro eje. Con first=True se busca el primer índice con contenido (borde
+    inicial) y si no lo hay el contenido empieza en `end`; con first=False, el
+    último más uno, o `start`.
+    """
+    if end <= start:
+        return start
+    x1, y1, x2, y2 = box
+    strip = (start, y1, end, y2) if axis == 0 else (x1, start, x2, end)
+    mask = content_mask(_pixels(_numeric(image.crop(strip))), background, tolerance)
+    found = _bounds(mask.any(axis=axis))
+    if found is None:
+        return end if first else start
+    return start + (found[0] if first else found[1])
+
+def _block_mask(image, background, tolerance, factor):
+    """Máscara de bloques factor x factor: True si algún píxel del bloque es contenido.
+
+    La imagen se compara con el fondo por franjas de filas para no crear arrays
+    del tamaño de la imagen entera.
+    """
+    width, height = image.size
+    block_cols, block_rows = -(-width // factor), -(-height // factor)
+    band_rows = max(1, BAND_PIXELS // (width * factor))
+    blocks = np.zeros((block_rows, block_cols), dtype=bool)
+    for first in range(0, block_rows, band_rows):
+        last = min(block_rows, first + band_rows)
+        band = image.crop((0, first * factor, width, min(height, last * factor)))
+        mask = content_mask(_pixels(band), background, tolerance)
+        # Pad the last partial blocks with background, then take each block's maximum
+        mask = np.pad(mask, ((0, (last - first) * factor - mask.shape[0]), (0, block_cols * factor - width)))
+        rows = mask.reshape(last - first, factor, block_cols * factor).any(axis=1)
+        blocks[first:last] = rows.reshape(last - first, block_cols, factor).any(axis=2)
+    return blocks
+
+def find_content_box(image, tolerance=TRIM_TOLERANCE, proxy_side=PROXY_SIDE):
+    """Caja (x1, y1, x2, y2) del contenido sin los márgenes del color de las esquinas.
+
+    Devuelve None si toda la imagen es del color del fondo. La imagen se
+    decodifica si aún no lo está.
+    """
+    width, height = image.size
+    background = background_color(image)
+    factor = max(1, max(width, height) // proxy_side)
+    mask = _block_mask(_numeric(image), background, tolerance, factor)
+    rows, cols = _bounds(mask.any(axis=1)), _bounds(mask.any(axis=0))
+    if rows is None:
+        return None
+    if factor == 1:
+        return cols[0], rows[0], cols[1], rows[1]
+
+    # Each proxy pixel covers a factor x factor block; every edge is searched
+    # from one block outside to one block inside of where the proxy put it
+    left, right = cols[0] * factor, min(width, cols[1] * factor)
+    top, bottom = rows[0] * factor, min(height, rows[1] * factor)
+    outer = (max(0, left - factor), max(0, top - factor), min(width, right + factor), min(height, bottom + factor))
+    x1 = _refine(image, background, tolerance, outer, 0, outer[0], min(width, left + factor), True)
+    x2 = _refine(image, background, tolerance, outer, 0, max(x1, right - factor), outer[2], False)
+    y1 = _refine(image, background, tolerance, outer, 1, outer[1], min(height, top + factor), True)
+    y2 = _refine(image, background, tolerance, outer, 1, max(y1, bottom - factor), outer[3], False)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
@@ -1,10 +1,42 @@
+import math
 import os
+import queue
+import threading
+import time
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, ttk
-from PIL import ImageTk
+from PIL import Image, ImageTk
 
+import autocrop
+from crop_chain import CropChain
+from filmstrip import Filmstrip
+from history import CropHistory
 from image_processor import ImageProcessor
-from utils import get_file_format, show_error, show_info, show_success
+from masks import DEFAULT_SUPERSAMPLE
+from orientation import get_orientation
+from prefetch import PREFETCH_COUNT, DecodePrefetcher
+from preview_cache import PreviewCache, file_key, preview_name
+from tile_pyramid import TileCache, TilePyramid
+from tracing import enable_from_env, traced
+from utils import LatencyCounter, get_file_format, parse_ratio, show_error, show_info
+
+# Memoria máxima para las teselas ya convertidas a PhotoImage
+TILE_CACHE_BYTES = 64 * 1024 * 1024
+# Memoria máxima para las imágenes recortadas que guarda el historial
+HISTORY_BYTES = 256 * 1024 * 1024
+ZOOM_STEP = 1.25
+# Espera tras el último cambio de tamaño de la ventana antes del remuestreo de calidad
+RESIZE_DEBOUNCE_MS = 150
+MAX_ZOOM = 64.0
+# Lado en píxeles del lienzo de los bloques en que se pinta una tesela ampliada
+DISPLAY_BLOCK = 512
+# Cada cuánto recoge el hilo de la interfaz los resultados de los hilos de trabajo
+UI_POLL_MS = 30
+# Segundos entre vistas previas parciales mientras se decodifica una imagen sin vista previa rápida
+PARTIAL_PREVIEW_INTERVAL = 0.5
+# Niveles de la pirámide que se guardan en la caché de vistas previas (los mayores no compensan)
+CACHED_LEVEL_PIXELS = 16 * 1000 * 1000
 
 class ImageCropperUI:
     def __init__(self, root):
@@ -14,15 +46,22 @@ class ImageCropperUI:
         
         # Variables
         self.image_path = None
-        self.original_image = None
+        self.original_image = None  # Imagen tal como está en el archivo; nunca se modifica
+        self.metadata = None  # Orientación EXIF, EXIF y perfil ICC de original_image
+        self.crop_chain = None  # Recortes aplicados, en coordenadas de original_image
+        self.cropped_image = None  # Resultado materializado de crop_chain
+        self.history = CropHistory(HISTORY_BYTES)
         self.displayed_image = None
         self.image_tk = None
-        self.crop_rectangle = None
+        self.crop_rectangle = None  # Selección en píxeles del lienzo, relativa a la imagen mostrada
+        self.selection_source = None  # La misma selección en píxeles de la imagen que se edita
         self.start_x = None
         self.start_y = None
         self.rect_id = None
         self.aspect_ratio = None
         self.crop_shape = "rectangular"  # Default shape
+        self.lasso_points = []  # Puntos del lazo mientras se dibuja, en coordenadas del lienzo
+        self.lasso_outline = None  # Contorno del lazo relativo a la selección (0..1 en cada eje)
         self.fixed_ratio = None  # Default no fixed ratio
         
         # Variables para edición de selección
@@ -34,8 +73,61 @@ class ImageCropperUI:
         self.handle_size = 8  # Tamaño de los puntos de control
         self.handle_ids = []  # IDs de los puntos de control
         
+        # Capa de selección: los elementos se crean una vez y solo se mueven
+        self.overlay_rect = None
+        self.overlay_oval = None
+        self.overlay_lasso = None
+        self.overlay_handles = []
+        
+        # Eventos de movimiento agrupados: como mucho un repintado por fotograma
+        self.pending_motion = None
+        self.pending_motion_time = None
+        self.coalesced_events = 0
+        self.drag_latency = LatencyCounter()
+        
+        # Variables para zoom y desplazamiento
+        self.zoom = 1.0  # 1.0 = imagen ajustada al lienzo
+        self.fit_position = None
+        self.image_item = None
+        self.pyramid = None
+        self.tile_cache = TileCache(TILE_CACHE_BYTES)
+        self.tile_items = {}  # clave de tesela -> id del elemento en el lienzo
+        self.visible_tiles = {}  # PhotoImages de las teselas mostradas
+        self.pan_x = None
+        self.pan_y = None
+        
+        # Variables para el redimensionado de la ventana
+        self.canvas_size = None
+        self.resize_job = None
+        
+        # Carga en segundo plano: los hilos de trabajo dejan sus resultados en
+        # ui_queue y solo el hilo de Tk los aplica
+        self.ui_queue = queue.Queue()
+        self.load_generation = 0  # Cada carga nueva invalida los resultados de las anteriores
+        self.load_cancel = None
+        self.image_loaded = False  # True cuando original_image ya está decodificada entera
+        self.source_preview = None  # Vista previa de la imagen sin recortar, decodificada al abrirla
+        
+        # Vistas previas y niveles de la pirámide en disco, para reabrir imágenes al instante;
+        # se escriben en segundo plano
+        self.preview_cache = PreviewCache()
+        self.cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
+        self.cache_key = None  # Clave de la imagen abierta en preview_cache
+        
+        # Las imágenes vecinas de la carpeta se decodifican por adelantado para pasar a ellas al instante
+        screen_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        self.prefetcher = DecodePrefetcher(screen_size, self.preview_cache)
+        
+        # Guardado en segundo plano: un solo hilo codifica los recortes en el orden pedido
+        self.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardado")
+        self.pending_saves = 0
+        
+        # Timing trace for this session when RECORTA_TRACE names an output file
+        enable_from_env()
+        
         # Create UI elements
         self.create_widgets()
+        self.root.after(UI_POLL_MS, self._poll_ui_queue)
         
     def create_widgets(self):
         # Top frame for buttons
@@ -46,19 +138,52 @@ class ImageCropperUI:
         self.open_btn = tk.Button(top_frame, text="Abrir Imagen", command=self.open_image)
         self.open_btn.pack(side=tk.LEFT, padx=5)
         
+        self.open_folder_btn = tk.Button(top_frame, text="Abrir Carpeta", command=self.open_folder)
+        self.open_folder_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.prev_btn = tk.Button(top_frame, text="◀", command=self.show_previous, state=tk.DISABLED)
+        self.prev_btn.pack(side=tk.LEFT)
+        
+        self.next_btn = tk.Button(top_frame, text="▶", command=self.show_next, state=tk.DISABLED)
+        self.next_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
         self.crop_btn = tk.Button(top_frame, text="Recortar", command=self.crop_image, state=tk.DISABLED)
         self.crop_btn.pack(side=tk.LEFT, padx=5)
         
+        self.auto_btn = tk.Button(top_frame, text="Auto", command=self.auto_crop, state=tk.DISABLED)
+        self.auto_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.trim_btn = tk.Button(top_frame, text="Quitar márgenes", command=self.trim_borders, state=tk.DISABLED)
+        self.trim_btn.pack(side=tk.LEFT, padx=5)
+        
         self.save_btn = tk.Button(top_frame, text="Guardar", command=self.save_image, state=tk.DISABLED)
         self.save_btn.pack(side=tk.LEFT, padx=5)
         
         self.reset_btn = tk.Button(top_frame, text="Reiniciar", command=self.reset_crop, state=tk.DISABLED)
         self.reset_btn.pack(side=tk.LEFT, padx=5)
         
+        self.undo_btn = tk.Button(top_frame, text="Deshacer", command=self.undo, state=tk.DISABLED)
+        self.undo_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.redo_btn = tk.Button(top_frame, text="Rehacer", command=self.redo, state=tk.DISABLED)
+        self.redo_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.root.bind("<Control-z>", self.undo)
+        self.root.bind("<Control-y>", self.redo)
+        self.root.bind("<Control-Z>", self.redo)
+        for key in ("<Right>", "<Next>"):
+            self.root.bind(key, self.show_next)
+        for key in ("<Left>", "<Prior>"):
+            self.root.bind(key, self.show_previous)
+        
         # Status label
         self.status_label = tk.Label(top_frame, text="Estado: Listo para abrir imagen")
         self.status_label.pack(side=tk.RIGHT, padx=5)
         
+        # Load progress, only shown while a file is being decoded
+        self.cancel_btn = tk.Button(top_frame, text="Cancelar", command=self.cancel_load)
+        self.progress = ttk.Progressbar(top_frame, length=120, mode="determinate", maximum=100)
+        
         # Options frame
         options_frame = tk.Frame(self.root)
         options_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -69,11 +194,19 @@ class ImageCropperUI:
         
         self.shape_var = tk.StringVar(value="rectangular")
         shape_combo = ttk.Combobox(options_frame, textvariable=self.shape_var, 
-                                  values=["rectangular", "cuadrado", "circular"],
+                                  values=["rectangular", "cuadrado", "circular", "elipse", "redondeado", "lazo"],
                                   width=10, state="readonly")
         shape_combo.pack(side=tk.LEFT, padx=5)
         shape_combo.bind("<<ComboboxSelected>>", self.on_shape_change)
         
+        # Corner radius for rounded crops, as a percentage of the shorter side
+        radius_label = tk.Label(options_frame, text="Radio %:")
+        radius_label.pack(side=tk.LEFT, padx=5)
+        
+        self.radius_var = tk.IntVar(value=15)
+        radius_spin = tk.Spinbox(options_frame, from_=0, to=50, width=4, textvariable=self.radius_var)
+        radius_spin.pack(side=tk.LEFT, padx=5)
+        
         # Aspect ratio selection
         ratio_label = tk.Label(options_frame, text="Proporción:")
         ratio_label.pack(side=tk.LEFT, padx=5)
@@ -85,6 +218,12 @@ class ImageCropperUI:
         ratio_combo.pack(side=tk.LEFT, padx=5)
         ratio_combo.bind("<<ComboboxSelected>>", self.on_ratio_change)
         
+        # Lossless JPEG saving
+        self.lossless_var = tk.BooleanVar(value=False)
+        self.lossless_check = tk.Checkbutton(options_frame, text="JPEG sin pérdida",
+                                             variable=self.lossless_var)
+        self.lossless_check.pack(side=tk.LEFT, padx=5)
+        
         # Canvas for image display
         self.canvas_frame = tk.Frame(self.root)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -97,9 +236,27 @@ class ImageCropperUI:
         self.canvas.bind("<B1-Motion>", self.on_mouse_move)
         self.canvas.bind("<ButtonRelease-1>", self.on_mouse_up)
         
+        # Re-fit the image when the window is resized
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        
+        # Zoom with the wheel, pan with the right or middle button
+        self.canvas.bind("<MouseWheel>", self.on_zoom)
+        self.canvas.bind("<Button-4>", self.on_zoom)
+        self.canvas.bind("<Button-5>", self.on_zoom)
+        for button in (2, 3):
+            self.canvas.bind(f"<ButtonPress-{button}>", self.on_pan_start)
+            self.canvas.bind(f"<B{button}-Motion>", self.on_pan_move)
+        
         # Information label
-        self.info_label = tk.Label(self.root, text="Haga clic y arrastre para seleccionar el área de recorte")
+        self.info_label = tk.Label(
+            self.root,
+            text="Haga clic y arrastre para seleccionar el área de recorte · Rueda: zoom · Botón derecho: desplazar"
+        )
         self.info_label.pack(side=tk.BOTTOM, pady=5)
+        
+        # Thumbnails of the current folder, shown once an image or folder is opened
+        self.filmstrip = Filmstrip(self.root, self._post, self.load_image)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def on_shape_change(self, event=None):
         shape = self.shape_var.get()
@@ -108,28 +265,25 @@ class ImageCropperUI:
         # If shape is square or circular, force 1:1 aspect ratio
         if shape in ["cuadrado", "circular"]:
             self.ratio_var.set("1:1")
-            self.on_ratio_change()
+            self._apply_ratio()
         
         # Reset crop if we have an image
         if self.original_image:
             self.reset_crop()
+            self._record_history()
     
     def on_ratio_change(self, event=None):
-        ratio_str = self.ratio_var.get()
-        
-        if ratio_str == "libre":
-            self.fixed_ratio = None
-        else:
-            # Parse ratio like "16:9" to a float
-            try:
-                w, h = map(int, ratio_str.split(':'))
-                self.fixed_ratio = w / h
-            except:
-                self.fixed_ratio = None
+        self._apply_ratio()
         
         # Reset crop if we have an image
         if self.original_image:
             self.reset_crop()
+            self._record_history()
+    
+    def _apply_ratio(self):
+        """Toma la proporción elegida sin tocar el recorte ni el historial."""
+        # Parse ratio like "16:9" to a float (None for "libre")
+        self.fixed_ratio = parse_ratio(self.ratio_var.get())
     
     def open_image(self):
         # Open file dialog to select an image
@@ -144,26 +298,292 @@ class ImageCropperUI:
         if not file_path:
             return
         
+        self.filmstrip.set_folder(os.path.dirname(file_path), file_path)
+        self.load_image(file_path)
+    
+    def open_folder(self):
+        """Muestra las imágenes de una carpeta en la tira de miniaturas y abre la primera."""
+        directory = filedialog.askdirectory(title="Seleccionar Carpeta")
+        if not directory:
+            return
+        
+        self.filmstrip.set_folder(directory)
+        if self.filmstrip.paths:
+            self.load_image(self.filmstrip.paths[0])
+        else:
+            show_info("Información", "La carpeta no contiene imágenes.")
+    
+    def show_next(self, event=None):
+        """Abre la imagen siguiente de la carpeta (→ o Av Pág)."""
+        self._step(1, event)
+    
+    def show_previous(self, event=None):
+        """Abre la imagen anterior de la carpeta (← o Re Pág)."""
+        self._step(-1, event)
+    
+    def _step(self, step, event=None):
+        if event is not None and isinstance(event.widget, (tk.Entry, tk.Spinbox, ttk.Entry)):
+            # Arrow keys move the cursor in text fields
+            return
+        index = self.filmstrip.current
+        if index is None:
+            return
+        index += step
+        if 0 <= index < len(self.filmstrip.paths):
+            self.load_image(self.filmstrip.paths[index])
+    
+    def _update_navigation(self):
+        index = self.filmstrip.current
+        count = len(self.filmstrip.paths)
+        self.prev_btn.config(state=tk.NORMAL if index is not None and index > 0 else tk.DISABLED)
+        self.next_btn.config(state=tk.NORMAL if index is not None and index < count - 1 else tk.DISABLED)
+    
+    def _prefetch_neighbours(self):
+        """Decodifica en segundo plano las imágenes de alrededor de la actual, las más cercanas primero."""
+        index = self.filmstrip.current
+        paths = self.filmstrip.paths
+        window = []
+        if index is not None:
+            for offset in range(1, PREFETCH_COUNT + 1):
+                window.extend(paths[i] for i in (index + offset, index - offset) if 0 <= i < len(paths))
+        self.prefetcher.set_window(window)
+    
+    def on_close(self):
+        self.filmstrip.close()
+        self.prefetcher.close()
+        self.root.destroy()
+    
+    def load_image(self, file_path):
+        """Abre una imagen en segundo plano, sustituyendo a cualquier carga en curso.
+        
+        Primero se muestra una vista previa decodificada al tamaño de la pantalla y
+        después, mientras ya se puede seleccionar, se decodifica la resolución completa.
+        """
+        if self.load_cancel:
+            self.load_cancel.set()
+        self.load_generation += 1
+        self.filmstrip.set_current(file_path)
+        self._update_navigation()
+        self.load_cancel = threading.Event()
+        
+        # The preview covers the whole screen so later reflows never decode again
+        preview_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        worker = threading.Thread(
+            target=self._load_worker,
+            args=(self.load_generation, file_path, preview_size, self.load_cancel),
+            name="carga",
+            daemon=True
+        )
+        
+        self._show_progress(0)
+        self.status_label.config(text=f"Estado: Abriendo {os.path.basename(file_path)}...")
+        worker.start()
+    
+    def cancel_load(self):
+        """Detiene la carga en curso; si ya se muestra la vista previa, la imagen sigue abierta."""
+        if not self.load_cancel:
+            return
+        self.load_cancel.set()
+        self.load_cancel = None
+        self.load_generation += 1
+        self._hide_progress()
+        self.status_label.config(text="Estado: Carga cancelada")
+    
+    @traced("ui.load_worker")
+    def _load_worker(self, generation, file_path, preview_size, cancel):
+        """Decodifica la imagen fuera del hilo de Tk y envía cada etapa con _post()."""
         try:
-            # Open and display the image
-            self.image_path = file_path
-            self.original_image = ImageProcessor.open_image(file_path)
-            self.reset_crop(reload=True)
+            cache_key = self._cache_key_for(file_path)
+            prefetched = self.prefetcher.take(file_path, cancel)
+            if prefetched is not None:
+                # Already decoded in the background (or waited for): nothing left to do
+                image, preview = prefetched
+                self._post(self._on_preview_loaded, generation, file_path, image, preview, cache_key)
+                self._post(self._on_image_loaded, generation, image)
+                return
             
-            # Update status
-            filename = os.path.basename(file_path)
-            self.status_label.config(text=f"Estado: Imagen cargada - {filename}")
+            cache_name = preview_name(preview_size)
+            image = ImageProcessor.open_image(file_path)
+            region_reads = ImageProcessor.supports_region_reads(image)
+            cached = self.preview_cache.get(cache_key, cache_name) if cache_key else None
+            if cached is not None or region_reads or ImageProcessor.supports_reduced_decode(image):
+                # A cached or reduced-decode preview is much cheaper than the full
+                # decode, so it shows up first and the user can start selecting
+                preview = cached
+                if preview is None:
+                    preview, _ = ImageProcessor.open_preview(file_path, *preview_size)
+                    self._cache_image(cache_key, cache_name, preview)
+                if cancel.is_set():
+                    return
+                self._post(self._on_preview_loaded, generation, file_path, image, preview, cache_key)
+                
+                # Region-readable files stay lazy; crops decode only what they cover
+                if region_reads:
+                    self._post(self._on_image_loaded, generation, image)
+                    return
             
-            # Enable buttons
-            self.crop_btn.config(state=tk.NORMAL)
-            self.reset_btn.config(state=tk.NORMAL)
+            needs_preview = cached is None and not ImageProcessor.supports_reduced_decode(image)
+            exif_orientation = get_orientation(image)
+            shown = [None]  # When the last partial preview was posted (None: none yet)
             
+            def on_partial(decoded):
+                # Until the decode ends, show the rows decoded so far
+                now = time.perf_counter()
+                if shown[0] is not None and now - shown[0] < PARTIAL_PREVIEW_INTERVAL:
+                    return
+                partial = ImageProcessor.quick_preview(decoded, *preview_size, exif_orientation)
+                if shown[0] is None:
+                    self._post(self._on_preview_loaded, generation, file_path, image, partial, cache_key)
+                else:
+                    self._post(self._on_preview_refined, generation, partial)
+                shown[0] = now
+            
+            full_image = ImageProcessor.decode_image(
+                file_path,
+                on_progress=lambda fraction: self._post(self._on_load_progress, generation, fraction),
+                is_cancelled=cancel.is_set,
+                on_partial=on_partial if needs_preview else None
+            )
+            if full_image is None:
+                return
+            if needs_preview:
+                # The final preview comes from the decoded pixels
+                preview, _ = ImageProcessor.resize_to_fit(full_image, *preview_size, exif_orientation)
+                self._cache_image(cache_key, cache_name, preview)
+                if shown[0] is None:
+                    self._post(self._on_preview_loaded, generation, file_path, full_image, preview, cache_key)
+                else:
+                    self._post(self._on_preview_refined, generation, preview)
+            self._post(self._on_image_loaded, generation, full_image)
         except Exception as e:
-            show_error("Error", f"No se pudo abrir la imagen: {str(e)}")
+            self._post(self._on_load_failed, generation, e)
+    
+    def _cache_key_for(self, file_path):
+        """Clave del archivo en la caché de vistas previas (None si no se puede leer)."""
+        try:
+            return file_key(file_path)
+        except OSError:
+            return None
+    
+    def _cache_image(self, cache_key, name, image, lossless=False):
+        """Guarda en segundo plano una vista previa o un nivel en la caché de disco."""
+        if cache_key:
+            self.cache_executor.submit(self.preview_cache.put, cache_key, name, image, lossless)
     
+    def _post(self, callback, *args):
+        """Encola una llamada para que la ejecute el hilo de Tk (seguro desde cualquier hilo)."""
+        self.ui_queue.put((callback, args))
+    
+    def _poll_ui_queue(self):
+        """Aplica en el hilo de Tk los resultados enviados por los hilos de trabajo."""
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                callback(*args)
+        except queue.Empty:
+            pass
+        self.root.after(UI_POLL_MS, self._poll_ui_queue)
+    
+    @traced("ui.show_preview")
+    def _on_preview_loaded(self, generation, file_path, image, preview, cache_key=None):
+        if generation != self.load_generation:
+            # Stepped past it (e.g. holding an arrow key): keep it in case the user steps back,
+            # unless it is still undecoded and would have to be decoded here on a crop
+            if not image.tile or ImageProcessor.supports_region_reads(image):
+                self.prefetcher.put(file_path, image, preview)
+            else:
+                image.close()
+            return
+        
+        # The image being left goes back to the prefetch cache, to step back to it at once
+        if self.image_loaded and self.image_path and self.original_image is not image:
+            self.prefetcher.put(self.image_path, self.original_image, self.source_preview)
+        
+        # Show the new image right away; the full decode keeps running
+        self.image_path = file_path
+        self.cache_key = cache_key
+        self.original_image = image
+        self.metadata = ImageProcessor.read_metadata(image)
+        self.image_loaded = False
+        self.source_preview = preview
+        # Crops are made in the upright image, as the preview shows it
+        self.crop_chain = CropChain(self.original_image, supersample=DEFAULT_SUPERSAMPLE,
+                                    exif_orientation=self.metadata.orientation)
+        self.cropped_image = None
+        self.save_btn.config(state=tk.DISABLED)
+        self.history.clear()
+        self._record_history()
+        self.reset_crop(reload=True)
+        
+        self.status_label.config(text=f"Estado: Cargando {os.path.basename(file_path)}...")
+        self.crop_btn.config(state=tk.NORMAL)
+        self.auto_btn.config(state=tk.NORMAL)
+        self.trim_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
+    
+    def _on_preview_refined(self, generation, preview):
+        """Sustituye la vista previa de la imagen en carga (por una con más filas o por la definitiva)."""
+        if generation != self.load_generation:
+            return
+        self.source_preview = preview
+        # Only the picture changes: the selection and the view stay as they are
+        if self.displayed_image and self.zoom == 1.0 and not self.crop_chain.operations:
+            self.displayed_image, _ = self._fit_source_preview(*self.canvas_size)
+            self.image_tk = ImageTk.PhotoImage(self.displayed_image)
+            self.canvas.itemconfigure(self.image_item, image=self.image_tk)
+    
+    def _on_load_progress(self, generation, fraction):
+        if generation == self.load_generation:
+            self.progress["value"] = fraction * 100
+    
+    def _on_image_loaded(self, generation, image):
+        if generation != self.load_generation:
+            return
+        
+        # Same pixels as the lazily opened file, so the chain and history stay valid
+        if image is not self.original_image:
+            lazy = self.original_image
+            self.original_image = image
+            self.crop_chain.source = image
+            if self.pyramid and self.pyramid.image is lazy:
+                self.pyramid = None
+            # The decoded copy replaces it: release its file now rather than at collection
+            lazy.close()
+        self.image_loaded = True
+        self.load_cancel = None
+        self._hide_progress()
+        self._prefetch_neighbours()
+        self.status_label.config(text=f"Estado: Imagen cargada - {os.path.basename(self.image_path)}")
+    
+    def _on_load_failed(self, generation, error):
+        if generation != self.load_generation:
+            return
+        self.load_cancel = None
+        self._hide_progress()
+        self.status_label.config(text="Estado: Error al abrir la imagen")
+        show_error("Error", f"No se pudo abrir la imagen: {str(error)}")
+    
+    def _show_progress(self, value):
+        self.progress["value"] = value
+        if not self.progress.winfo_manager():
+            self.cancel_btn.pack(side=tk.RIGHT, padx=5)
+            self.progress.pack(side=tk.RIGHT, padx=5)
+    
+    def _hide_progress(self):
+        self.progress.pack_forget()
+        self.cancel_btn.pack_forget()
+    
+    @traced("ui.display_image")
     def display_image(self):
         # Clear canvas
         self.canvas.delete("all")
+        self.tile_items = {}
+        self.visible_tiles = {}
+        
+        # The pyramid belongs to the image it was built from
+        if self.pyramid and self.pyramid.image is not self.current_image():
+            self.pyramid = None
+            self.tile_cache.clear()
         
         # Get canvas dimensions
         canvas_width = self.canvas.winfo_width()
@@ -175,9 +595,14 @@ class ImageCropperUI:
             return
         
         # Resize image to fit canvas
-        self.displayed_image, (new_width, new_height) = ImageProcessor.resize_to_fit(
-            self.original_image, canvas_width, canvas_height
-        )
+        if not self.crop_chain.operations:
+            self.displayed_image, (new_width, new_height) = self._fit_source_preview(
+                canvas_width, canvas_height
+            )
+        else:
+            self.displayed_image, (new_width, new_height) = ImageProcessor.resize_to_fit(
+                self.cropped_image, canvas_width, canvas_height
+            )
         
         # Convert to PhotoImage for canvas
         self.image_tk = ImageTk.PhotoImage(self.displayed_image)
@@ -187,15 +612,267 @@ class ImageCropperUI:
         y_position = (canvas_height - new_height) // 2
         
         # Display image on canvas
-        self.canvas.create_image(x_position, y_position, anchor=tk.NW, image=self.image_tk)
+        self.image_item = self.canvas.create_image(x_position, y_position, anchor=tk.NW, image=self.image_tk)
+        self._create_overlay()
         
         # Store image position for coordinate calculations
         self.image_position = (x_position, y_position, new_width, new_height)
+        self.fit_position = self.image_position
+        self.canvas_size = (canvas_width, canvas_height)
+        self.zoom = 1.0
+        
+        # A reflow keeps the selection, which lives in image pixels
+        if self.selection_source:
+            self.crop_rectangle = self._source_to_display(self.selection_source)
+            self._update_selection_display()
+    
+    def _fit_source_preview(self, canvas_width, canvas_height):
+        """Ajusta la imagen sin recortar al lienzo partiendo de la vista previa de la carga."""
+        new_size = ImageProcessor.fit_size(self.crop_chain.size, canvas_width, canvas_height)
+        preview = self.source_preview
+        if preview is None or preview.width < new_size[0]:
+            # The preview is too small for this canvas: rebuild it from the decoded
+            # pixels, or straight from the file at display size while still loading
+            if self.image_loaded and not ImageProcessor.supports_region_reads(self.original_image):
+                preview, _ = ImageProcessor.resize_to_fit(self.original_image, canvas_width, canvas_height,
+                                                          self.crop_chain.exif_orientation)
+            else:
+                preview, _ = ImageProcessor.open_preview(self.image_path, canvas_width, canvas_height)
+            self.source_preview = preview
+        
+        if preview.size != new_size:
+            preview = preview.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return preview, new_size
+    
+    def on_canvas_resize(self, event):
+        """Reajusta la imagen al nuevo tamaño del lienzo, agrupando las ráfagas de cambios."""
+        if not self.displayed_image or (event.width, event.height) == self.canvas_size:
+            return
+        self.canvas_size = (event.width, event.height)
+        
+        # While the window is being dragged, show a cheap nearest-neighbour preview
+        if self.zoom == 1.0:
+            new_width, new_height = ImageProcessor.fit_size(self.crop_chain.size, event.width, event.height)
+            preview = self.displayed_image.resize((new_width, new_height), Image.Resampling.NEAREST)
+            self.image_tk = ImageTk.PhotoImage(preview)
+            x_position = (event.width - new_width) // 2
+            y_position = (event.height - new_height) // 2
+            self.canvas.itemconfigure(self.image_item, image=self.image_tk)
+            self.canvas.coords(self.image_item, x_position, y_position)
+            self.fit_position = (x_position, y_position, new_width, new_height)
+            self._set_view(*self.fit_position)
+        else:
+            # Zoomed in: the tiles are already at the right resolution
+            self._set_view(*self.image_position)
+        
+        # ...and resample properly once the resizing settles
+        if self.resize_job:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_DEBOUNCE_MS, self._finish_resize)
+    
+    @traced("ui.finish_resize")
+    def _finish_resize(self):
+        """Vuelve a pintar con remuestreo de calidad cuando el redimensionado termina."""
+        self.resize_job = None
+        x, y, width, height = self.image_position
+        was_zoomed = self.zoom != 1.0
+        self.display_image()
+        
+        # Keep a zoomed view as it was, relative to the new fit
+        if was_zoomed and width > self.fit_position[2]:
+            self.zoom = width / self.fit_position[2]
+            self._set_view(x, y, width, height)
+    
+    def _display_to_source(self, rect):
+        """Convierte una caja del lienzo (relativa a la imagen mostrada) a píxeles de la imagen."""
+        scale = self.crop_chain.size[0] / self.image_position[2]
+        return tuple(c * scale for c in rect)
+    
+    def _source_to_display(self, rect):
+        """Convierte una caja en píxeles de la imagen a coordenadas del lienzo relativas a la imagen mostrada."""
+        scale = self.image_position[2] / self.crop_chain.size[0]
+        return tuple(c * scale for c in rect)
+    
+    def _set_selection(self, rect):
+        """Fija la selección (en coordenadas del lienzo) y la guarda también en píxeles de la imagen."""
+        self.crop_rectangle = rect
+        self.selection_source = self._display_to_source(rect)
+        self._update_selection_display()
+    
+    def current_image(self):
+        """Imagen que se está editando: la original o el resultado de los recortes."""
+        if self.crop_chain and self.crop_chain.operations:
+            return self.cropped_image
+        return self.original_image
+    
+    def on_zoom(self, event):
+        """Acerca o aleja la vista alrededor del cursor."""
+        if not self.displayed_image:
+            return
+        
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        new_zoom = self.zoom * ZOOM_STEP if zoom_in else self.zoom / ZOOM_STEP
+        new_zoom = max(1.0, min(new_zoom, MAX_ZOOM))
+        if new_zoom == self.zoom:
+            return
+        
+        x, y, width, height = self.image_position
+        fit_x, fit_y, fit_width, fit_height = self.fit_position
+        factor = new_zoom / self.zoom
+        self.zoom = new_zoom
+        
+        if new_zoom == 1.0:
+            new_position = self.fit_position
+        else:
+            # Keep the image point under the cursor fixed
+            new_position = (
+                event.x - (event.x - x) * factor,
+                event.y - (event.y - y) * factor,
+                fit_width * new_zoom,
+                fit_height * new_zoom
+            )
+        
+        self._set_view(*new_position)
+    
+    def on_pan_start(self, event):
+        self.pan_x = event.x
+        self.pan_y = event.y
+    
+    def on_pan_move(self, event):
+        if self.zoom == 1.0 or self.pan_x is None:
+            return
+        
+        x, y, width, height = self.image_position
+        self._set_view(x + event.x - self.pan_x, y + event.y - self.pan_y, width, height)
+        self.pan_x = event.x
+        self.pan_y = event.y
+    
+    def _set_view(self, x, y, width, height):
+        """Coloca la imagen en el lienzo con la posición y tamaño indicados y la vuelve a pintar."""
+        if self.zoom == 1.0:
+            self.image_position = self.fit_position
+            for item in self.tile_items.values():
+                self.canvas.delete(item)
+            self.tile_items = {}
+            self.visible_tiles = {}
+            self.canvas.itemconfigure(self.image_item, state=tk.NORMAL)
+        else:
+            # Keep the canvas covered: no panning past the image edges
+            canvas_width = self.canvas.winfo_width()
+            canvas_height = self.canvas.winfo_height()
+            if width <= canvas_width:
+                x = (canvas_width - width) / 2
+            else:
+                x = min(0, max(canvas_width - width, x))
+            if height <= canvas_height:
+                y = (canvas_height - height) / 2
+            else:
+                y = min(0, max(canvas_height - height, y))
+            
+            self.image_position = (x, y, width, height)
+            self.canvas.itemconfigure(self.image_item, state=tk.HIDDEN)
+            self._render_tiles()
+        
+        # The selection is kept in image pixels, so it follows any zoom or pan
+        if self.selection_source and self.rect_id:
+            self.crop_rectangle = self._source_to_display(self.selection_source)
+            self._update_selection_display()
+    
+    @traced("ui.render_tiles")
+    def _render_tiles(self):
+        """Pinta solo las teselas de la pirámide visibles con el zoom actual."""
+        if self.pyramid is None:
+            self.pyramid = self._make_pyramid(self.current_image())
+        
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        x, y, width, height = self.image_position
+        x, y = round(x), round(y)
+        
+        # Pick the smallest level that still has enough resolution
+        scale = width / self.crop_chain.size[0]
+        level = self.pyramid.level_for_scale(scale)
+        level_scale = scale * 2 ** level  # canvas pixels per level pixel
+        resample = Image.Resampling.NEAREST if level_scale > 1 else Image.Resampling.BILINEAR
+        
+        visible_box = (-x / level_scale, -y / level_scale,
+                       (canvas_width - x) / level_scale, (canvas_height - y) / level_scale)
+        
+        tile_items = {}
+        visible_tiles = {}
+        for tx, ty in self.pyramid.visible_tiles(level, visible_box):
+            tx1, ty1, tx2, ty2 = self.pyramid.tile_box(level, tx, ty)
+            left, top = round(tx1 * level_scale), round(ty1 * level_scale)
+            right, bottom = round(tx2 * level_scale), round(ty2 * level_scale)
+            fx = (tx2 - tx1) / max(1, right - left)
+            fy = (ty2 - ty1) / max(1, bottom - top)
+            
+            # A tile scaled up is drawn in blocks anchored to the tile, so a deep
+            # zoom only builds the blocks on the canvas and panning reuses them
+            bx1 = max(0, (-x - left) // DISPLAY_BLOCK)
+            by1 = max(0, (-y - top) // DISPLAY_BLOCK)
+            bx2 = math.ceil((min(right, canvas_width - x) - left) / DISPLAY_BLOCK)
+            by2 = math.ceil((min(bottom, canvas_height - y) - top) / DISPLAY_BLOCK)
+            tile = None
+            for by in range(by1, by2):
+                for bx in range(bx1, bx2):
+                    block_left, block_top = left + bx * DISPLAY_BLOCK, top + by * DISPLAY_BLOCK
+                    block_right = min(right, block_left + DISPLAY_BLOCK)
+                    block_bottom = min(bottom, block_top + DISPLAY_BLOCK)
+                    key = (level, tx, ty, level_scale, bx, by)
+                    
+                    photo = self.tile_cache.get(key)
+                    if photo is None:
+                        if tile is None:
+                            tile = self.pyramid.tile(level, tx, ty)
+                        # Source pixels of the tile under this block
+                        source_box = ((block_left - left) * fx, (block_top - top) * fy,
+                                      (block_right - left) * fx, (block_bottom - top) * fy)
+                        block = tile.resize((max(1, block_right - block_left), max(1, block_bottom - block_top)),
+                                            resample, box=source_box)
+                        photo = ImageTk.PhotoImage(block)
+                        self.tile_cache.put(key, photo, block.width * block.height * 4)
+                    visible_tiles[key] = photo
+                    
+                    # Reuse the canvas item when the block was already on screen
+                    item = self.tile_items.pop(key, None)
+                    if item is None:
+                        item = self.canvas.create_image(x + block_left, y + block_top, anchor=tk.NW,
+                                                        image=photo, tags="tile")
+                    else:
+                        self.canvas.coords(item, x + block_left, y + block_top)
+                    tile_items[key] = item
+        
+        for item in self.tile_items.values():
+            self.canvas.delete(item)
+        self.tile_items = tile_items
+        self.visible_tiles = visible_tiles
+        self.canvas.tag_lower("tile")
+    
+    def _make_pyramid(self, image):
+        """Pirámide de la imagen; la del original sin recortar lee y guarda sus niveles en la caché de disco."""
+        key = self.cache_key
+        if image is not self.original_image:
+            return TilePyramid(image)
+        # The levels stay as stored in the file; only the tiles on screen are turned upright
+        exif_orientation = self.crop_chain.exif_orientation
+        if not key:
+            return TilePyramid(image, exif_orientation=exif_orientation)
+        
+        def store_level(n, level):
+            if level.width * level.height <= CACHED_LEVEL_PIXELS:
+                self._cache_image(key, f"level-{n}", level, lossless=True)
+        
+        return TilePyramid(image, load_level=lambda n: self.preview_cache.get(key, f"level-{n}"),
+                           store_level=store_level, exif_orientation=exif_orientation)
     
     def on_mouse_down(self, event):
         if not self.displayed_image:
             return
         
+        self.drag_latency.reset()
+        self.coalesced_events = 0
+        
         # Check if click is within image bounds
         x, y, width, height = self.image_position
         
@@ -240,19 +917,47 @@ class ImageCropperUI:
         
         # Si no estamos editando una selección existente, creamos una nueva
         if x <= event.x <= x + width and y <= event.y <= y + height:
+            # Eliminar selección anterior (before storing the new start point,
+            # since clearing also resets it)
+            self._clear_selection()
+            
             self.start_x = event.x
             self.start_y = event.y
             
-            # Eliminar selección anterior
-            self._clear_selection()
+            if self.crop_shape == "lazo":
+                # The lasso follows the pointer; its outline is the selection
+                self.lasso_points = [(event.x, event.y)]
+                self._show_selection_shape(self.overlay_lasso, event.x, event.y, event.x, event.y)
+                return
             
-            # Crear rectángulo inicial
-            self.rect_id = self.canvas.create_rectangle(
-                self.start_x, self.start_y, self.start_x, self.start_y,
-                outline="red", width=2
-            )
+            # Mostrar rectángulo inicial
+            self._show_selection_shape(self.overlay_rect, self.start_x, self.start_y, self.start_x, self.start_y)
     
     def on_mouse_move(self, event):
+        if not self.displayed_image:
+            return
+        
+        # Only remember the latest position; the redraw happens once per idle cycle
+        if self.pending_motion is None:
+            self.pending_motion_time = time.perf_counter()
+            self.root.after_idle(self._flush_motion)
+        else:
+            self.coalesced_events += 1
+        self.pending_motion = event
+    
+    @traced("ui.drag_redraw")
+    def _flush_motion(self):
+        """Procesa el último evento de movimiento pendiente y mide el tiempo hasta el repintado."""
+        event = self.pending_motion
+        if event is None:
+            return
+        self.pending_motion = None
+        
+        self._handle_motion(event)
+        self.canvas.update_idletasks()
+        self.drag_latency.record(time.perf_counter() - self.pending_motion_time)
+    
+    def _handle_motion(self, event):
         x, y, width, height = self.image_position
         
         # Caso 1: Estamos redimensionando la selección
@@ -323,8 +1028,7 @@ class ImageCropperUI:
             y2 = max(0, min(y2, height))
             
             # Actualizar la selección
-            self.crop_rectangle = (x1, y1, x2, y2)
-            self._update_selection_display()
+            self._set_selection((x1, y1, x2, y2))
             
             self.last_x = event.x
             self.last_y = event.y
@@ -360,8 +1064,7 @@ class ImageCropperUI:
                 y2 = height
             
             # Actualizar la selección
-            self.crop_rectangle = (x1, y1, x2, y2)
-            self._update_selection_display()
+            self._set_selection((x1, y1, x2, y2))
             
             self.last_x = event.x
             self.last_y = event.y
@@ -375,6 +1078,14 @@ class ImageCropperUI:
         current_x = max(x, min(event.x, x + width))
         current_y = max(y, min(event.y, y + height))
         
+        if self.crop_shape == "lazo":
+            # Skip points closer than a couple of pixels to the last one
+            last_x, last_y = self.lasso_points[-1]
+            if abs(current_x - last_x) + abs(current_y - last_y) >= 2:
+                self.lasso_points.append((current_x, current_y))
+                self._show_selection_shape(self.overlay_lasso, *self._flatten(self.lasso_points))
+            return
+        
         # Apply fixed aspect ratio if needed
         if self.fixed_ratio:
             # Calculate width and height of the selection
@@ -409,8 +1120,6 @@ class ImageCropperUI:
             current_y = max(y, min(current_y, y + height))
         
         # Update the rectangle
-        self.canvas.delete(self.rect_id)
-        
         if self.crop_shape == "circular":
             # For circular shape, draw a circle
             # Calculate radius based on the larger dimension
@@ -418,19 +1127,25 @@ class ImageCropperUI:
             center_x = (self.start_x + current_x) / 2
             center_y = (self.start_y + current_y) / 2
             
-            self.rect_id = self.canvas.create_oval(
+            self._show_selection_shape(
+                self.overlay_oval,
                 center_x - radius, center_y - radius,
-                center_x + radius, center_y + radius,
-                outline="red", width=2
+                center_x + radius, center_y + radius
             )
+        elif self.crop_shape == "elipse":
+            self._show_selection_shape(self.overlay_oval, self.start_x, self.start_y, current_x, current_y)
         else:
             # For rectangular or square, draw a rectangle
-            self.rect_id = self.canvas.create_rectangle(
-                self.start_x, self.start_y, current_x, current_y,
-                outline="red", width=2
-            )
+            self._show_selection_shape(self.overlay_rect, self.start_x, self.start_y, current_x, current_y)
     
     def on_mouse_up(self, event):
+        # Apply the last coalesced motion before finishing the drag
+        self._flush_motion()
+        if self.drag_latency.count:
+            self.info_label.config(
+                text=f"Latencia de arrastre: {self.drag_latency} · {self.coalesced_events} eventos agrupados"
+            )
+        
         # Si estábamos moviendo o redimensionando, terminamos la operación
         if self.is_moving or self.is_resizing:
             self.is_moving = False
@@ -441,6 +1156,10 @@ class ImageCropperUI:
         if not self.start_x or not self.start_y or not self.rect_id:
             return
         
+        if self.crop_shape == "lazo":
+            self._finish_lasso()
+            return
+        
         # Finalize rectangle
         x, y, width, height = self.image_position
         end_x = max(x, min(event.x, x + width))
@@ -506,24 +1225,78 @@ class ImageCropperUI:
             if y1 > y2:
                 y1, y2 = y2, y1
                 
-            self.crop_rectangle = (x1, y1, x2, y2)
-            self._update_selection_display()
+            self._set_selection((x1, y1, x2, y2))
             self.crop_btn.config(state=tk.NORMAL)
         else:
             # If it's just a click or very small rectangle, clear it
             self._clear_selection()
     
+    def _finish_lasso(self):
+        """Cierra el lazo: la selección es su caja y el contorno se guarda relativo a ella."""
+        x, y, width, height = self.image_position
+        points = [(px - x, py - y) for px, py in self.lasso_points]
+        self.lasso_points = []
+        xs = [px for px, _ in points]
+        ys = [py for _, py in points]
+        x1, y1, x2, y2 = min(xs), min(ys), max(xs), max(ys)
+        
+        if len(points) < 3 or x2 - x1 <= 10 or y2 - y1 <= 10:
+            self._clear_selection()
+            return
+        
+        # Relative to the box, so moving or resizing the selection carries the outline along
+        self.lasso_outline = tuple(((px - x1) / (x2 - x1), (py - y1) / (y2 - y1)) for px, py in points)
+        self._set_selection((x1, y1, x2, y2))
+        self.crop_btn.config(state=tk.NORMAL)
+    
+    @staticmethod
+    def _flatten(points):
+        return [c for point in points for c in point]
+    
+    def _create_overlay(self):
+        """Crea los elementos de la selección una sola vez; después solo se actualizan con coords()."""
+        self.overlay_rect = self.canvas.create_rectangle(
+            0, 0, 0, 0, outline="red", width=2, state=tk.HIDDEN, tags="overlay"
+        )
+        self.overlay_oval = self.canvas.create_oval(
+            0, 0, 0, 0, outline="red", width=2, state=tk.HIDDEN, tags="overlay"
+        )
+        self.overlay_lasso = self.canvas.create_line(
+            0, 0, 0, 0, fill="red", width=2, state=tk.HIDDEN, tags="overlay"
+        )
+        self.overlay_handles = [
+            self.canvas.create_rectangle(
+                0, 0, 0, 0, fill="white", outline="blue", width=1, state=tk.HIDDEN, tags="overlay"
+            )
+            for _ in range(4)
+        ]
+        self.rect_id = None
+        self.handle_ids = []
+    
+    def _show_selection_shape(self, item, *coords):
+        """Muestra el rectángulo, óvalo o lazo de selección en las coordenadas dadas y oculta el resto."""
+        self.canvas.coords(item, *coords)
+        if self.rect_id != item:
+            self.canvas.itemconfigure(item, state=tk.NORMAL)
+            if self.rect_id:
+                self.canvas.itemconfigure(self.rect_id, state=tk.HIDDEN)
+            self.rect_id = item
+    
     def _clear_selection(self):
         """Limpia la selección actual y los puntos de control"""
         if self.rect_id:
-            self.canvas.delete(self.rect_id)
+            self.canvas.itemconfigure(self.rect_id, state=tk.HIDDEN)
         
         for handle_id in self.handle_ids:
-            self.canvas.delete(handle_id)
+            self.canvas.itemconfigure(handle_id, state=tk.HIDDEN)
         
+        self.pending_motion = None
         self.rect_id = None
         self.handle_ids = []
+        self.lasso_points = []
+        self.lasso_outline = None
         self.crop_rectangle = None
+        self.selection_source = None
         self.start_x = None
         self.start_y = None
     
@@ -539,32 +1312,26 @@ class ImageCropperUI:
             y1, y2 = y2, y1
         
         # Actualizar el rectángulo o círculo de selección
-        if self.rect_id:
-            self.canvas.delete(self.rect_id)
-        
         if self.crop_shape == "circular":
             center_x = (x1 + x2) / 2
             center_y = (y1 + y2) / 2
             radius = max(abs(x2 - x1), abs(y2 - y1)) / 2
             
-            self.rect_id = self.canvas.create_oval(
+            self._show_selection_shape(
+                self.overlay_oval,
                 center_x - radius + x, center_y - radius + y,
-                center_x + radius + x, center_y + radius + y,
-                outline="red", width=2
+                center_x + radius + x, center_y + radius + y
             )
+        elif self.crop_shape == "elipse":
+            self._show_selection_shape(self.overlay_oval, x1 + x, y1 + y, x2 + x, y2 + y)
+        elif self.crop_shape == "lazo" and self.lasso_outline:
+            outline = [(x + x1 + u * (x2 - x1), y + y1 + v * (y2 - y1)) for u, v in self.lasso_outline]
+            outline.append(outline[0])
+            self._show_selection_shape(self.overlay_lasso, *self._flatten(outline))
         else:
-            self.rect_id = self.canvas.create_rectangle(
-                x1 + x, y1 + y, x2 + x, y2 + y,
-                outline="red", width=2
-            )
-        
-        # Eliminar puntos de control anteriores
-        for handle_id in self.handle_ids:
-            self.canvas.delete(handle_id)
-        
-        self.handle_ids = []
+            self._show_selection_shape(self.overlay_rect, x1 + x, y1 + y, x2 + x, y2 + y)
         
-        # Crear nuevos puntos de control en las esquinas
+        # Mover los puntos de control a las esquinas
         handle_positions = [
             (x1, y1),  # Superior izquierda
             (x2, y1),  # Superior derecha
@@ -572,48 +1339,89 @@ class ImageCropperUI:
             (x2, y2)   # Inferior derecha
         ]
         
-        for hx, hy in handle_positions:
-            handle = self.canvas.create_rectangle(
+        for handle, (hx, hy) in zip(self.overlay_handles, handle_positions):
+            self.canvas.coords(
+                handle,
                 hx + x - self.handle_size/2, hy + y - self.handle_size/2,
-                hx + x + self.handle_size/2, hy + y + self.handle_size/2,
-                fill="white", outline="blue", width=1
+                hx + x + self.handle_size/2, hy + y + self.handle_size/2
             )
-            self.handle_ids.append(handle)
+            if not self.handle_ids:
+                self.canvas.itemconfigure(handle, state=tk.NORMAL)
+        self.handle_ids = self.overlay_handles
     
+    @traced("ui.auto_crop")
+    def auto_crop(self):
+        """Propone como selección la zona con más detalle, con la proporción elegida."""
+        if not self.displayed_image:
+            return
+        if self.crop_shape == "lazo":
+            show_info("Información", "El recorte automático no está disponible con la forma lazo.")
+            return
+        
+        # The fitted preview is already a small proxy of the image being edited
+        box = autocrop.suggest_box(self.displayed_image, self.fixed_ratio, self.crop_chain.size)
+        self._clear_selection()
+        self.selection_source = box
+        self.crop_rectangle = self._source_to_display(box)
+        self._update_selection_display()
+        self.crop_btn.config(state=tk.NORMAL)
+        self.status_label.config(text="Estado: Recorte sugerido; ajústelo o pulse Recortar")
+    
+    @traced("ui.trim_borders")
+    def trim_borders(self):
+        """Propone como selección el contenido de la imagen sin sus márgenes uniformes."""
+        if not self.displayed_image:
+            return
+        if self.crop_shape == "lazo":
+            show_info("Información", "Quitar márgenes no está disponible con la forma lazo.")
+            return
+        if not self.crop_chain.operations and not self.image_loaded:
+            # The loader thread is still decoding the pixels the trim needs
+            show_info("Información", "Espere a que termine de cargarse la imagen.")
+            return
+        
+        # The uncropped original is still as stored in the file; crops are already upright
+        exif_orientation = 1 if self.crop_chain.operations else self.crop_chain.exif_orientation
+        box = ImageProcessor.find_trim_box(self.current_image(), exif_orientation=exif_orientation)
+        if box is None:
+            show_info("Información", "La imagen no tiene contenido distinto del fondo.")
+            return
+        box = ImageProcessor.fit_ratio(box, self.fixed_ratio)
+        self._clear_selection()
+        self.selection_source = box
+        self.crop_rectangle = self._source_to_display(box)
+        self._update_selection_display()
+        self.crop_btn.config(state=tk.NORMAL)
+        self.status_label.config(text="Estado: Márgenes detectados; ajuste la selección o pulse Recortar")
+    
+    @traced("ui.crop_image")
     def crop_image(self):
         if not self.crop_rectangle or not self.displayed_image:
             show_info("Información", "Por favor, seleccione un área para recortar primero.")
             return
         
-        # Get crop coordinates relative to displayed image
-        x1, y1, x2, y2 = self.crop_rectangle
+        # The selection is already kept in pixels of the image being edited
+        x1, y1, x2, y2 = self.selection_source
         
         # Sort coordinates (in case of drawing from bottom-right to top-left)
         x1, x2 = min(x1, x2), max(x1, x2)
         y1, y2 = min(y1, y2), max(y1, y2)
         
-        # Scale coordinates to original image size
-        orig_width, orig_height = self.original_image.size
-        disp_width, disp_height = self.displayed_image.size
-        
-        scale_x = orig_width / disp_width
-        scale_y = orig_height / disp_height
+        orig_x1 = int(x1)
+        orig_y1 = int(y1)
+        orig_x2 = int(x2)
+        orig_y2 = int(y2)
         
-        orig_x1 = int(x1 * scale_x)
-        orig_y1 = int(y1 * scale_y)
-        orig_x2 = int(x2 * scale_x)
-        orig_y2 = int(y2 * scale_y)
-        
-        # Crop the image using the processor
-        self.cropped_image = ImageProcessor.crop_image(
-            self.original_image, 
-            (orig_x1, orig_y1, orig_x2, orig_y2), 
-            self.crop_shape
-        )
+        # Record the crop in source coordinates and render the whole chain as a
+        # single crop of the original, so only the source and one result are alive
+        crop_shape = self._shape_for_crop(orig_x2 - orig_x1, orig_y2 - orig_y1)
+        self.crop_chain.push((orig_x1, orig_y1, orig_x2, orig_y2), crop_shape)
+        self.cropped_image = None
+        self.cropped_image = self.crop_chain.render()
         
         # Display cropped image
-        self.original_image = self.cropped_image.copy()
         self.reset_crop(reload=True)
+        self._record_history()
         
         # Enable save button
         self.save_btn.config(state=tk.NORMAL)
@@ -621,8 +1429,20 @@ class ImageCropperUI:
         # Update status
         self.status_label.config(text="Estado: Imagen recortada")
     
+    def _shape_for_crop(self, width, height):
+        """Forma que se pasa a la cadena de recortes, con su parámetro en píxeles del recorte."""
+        if self.crop_shape == "redondeado":
+            try:
+                percent = max(0, min(int(self.radius_var.get()), 50))
+            except (tk.TclError, ValueError):
+                percent = 0
+            return ("redondeado", min(width, height) * percent / 100)
+        if self.crop_shape == "lazo" and self.lasso_outline:
+            return ("lazo", tuple((u * width, v * height) for u, v in self.lasso_outline))
+        return self.crop_shape
+    
     def save_image(self):
-        if not hasattr(self, 'cropped_image'):
+        if self.cropped_image is None:
             show_info("Información", "No hay imagen recortada para guardar.")
             return
         
@@ -639,16 +1459,90 @@ class ImageCropperUI:
         if not save_path:
             return
         
-        try:
-            # Save the image using the processor
-            ImageProcessor.save_image(self.cropped_image, save_path, file_format)
-            
-            # Update status
-            self.status_label.config(text=f"Estado: Imagen guardada en {os.path.basename(save_path)}")
-            show_success("Éxito", "Imagen guardada correctamente.")
-            
-        except Exception as e:
-            show_error("Error", f"No se pudo guardar la imagen: {str(e)}")
+        # A rectangular JPEG chain is a single crop of the source file, which
+        # can be copied without re-encoding
+        lossless_box = None
+        if (self.lossless_var.get() and file_format == 'JPEG'
+                and get_file_format(save_path)[0] == 'JPEG' and self.crop_chain.is_rectangular):
+            lossless_box = self.crop_chain.box
+        
+        # The job only holds its own references, so the user can keep cropping
+        # (or open another image) while it encodes
+        future = self.save_executor.submit(
+            self._save_worker, self.cropped_image, save_path, file_format, self.image_path, lossless_box,
+            self.metadata, self.original_image.size
+        )
+        future.add_done_callback(lambda f: self._post(self._on_save_done, save_path, f))
+        self.pending_saves += 1
+        self.status_label.config(text=f"Estado: Guardando {os.path.basename(save_path)}...")
+    
+    @staticmethod
+    @traced("ui.save_worker")
+    def _save_worker(image, save_path, file_format, source_path, lossless_box, metadata, source_size):
+        """Codifica y escribe un recorte en el hilo de guardado. Devuelve True si se copió sin pérdida.
+        
+        El EXIF y el perfil ICC son los leídos al abrir la imagen; el original no se vuelve a leer.
+        """
+        if lossless_box and ImageProcessor.save_crop_lossless(source_path, lossless_box, save_path,
+                                                              exif_orientation=metadata.orientation,
+                                                              source_size=source_size):
+            return True
+        ImageProcessor.save_image(image, save_path, file_format, metadata=metadata)
+        return False
+    
+    def _on_save_done(self, save_path, future):
+        self.pending_saves -= 1
+        filename = os.path.basename(save_path)
+        pending = f" ({self.pending_saves} pendientes)" if self.pending_saves else ""
+        
+        error = future.exception()
+        if error is not None:
+            self.status_label.config(text=f"Estado: Error al guardar {filename}{pending}")
+            show_error("Error", f"No se pudo guardar la imagen: {str(error)}")
+            return
+        
+        mode = " (sin pérdida)" if future.result() else ""
+        self.status_label.config(text=f"Estado: Imagen guardada en {filename}{mode}{pending}")
+    
+    def _record_history(self):
+        """Guarda el estado actual (recortes, forma y proporción) en el historial."""
+        image = self.cropped_image if self.crop_chain.operations else None
+        self.history.record(self.crop_chain.operations, self.crop_shape, self.ratio_var.get(), image)
+        self._update_history_buttons()
+    
+    def _update_history_buttons(self):
+        self.undo_btn.config(state=tk.NORMAL if self.history.can_undo() else tk.DISABLED)
+        self.redo_btn.config(state=tk.NORMAL if self.history.can_redo() else tk.DISABLED)
+    
+    def undo(self, event=None):
+        state = self.history.undo()
+        if state:
+            self._restore_state(state)
+            self.status_label.config(text="Estado: Cambio deshecho")
+    
+    def redo(self, event=None):
+        state = self.history.redo()
+        if state:
+            self._restore_state(state)
+            self.status_label.config(text="Estado: Cambio rehecho")
+    
+    @traced("ui.restore_state")
+    def _restore_state(self, state):
+        """Vuelve a un estado del historial, recalculando la imagen desde la original si hace falta."""
+        self.crop_chain.operations = list(state.operations)
+        self.crop_shape = state.shape
+        self.shape_var.set(state.shape)
+        self.ratio_var.set(state.ratio)
+        self.fixed_ratio = parse_ratio(state.ratio)
+        
+        # Drop the current result before rendering the next one
+        self.cropped_image = None
+        if state.operations:
+            self.cropped_image = self.history.materialize(state, self.crop_chain.render)
+        
+        self.save_btn.config(state=tk.NORMAL if self.cropped_image is not None else tk.DISABLED)
+        self.reset_crop(reload=True)
+        self._update_history_buttons()
     
     def reset_crop(self, reload=False):
         # Clear canvas and reset crop variables
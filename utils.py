@@ -1,5 +1,10 @@
 import os
-from tkinter import messagebox
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+
+# Extensiones de imagen reconocidas (las mismas que el filtro del diálogo de apertura)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.webp')
 
 def get_file_format(file_path):
     """Obtiene el formato de archivo a partir de la extensión."""
@@ -7,16 +12,143 @@ def get_file_format(file_path):
     file_format = original_ext[1:].upper()  # Remove dot and convert to uppercase
     if file_format == 'JPG':
         file_format = 'JPEG'
+    elif file_format == 'TIF':
+        file_format = 'TIFF'
     return file_format, original_ext
 
+def extension_for(file_format):
+    """Extensión de archivo habitual para un formato ("JPEG" -> ".jpg")."""
+    return '.jpg' if file_format == 'JPEG' else '.' + file_format.lower()
+
+def is_image_file(file_path):
+    """Indica si la ruta tiene una extensión de imagen reconocida."""
+    return os.path.splitext(file_path)[1].lower() in IMAGE_EXTENSIONS
+
+def list_image_files(directory):
+    """Rutas de las imágenes de un directorio (sin subdirectorios), ordenadas por nombre."""
+    with os.scandir(directory) as entries:
+        names = sorted(e.name for e in entries if is_image_file(e.name) and e.is_file())
+    return [os.path.join(directory, name) for name in names]
+
+def parse_ratio(ratio_str):
+    """Convierte una proporción como "16:9" en un float, o None si es "libre" o no es válida."""
+    if not ratio_str or ratio_str == "libre":
+        return None
+    try:
+        w, h = map(int, ratio_str.split(':'))
+        return w / h
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def pixel_nbytes(mode, size):
+    """Estima la memoria que ocupan los píxeles de una imagen de ese modo y tamaño."""
+    width, height = size
+    if mode in ('I', 'F', 'RGBA', 'RGBa', 'RGBX', 'CMYK', 'RGB', 'YCbCr', 'LAB', 'HSV', 'LA', 'PA', 'La'):
+        # Pillow stores these modes (and any mode with several bands) with four bytes per pixel
+        return width * height * 4
+    if mode in ('I;16', 'I;16B', 'I;16L'):
+        return width * height * 2
+    return width * height
+
+def image_nbytes(image):
+    """Estima la memoria que ocupan los píxeles de una imagen ya decodificada."""
+    return pixel_nbytes(image.mode, image.size)
+
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Read once at import (os.umask can only be queried by changing it, which is not thread-safe)
+_UMASK = _current_umask()
+
+def fsync_directory(directory):
+    """Asegura en disco la entrada de un archivo recién renombrado (sin efecto donde no se puede)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path):
+    """Escribe un archivo de forma atómica.
+
+    Devuelve un archivo temporal abierto en binario en el mismo directorio que
+    `path`. Al salir del bloque sin errores se vuelca a disco (fsync) y se renombra
+    sobre `path`; si algo falla se borra, así que `path` nunca queda a medias.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file as 0600; keep the mode a plain write would give
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    fsync_directory(directory)
+
+class LatencyCounter:
+    """Acumula latencias recientes (en segundos) y las resume en milisegundos."""
+    
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+    
+    @property
+    def count(self):
+        return len(self.samples)
+    
+    def reset(self):
+        self.samples.clear()
+    
+    def record(self, seconds):
+        self.samples.append(seconds)
+    
+    def summary(self):
+        """Devuelve media, percentil 95 y máximo en milisegundos."""
+        if not self.samples:
+            return {'count': 0, 'mean_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return {
+            'count': len(ordered),
+            'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p95_ms': p95 * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
+    
+    def __str__(self):
+        stats = self.summary()
+        return (f"media {stats['mean_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+                f"máx {stats['max_ms']:.1f} ms ({stats['count']} repintados)")
+
 def show_error(title, message):
     """Muestra un mensaje de error."""
+    # Imported lazily so headless tools (batch mode) don't require Tk
+    from tkinter import messagebox
     messagebox.showerror(title, message)
 
 def show_info(title, message):
     """Muestra un mensaje informativo."""
+    from tkinter import messagebox
     messagebox.showinfo(title, message)
 
 def show_success(title, message):
     """Muestra un mensaje de éxito."""
-    messagebox.showinfo(title, message)
\ No newline at end of file
+    from tkinter import messagebox
+    messagebox.showinfo(title, message)
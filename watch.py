@@ -0,0 +1,558 @@
+"""Carpeta vigilada: recorta automáticamente las imágenes que se dejan en ella.
+
+Ejemplo:
+    python watch.py entrada/ -o recortes/ --preset circular.json --workers 4
+
+El preajuste es un JSON con las mismas opciones que batch.py:
+    {"shape": "circular", "box": [100, 100, 900, 900], "format": "PNG"}
+    {"ratio": "16:9", "renditions": ["2048:jpeg", "1024:webp:q80", "256:png"]}
+
+Cada imagen se procesa cuando ha terminado de escribirse: con inotify (Linux)
+en cuanto se cierra o se mueve a la carpeta, y en los demás casos cuando su
+tamaño y su fecha no cambian durante --settle segundos. Los recortes van al
+directorio de salida y el original a procesados/ o, si falla, a fallidos/ junto
+con un .txt con el error.
+
+Las imágenes listas pasan por una cola acotada hasta los procesos de recorte. Si
+la cola se llena, el vigilante deja de leer eventos hasta que hay sitio. Los
+archivos siguen esperando en la carpeta, que hace de búfer, y al reanudar se
+vuelve a recorrer. Así una ráfaga de llegadas no hace crecer la memoria y los
+procesos nunca se quedan sin trabajo mientras quede algo pendiente.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import inspect
+import json
+import multiprocessing
+import os
+import queue
+import select
+import shutil
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import export
+import memory
+import tracing
+from batch import (SHAPES, estimate_file_memory, make_spec, normalize_format, numbered_name, output_key,
+                   output_paths_for, parse_memory_budget, process_chunk)
+from utils import atomic_write, is_image_file, parse_ratio
+
+# Segundos sin cambios de tamaño ni fecha tras los que un archivo se da por escrito
+DEFAULT_SETTLE = 1.0
+# Intervalo entre recorridos de la carpeta cuando no hay inotify
+DEFAULT_POLL_INTERVAL = 1.0
+# Imágenes listas que pueden esperar en la cola antes de frenar al vigilante
+DEFAULT_QUEUE_SIZE = 64
+
+# Veces que se reintenta un archivo cuyo proceso muere (por falta de memoria, por ejemplo)
+MAX_ATTEMPTS = 2
+
+DONE_DIR = "procesados"
+FAILED_DIR = "fallidos"
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Eventos de una carpeta con inotify. Lanza OSError si el sistema no lo ofrece."""
+
+    def __init__(self, directory):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError, TypeError):
+            raise OSError("inotify no está disponible")
+        self.directory = directory
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch")
+
+    def read(self, timeout):
+        """Espera eventos hasta `timeout` segundos.
+
+        Devuelve una lista de (ruta, escrito), donde escrito indica que el archivo
+        se ha cerrado tras escribirlo o se ha movido a la carpeta; None si se han
+        perdido eventos y hay que recorrer la carpeta.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name and not mask & IN_ISDIR:
+                events.append((os.path.join(self.directory, os.fsdecode(name)),
+                               bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Sustituto de InotifyWatcher que pide recorrer la carpeta cada cierto tiempo."""
+
+    def __init__(self, directory, interval=DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+
+    def read(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return None
+
+    def close(self):
+        pass
+
+def open_watcher(directory, poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+    """Devuelve un vigilante con inotify si es posible; si no, uno que recorre la carpeta."""
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+    return PollingWatcher(directory, poll_interval)
+
+def is_candidate(path):
+    """Indica si un archivo de la carpeta es una imagen por procesar (no un temporal oculto)."""
+    name = os.path.basename(path)
+    return not name.startswith('.') and is_image_file(name)
+
+class WriteTracker:
+    """Decide cuándo un archivo ha terminado de escribirse.
+
+    Un archivo está listo cuando no está vacío y, o bien se sabe que se ha cerrado
+    tras escribirlo, o bien su tamaño y su fecha llevan `settle` segundos sin cambiar.
+    """
+
+    def __init__(self, settle=DEFAULT_SETTLE):
+        self.settle = settle
+        self.files = {}  # path -> [size, mtime_ns, stable since, closed]
+
+    def touch(self, path, closed=False):
+        entry = self.files.get(path)
+        if entry is None:
+            self.files[path] = [None, None, None, closed]
+        elif closed:
+            entry[3] = True
+        else:
+            # Written to again after a close: wait for it to settle
+            entry[3] = False
+
+    def pop_ready(self, now=None):
+        """Devuelve, en orden de llegada, los archivos listos y deja de seguirlos."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, entry in list(self.files.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Moved away or deleted before it was ready
+                del self.files[path]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if signature != (entry[0], entry[1]):
+                entry[0], entry[1], entry[2] = st.st_size, st.st_mtime_ns, now
+            if st.st_size > 0 and (entry[3] or now - entry[2] >= self.settle):
+                ready.append(path)
+                del self.files[path]
+        return ready
+
+    def __len__(self):
+        return len(self.files)
+
+def load_preset(path):
+    """Lee un preajuste JSON y devuelve la especificación de recorte (ver batch.make_spec)."""
+    with open(path, encoding="utf-8") as f:
+        options = json.load(f)
+    if not isinstance(options, dict):
+        raise ValueError("El preajuste debe ser un objeto JSON")
+    if "format" in options:
+        options["file_format"] = options.pop("format")
+    allowed = inspect.signature(make_spec).parameters
+    unknown = sorted(set(options) - set(allowed))
+    if unknown:
+        raise ValueError(f"Opciones desconocidas en el preajuste: {', '.join(unknown)}")
+
+    shape = options.get("shape", "rectangular")
+    if shape not in SHAPES:
+        raise ValueError(f"Forma no válida: {shape}")
+    if shape == "poligono" and not options.get("points"):
+        raise ValueError("La forma poligono necesita points")
+    ratio = options.get("ratio")
+    if ratio and ratio != "libre" and parse_ratio(ratio) is None:
+        raise ValueError(f"Proporción no válida: {ratio}")
+    if options.get("box") is not None and len(options["box"]) != 4:
+        raise ValueError("box debe tener el formato [x1, y1, x2, y2]")
+    if options.get("auto_crop") and (options.get("box") or shape == "poligono"):
+        raise ValueError("auto_crop no se puede combinar con box ni con la forma poligono")
+    if options.get("trim") is not None and (options.get("box") or options.get("auto_crop") or shape == "poligono"):
+        raise ValueError("trim no se puede combinar con box, auto_crop ni la forma poligono")
+    options["file_format"] = normalize_format(options.get("file_format"))
+    if isinstance(options.get("memory_budget"), str):
+        options["memory_budget"] = memory.parse_size(options["memory_budget"])
+    if options.get("renditions"):
+        options["renditions"] = [export.parse_rendition(r) for r in options["renditions"]]
+    return make_spec(**options)
+
+def _unique_path(directory, name):
+    """Ruta libre para `name` en el directorio, añadiendo -1, -2... si ya existe."""
+    path = os.path.join(directory, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, numbered_name(name, counter))
+        counter += 1
+    return path
+
+def _move(path, directory):
+    target = _unique_path(directory, os.path.basename(path))
+    shutil.move(path, target)
+    return target
+
+def _ignore_interrupt():
+    # Ctrl+C stops the watcher, which lets the workers finish what they have
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class HotFolder:
+    """Vigila una carpeta y recorta con un preajuste cada imagen que llega."""
+
+    def __init__(self, inbox, output_dir, spec, done_dir=None, failed_dir=None, workers=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True, on_result=None):
+        self.inbox = inbox
+        self.output_dir = output_dir
+        self.spec = spec
+        self.done_dir = done_dir or os.path.join(inbox, DONE_DIR)
+        self.failed_dir = failed_dir or os.path.join(inbox, FAILED_DIR)
+        for directory in (output_dir, self.done_dir, self.failed_dir):
+            if os.path.abspath(directory) == os.path.abspath(inbox):
+                raise ValueError(f"{directory} no puede ser la propia carpeta vigilada")
+        self.workers = workers or os.cpu_count() or 1
+        self.budget = spec.get('memory_budget')
+        if self.budget:
+            self.workers = max(1, min(self.workers, self.budget // memory.WORKER_OVERHEAD))
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.on_result = on_result
+        if tracing.is_enabled():
+            self.spec = dict(spec, trace=True)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        # One queued task per worker keeps every process busy between files
+        self.slots = threading.Semaphore(self.workers * 2)
+        self.memory = threading.Condition()
+        self.reserved = 0
+        self.in_flight = 0
+        # Paths queued or being processed: rescans must not pick them up again
+        self.claimed = set()
+        # Output keys of the files being processed (see batch.output_key)
+        self.outputs = set()
+        self.attempts = {}
+        # Set when a released file must be found again by the watcher
+        self.rescan = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {'processed': 0, 'failed': 0}
+        self.started = None
+        self.stop_event = None
+        self.watcher = open_watcher(inbox, poll_interval, use_inotify)
+
+    def run(self, stop_event=None):
+        """Vigila la carpeta hasta que se activa stop_event (o hasta Ctrl+C)."""
+        stop_event = self.stop_event = stop_event or threading.Event()
+        for directory in (self.output_dir, self.done_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.started = time.perf_counter()
+
+        dispatcher = threading.Thread(target=self._dispatch, args=(stop_event,), name="despacho", daemon=True)
+        dispatcher.start()
+        try:
+            self._watch(stop_event)
+        finally:
+            stop_event.set()
+            dispatcher.join()
+            self.watcher.close()
+        return self.stats
+
+    def _watch(self, stop_event):
+        tracker = WriteTracker(self.settle)
+        rescan = True  # Files already in the inbox when starting
+        while not stop_event.is_set():
+            if rescan:
+                with os.scandir(self.inbox) as entries:
+                    for entry in entries:
+                        if entry.is_file() and is_candidate(entry.path):
+                            self._track(tracker, entry.path)
+            # Wake up often enough to notice files settling
+            timeout = self.settle / 2 if len(tracker) else self.poll_interval
+            events = self.watcher.read(timeout)
+            rescan = events is None or self.rescan.is_set()
+            self.rescan.clear()
+            for path, closed in events or ():
+                if is_candidate(path):
+                    self._track(tracker, path, closed)
+            for path in tracker.pop_ready():
+                if not self._enqueue(path, stop_event):
+                    return
+                # The inbox was not watched while the queue was full
+                rescan = rescan or self.queue.full()
+
+    def _track(self, tracker, path, closed=False):
+        with self.lock:
+            if path in self.claimed:
+                return
+        tracker.touch(path, closed)
+
+    def _enqueue(self, path, stop_event):
+        """Pone un archivo en la cola, esperando mientras esté llena. False si hay que parar."""
+        with self.lock:
+            if path in self.claimed:
+                return True
+            self.claimed.add(path)
+        while not stop_event.is_set():
+            try:
+                self.queue.put(path, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _new_executor(self):
+        # Workers are started from the dispatcher thread while others run: forking
+        # there can copy a held lock into the child, so they come from a fork server
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_ignore_interrupt)
+
+    def _dispatch(self, stop_event):
+        executor = self._new_executor()
+        try:
+            while not stop_event.is_set():
+                if not self.slots.acquire(timeout=0.5):
+                    continue
+                try:
+                    path = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    self.slots.release()
+                    continue
+                reserve = name = None
+                try:
+                    reserve = self._reserve(path, stop_event)
+                    if reserve is None:
+                        self.slots.release()
+                        self._release(path)
+                        return
+                    name = self._claim_output(path)
+                    try:
+                        future = executor.submit(process_chunk, [(path, name)], self.spec, self.output_dir)
+                    except BrokenProcessPool:
+                        # A worker died; the files it took down are retried by _finished
+                        executor.shutdown(wait=False)
+                        executor = self._new_executor()
+                        future = executor.submit(process_chunk, [(path, name)], self.spec, self.output_dir)
+                except Exception as e:
+                    # Never lose the dispatcher: the file fails like one whose worker
+                    # died (retried, then moved aside) and a fresh pool takes over
+                    print(f"Error al enviar {path}: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
+                    if isinstance(e, (BrokenProcessPool, RuntimeError)):
+                        executor.shutdown(wait=False)
+                        executor = self._new_executor()
+                    future = Future()
+                    future.set_exception(e)
+                future.add_done_callback(
+                    lambda f, path=path, name=name, reserve=reserve: self._finished(path, name, reserve, f)
+                )
+        finally:
+            # Files already submitted are finished before returning
+            executor.shutdown(wait=True)
+
+    def _release(self, path):
+        """Devuelve un archivo a la carpeta: el vigilante lo volverá a encontrar."""
+        with self.lock:
+            self.claimed.discard(path)
+        self.rescan.set()
+
+    def _claim_output(self, path):
+        """Nombre de salida libre para un archivo, con -1, -2... si ya hay un recorte con el suyo.
+
+        Así un archivo que vuelve a llegar con el mismo nombre no sobrescribe el
+        recorte del anterior, igual que su original no sobrescribe el archivado.
+        """
+        base = os.path.basename(path)
+        name = base
+        counter = 1
+        with self.lock:
+            while output_key(name, self.spec) in self.outputs or any(
+                    os.path.exists(p) for p in output_paths_for(path, self.output_dir, self.spec, name)):
+                name = numbered_name(base, counter)
+                counter += 1
+            self.outputs.add(output_key(name, self.spec))
+        return name
+
+    def _reserve(self, path, stop_event):
+        """Reserva la memoria estimada de un archivo dentro del presupuesto; None si hay que parar."""
+        if not self.budget:
+            return 0
+        reserve = min(self.budget, memory.WORKER_OVERHEAD + estimate_file_memory(path, self.spec))
+        with self.memory:
+            # A file that only fits alone waits until nothing else is running
+            while self.in_flight and self.reserved + reserve > self.budget:
+                if stop_event.is_set():
+                    return None
+                self.memory.wait(0.5)
+            self.reserved += reserve
+            self.in_flight += 1
+        return reserve
+
+    def _finished(self, path, name, reserve, future):
+        retry = False
+        try:
+            results, events = future.result()
+            tracing.add_events(events)
+            _, error, _, _ = results[0]
+        except Exception as e:
+            # The worker process died (killed by the OOM killer, for example). Every
+            # file in flight fails with it, so each one gets another chance.
+            error = f"{type(e).__name__}: {e}"
+            with self.lock:
+                attempts = self.attempts[path] = self.attempts.get(path, 0) + 1
+            # Workers killed while stopping leave their files for the next run
+            retry = attempts < MAX_ATTEMPTS or self.stop_event.is_set()
+        if self.budget and reserve is not None:
+            with self.memory:
+                self.reserved -= reserve
+                self.in_flight -= 1
+                self.memory.notify_all()
+        self.slots.release()
+        if name is not None:
+            with self.lock:
+                # Written by now, or not at all: the name is found on disk from here on
+                self.outputs.discard(output_key(name, self.spec))
+        if retry:
+            self._release(path)
+            return
+
+        try:
+            if error:
+                target = _move(path, self.failed_dir)
+                with atomic_write(target + ".txt") as f:
+                    f.write((error + "\n").encode("utf-8"))
+            else:
+                _move(path, self.done_dir)
+            with self.lock:
+                self.claimed.discard(path)
+                self.attempts.pop(path, None)
+        except OSError as e:
+            # Left in the inbox and still claimed, so it is not retried in a loop
+            error = error or f"No se pudo mover el original: {e}"
+        with self.lock:
+            self.stats['failed' if error else 'processed'] += 1
+        if self.on_result:
+            self.on_result(path, error)
+
+def format_stats(stats, elapsed):
+    """Formatea el resumen de una sesión de vigilancia."""
+    total = stats['processed'] + stats['failed']
+    rate = total / elapsed if elapsed > 0 else 0.0
+    return (f"Procesadas: {stats['processed']}  Fallidas: {stats['failed']}  "
+            f"Tiempo: {elapsed:.1f} s  ({rate:.1f} imágenes/s)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Recorta automáticamente las imágenes que llegan a una carpeta.")
+    parser.add_argument("inbox", help="Carpeta vigilada")
+    parser.add_argument("-o", "--output", required=True, help="Directorio de los recortes")
+    parser.add_argument("--preset", required=True, help="Preajuste JSON con las opciones de recorte")
+    parser.add_argument("--done", help=f"Directorio para los originales procesados (por defecto, {DONE_DIR}/ en la carpeta)")
+    parser.add_argument("--failed", help=f"Directorio para los originales que fallan (por defecto, {FAILED_DIR}/ en la carpeta)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Imágenes listas que pueden esperar antes de dejar de leer la carpeta")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help="Segundos sin cambios para dar un archivo por escrito")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Segundos entre recorridos de la carpeta cuando no hay inotify")
+    parser.add_argument("--poll", dest="use_inotify", action="store_false",
+                        help="Recorre la carpeta periódicamente aunque haya inotify (p. ej. en carpetas de red)")
+    parser.add_argument("--memory-budget", type=parse_memory_budget, metavar="TAMAÑO",
+                        help="Memoria máxima, p. ej. 2G; sustituye a la del preajuste")
+    parser.add_argument("--trace", metavar="ARCHIVO",
+                        help="Guarda una traza de tiempos para chrome://tracing o Perfetto "
+                             f"(también con la variable {tracing.TRACE_ENV})")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.inbox):
+        print(f"No existe la carpeta {args.inbox}", file=sys.stderr)
+        return 2
+    try:
+        spec = load_preset(args.preset)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Preajuste no válido: {e}", file=sys.stderr)
+        return 2
+    if args.memory_budget:
+        spec['memory_budget'] = args.memory_budget
+    trace_path = args.trace or os.environ.get(tracing.TRACE_ENV)
+    if trace_path:
+        # No path for tracing itself: the trace is saved once, when the watcher stops
+        tracing.enable()
+
+    def report(path, error):
+        if error:
+            print(f"Error en {path}: {error}", file=sys.stderr, flush=True)
+        else:
+            print(f"Recortada: {path}", flush=True)
+
+    try:
+        hot_folder = HotFolder(args.inbox, args.output, spec, args.done, args.failed, args.workers,
+                               args.queue_size, args.settle, args.poll_interval, args.use_inotify, report)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    mode = "inotify" if isinstance(hot_folder.watcher, InotifyWatcher) else "sondeo"
+    print(f"Vigilando {args.inbox} ({mode}, {hot_folder.workers} procesos). Ctrl+C para terminar.", flush=True)
+    stop_event = threading.Event()
+    # A service manager stops the watcher with SIGTERM; it ends like with Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        hot_folder.run(stop_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if trace_path:
+            tracing.save(trace_path)
+    print(format_stats(hot_folder.stats, time.perf_counter() - hot_folder.started))
+    if trace_path:
+        print(f"Traza guardada en {trace_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())